@@ -1,7 +1,7 @@
 # initialization file, a bunch of imports and stuff
 
 import os
-from flask import Flask, request
+from flask import Flask, request, g
 from config import Config
 from flask_babel import Babel, _
 from flask_babel import lazy_gettext as _l
@@ -24,6 +24,27 @@ mysql = MySQL()
 mysql.init_app(application)
 #conn = mysql.connect()
 
+# connection pool, one per worker process; size it to the number of threads per gunicorn worker
+from application.pool import ConnectionPool
+application.config.update(
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5)),
+    DB_POOL_MAX_LIFETIME = int(os.getenv('DB_POOL_MAX_LIFETIME', 3600)), # seconds before a connection is recycled
+    DB_POOL_PING_AFTER = int(os.getenv('DB_POOL_PING_AFTER', 30)), # idle seconds before a health check
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10)) # seconds to wait for a free connection
+)
+pool = ConnectionPool(mysql.connect,
+                      size = application.config['DB_POOL_SIZE'],
+                      max_lifetime = application.config['DB_POOL_MAX_LIFETIME'],
+                      ping_after = application.config['DB_POOL_PING_AFTER'],
+                      timeout = application.config['DB_POOL_TIMEOUT'])
+
+# return the connection borrowed by this request (if any) to the pool
+@application.teardown_appcontext
+def release_db_connection(exception):
+    pooled = g.pop('db_conn', None)
+    if pooled is not None:
+        pool.release(pooled)
+
 # multi-language support
 babel = Babel(application)
 @babel.localeselector
@@ -39,6 +60,8 @@ login_manager.login_message = _l("Please log in to access this page.")
 login_manager.needs_refresh_message = _l("Please reauthenticate to view this page.")
 
 # this import needs to come at the end, don't touch; later the other imported files will also be here
+from application import metrics
 from application import db
 from application import routes
 from application import models
+from application import cli
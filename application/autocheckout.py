@@ -0,0 +1,30 @@
+# nightly auto-checkout: check-ins still open at the end of a clubhouse's local day are closed at midnight
+# run periodically with `flask auto-checkout --every 900` (see Procfile); each run closes whatever is
+# left over from before every clubhouse's last local midnight, so runs can be repeated or missed safely
+
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from application import application
+from .db import get_clubhouse_time_zones, auto_checkout_clubhouse
+
+# start of the current day in time_zone (an IANA name such as 'America/Chicago'), as a naive server-local
+# datetime like the ones stored in checkins; unknown or missing time zones use the server's
+def local_day_start(time_zone, now=None):
+    now = (now or datetime.now()).astimezone()
+    zone = None
+    if time_zone:
+        try:
+            zone = ZoneInfo(time_zone)
+        except (ZoneInfoNotFoundError, ValueError):
+            application.logger.warning("unknown time zone %r, using server time", time_zone)
+    local = now.astimezone(zone) if zone else now
+    midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.astimezone().replace(tzinfo=None)
+
+# close yesterday's open check-ins in every clubhouse (or one): returns [(clubhouse id, cutoff, check-ins closed)]
+def sweep(clubhouse_id=None, now=None):
+    results = []
+    for club_id, time_zone in get_clubhouse_time_zones(clubhouse_id):
+        cutoff = local_day_start(time_zone, now)
+        results.append((club_id, cutoff, auto_checkout_clubhouse(club_id, cutoff)))
+    return results
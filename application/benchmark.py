@@ -0,0 +1,485 @@
+# end-to-end benchmark, run with `flask benchmark` (see cli.py) against a database filled by `flask seed`
+# drives the real routes through the Flask test client and reports per-route latency percentiles,
+# queries per request (from metrics.py) and peak RSS; results are saved as JSON so runs can be compared
+
+import contextvars
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from application import application, metrics, checkinqueue
+from .cache import plot_cache
+from .db import get_conn, get_clubhouse_roster, add_checkin, add_checkout, delete_clubhouse
+from . import roster
+from .roster import invalidate_roster
+from .seed import SEED_PASSWORD, HOUR_WEIGHTS, seed_clubhouse, checkin_rows
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def log_in(username, password):
+    client = application.test_client()
+    response = client.post('/login', data={'user': username, 'password': password})
+    if response.status_code != 302 or '/login' in response.headers.get('Location', ''):
+        raise RuntimeError("could not log in as %s" % username)
+    return client
+
+# the check-in page marks the session stale, the other pages need it fresh
+def refresh(client, **values):
+    with client.session_transaction() as session:
+        session['fresh'] = True
+        session.update(values)
+
+class Benchmark:
+    # cold clears the plot cache before every request, so view routes always aggregate and render
+    def __init__(self, iterations, cold=False):
+        self.iterations = iterations
+        self.cold = cold
+        self.results = {}
+        self.last = None
+        metrics.observers.append(self.observe)
+
+    def observe(self, summary):
+        self.last = summary
+
+    def close(self):
+        metrics.observers.remove(self.observe)
+
+    # call request(i) iterations times, request returns a response
+    def measure(self, name, request):
+        latencies, queries, db_ms = [], [], []
+        for i in range(self.iterations):
+            self.last = None
+            if self.cold:
+                plot_cache.clear()
+            started = time.perf_counter()
+            response = request(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError("%s returned %d" % (name, response.status_code))
+            if self.last:
+                queries.append(self.last['queries'])
+                db_ms.append(self.last['db_ms'])
+        self.results[name] = {
+            'requests': self.iterations,
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'queries_per_request': round(sum(queries) / max(len(queries), 1), 2),
+            'max_queries': max(queries or [0]),
+            'db_ms_per_request': round(sum(db_ms) / max(len(db_ms), 1), 2),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        return self.results[name]
+
+# run every route; progress(name, result) is called after each one
+# runs in an empty context: under `flask benchmark` an app context is already active, and requests would
+# otherwise share its flask.g (and the logged-in user cached there) instead of getting their own
+def run(iterations=100, club_user='seed-club-1', admin_user='seed-admin', password=SEED_PASSWORD, cold=False, progress=None):
+    return contextvars.Context().run(run_routes, iterations, club_user, admin_user, password, cold, progress)
+
+def run_routes(iterations, club_user, admin_user, password, cold, progress):
+    application.config['WTF_CSRF_ENABLED'] = False
+    bench = Benchmark(iterations, cold)
+    try:
+        coord = log_in(club_user, password)
+        with coord.session_transaction() as session:
+            club_id = session['club_id']
+        with application.app_context():
+            member_ids = [row[0] for row in get_clubhouse_roster(club_id) if not row[3]][:max(iterations, 1)]
+        if not member_ids:
+            raise RuntimeError("clubhouse %s has no checked-out members, run flask seed first" % club_id)
+        formats = ['0', '1', '2', '3', '4']
+        ranges = ['1', '7', '30', '365']
+        admin = log_in(admin_user, password)
+
+        def view_data(client, url):
+            return lambda i: client.get('%s?range=%s&format=%s' % (url, ranges[i % 4], formats[i % 5]))
+
+        def view_plot(client, url):
+            return lambda i: client.post(url, data={'range': ranges[i % 4], 'format': formats[i % 5]})
+
+        def edit_member(i):
+            refresh(coord, edit_member_id=member_ids[i % len(member_ids)])
+            return coord.get('/clubhouse/editmember')
+
+        # check a member in, then out again on the next iteration
+        def check_in_out(i):
+            member_id = member_ids[(i // 2) % len(member_ids)]
+            if i % 2 == 0:
+                return coord.post('/clubhouse/checkin', data={'check_in': 'Check In', 'check_in_id': member_id})
+            return coord.post('/clubhouse/checkin', data={'check_out': 'Check Out', 'check_out_id': member_id})
+
+        steps = [
+            ('clubhouse/view (json)', view_data(coord, '/clubhouse/view/data')),
+            ('clubhouse/view (server plot)', view_plot(coord, '/clubhouse/view')),
+            ('admin/view (json)', view_data(admin, '/admin/view/data')),
+            ('admin/view (server plot)', view_plot(admin, '/admin/view')),
+            ('clubhouse/editmember', edit_member),
+            ('clubhouse/checkin (page)', lambda i: coord.get('/clubhouse/checkin')),
+            ('clubhouse/checkin (check in/out)', check_in_out),
+        ]
+        for name, request in steps:
+            refresh(coord)
+            result = bench.measure(name, request)
+            if progress:
+                progress(name, result)
+    finally:
+        bench.close()
+    return bench.results
+
+### roster queries by clubhouse size (flask benchmark-roster)
+
+# queries per request of the check-in page (with the roster loaded from the database, as on the first
+# request after a change) and of a mass checkout, for a temporary clubhouse of each size in sizes with
+# a tenth of its members checked in; the clubhouses are removed afterwards
+# returns {size: {'checkin page': queries, 'mass checkout': queries}}, the counts should not grow with size
+def roster_queries(sizes=(50, 500, 5000), iterations=3, progress=None):
+    return contextvars.Context().run(run_roster_queries, sizes, iterations, progress)
+
+def run_roster_queries(sizes, iterations, progress):
+    from werkzeug.security import generate_password_hash
+    application.config['WTF_CSRF_ENABLED'] = False
+    password = generate_password_hash(SEED_PASSWORD)
+    today = datetime.now().date()
+    bench = Benchmark(iterations)
+    results = {}
+    try:
+        for size in sizes:
+            with application.app_context():
+                conn = get_conn()
+                cursor = conn.cursor()
+                club_id, created = seed_clubhouse(cursor, conn, random.Random(size), "bench-roster-%d" % size,
+                                                  "Roster %d" % size, password, size, today, today)
+                cursor.close()
+                for member_id, first, last, checked_in in get_clubhouse_roster(club_id)[::10]:
+                    add_checkin(member_id, club_id)
+            try:
+                coord = log_in("bench-roster-%d" % size, SEED_PASSWORD)
+
+                def page(i):
+                    with application.app_context():
+                        invalidate_roster(club_id)
+                    return coord.get('/clubhouse/checkin')
+
+                def checkout(i):
+                    refresh(coord)
+                    return coord.get('/clubhouse/checkout')
+
+                results[size] = {
+                    'checkin page': bench.measure('checkin page (%d members)' % size, page)['max_queries'],
+                    'mass checkout': bench.measure('mass checkout (%d members)' % size, checkout)['max_queries'],
+                }
+            finally:
+                with application.app_context():
+                    delete_clubhouse(club_id)
+            if progress:
+                progress(size, results[size])
+    finally:
+        bench.close()
+    return results
+
+### user cache (flask benchmark-user-cache)
+
+# queries per request of a page that only needs the logged-in user, loading the user on every request
+# (as without ROSTER_REDIS_URL) and with the user cache; without redis the cache runs on LocalVersions,
+# as it would in a single process; returns {mode: queries per request}
+def user_cache_queries(iterations=50, club_user='seed-club-1', password=SEED_PASSWORD):
+    return contextvars.Context().run(run_user_cache_queries, iterations, club_user, password)
+
+def run_user_cache_queries(iterations, club_user, password):
+    from application import cache
+    saved = cache.shared_versions
+    bench = Benchmark(iterations)
+    results = {}
+    try:
+        client = log_in(club_user, password)
+        for mode, versions in (('uncached', None), ('cached', saved or cache.LocalVersions())):
+            cache.shared_versions = versions
+            cache.user_cache.clear()
+            results[mode] = bench.measure('clubhouse home (%s)' % mode, lambda i: client.get('/clubhouse'))['queries_per_request']
+    finally:
+        cache.shared_versions = saved
+        bench.close()
+    return results
+
+### roster bursts (flask benchmark-roster-burst)
+# the after-school rush on one kiosk worker: members of a large clubhouse tap in and out one after the
+# other, and every tap is followed by a check-in page render (is_checked_in and the first page of both
+# lists); runs in memory on LocalRosterBackend, no database needed
+
+# counts the backend calls made through it
+class CountingBackend:
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        def counted(*args):
+            self.calls[name] += 1
+            return method(*args)
+        return counted
+
+# returns taps per second, p50/p99 microseconds per tap and per render, and the backend calls made
+def roster_burst(members=5000, taps=5000, seed=1):
+    from .search import PAGE_SIZE
+    rng = random.Random(seed)
+    rows = sorted(((n, "First%d" % n, "Last%05d" % rng.randrange(100000), rng.random() < 0.2) for n in range(1, members + 1)),
+                  key=lambda row: (row[2], row[1]))
+    saved_backend, saved_rosters = roster.backend, roster.rosters
+    roster.backend = counting = CountingBackend(roster.LocalRosterBackend())
+    roster.rosters = {}
+    club_id = -1 # not a real clubhouse
+    tap_us, render_us = [], []
+    try:
+        members_roster = roster.get_roster(club_id, lambda club_id: rows)
+        members_roster.lists(PAGE_SIZE + 1)
+        counting.calls.clear()
+        started = time.perf_counter()
+        for i in range(taps):
+            member_id = str(rng.randrange(1, members + 1))
+            tapped = time.perf_counter()
+            roster.roster_mark(club_id, member_id, not members_roster.is_checked_in(member_id))
+            rendered = time.perf_counter()
+            members_roster.is_checked_in(member_id)
+            members_roster.lists(PAGE_SIZE + 1)
+            done = time.perf_counter()
+            tap_us.append((rendered - tapped) * 1e6)
+            render_us.append((done - rendered) * 1e6)
+        elapsed = time.perf_counter() - started
+    finally:
+        roster.backend, roster.rosters = saved_backend, saved_rosters
+    return {
+        'members': members,
+        'taps': taps,
+        'taps_per_second': round(taps / elapsed, 1),
+        'tap_p50_us': round(percentile(tap_us, 0.50), 1),
+        'tap_p99_us': round(percentile(tap_us, 0.99), 1),
+        'render_p50_us': round(percentile(render_us, 0.50), 1),
+        'render_p99_us': round(percentile(render_us, 0.99), 1),
+        'backend_calls': dict(counting.calls),
+    }
+
+### plot engine at scale (flask benchmark-engine)
+# the 365-day views computed from raw check-in rows, once with the per-row loops plot.py had before the
+# bucketing engine and once with the engine's vectorized operations, on rows from the seed generator
+
+# rows (member id, check-in, check-out, clubhouse id) as `flask seed` would insert them, count of them
+# spread over the year before now
+def engine_rows(count, seed=1, now=None):
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(second=0, microsecond=0)
+    hours = [hour for hour, weight in HOUR_WEIGHTS]
+    hour_weights = []
+    for hour, weight in HOUR_WEIGHTS:
+        hour_weights.append(weight + (hour_weights[-1] if hour_weights else 0))
+    rows = []
+    member_id = 0
+    while len(rows) < count:
+        member_id += 1
+        joined = (now - timedelta(days=rng.randrange(365))).date()
+        for member, checkin, checkout in checkin_rows(rng, member_id, joined, now, hours, hour_weights):
+            rows.append((member, checkin, checkout.replace(microsecond=0), 1)) # DATETIME keeps whole seconds
+    return rows[:count], now
+
+# the loops, one pass per view like the old plot_checkins, plot_timeofday, plot_dayofweek, avg_stats
+# and plot_by_member
+def loop_views(rows, now):
+    start = now - timedelta(days=365)
+    current_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    counts = {}
+    hours_per_day = {}
+    for i in range(366):
+        counts[current_day - timedelta(days=i)] = 0
+        hours_per_day[current_day - timedelta(days=i)] = 0
+    max_y = 0
+    for member_id, checkin, checkout, clubhouse_id in rows:
+        if checkin < start:
+            continue
+        day = checkin.replace(hour=0, minute=0, second=0, microsecond=0)
+        if day in counts.keys():
+            counts[day] = counts[day] + 1
+            max_y = max(max_y, counts[day])
+    timeofday = {}
+    for hour in range(24):
+        timeofday[hour] = 0
+    for member_id, checkin, checkout, clubhouse_id in rows:
+        if checkin < start:
+            continue
+        timeofday[checkin.hour] = timeofday[checkin.hour] + 1
+    dayofweek = [0, 0, 0, 0, 0, 0, 0]
+    for member_id, checkin, checkout, clubhouse_id in rows:
+        if checkin < start:
+            continue
+        dayofweek[checkin.weekday()] = dayofweek[checkin.weekday()] + 1
+    num_checkins = 0
+    num_hours = 0
+    for member_id, checkin, checkout, clubhouse_id in rows:
+        if checkin < start:
+            continue
+        num_checkins = num_checkins + 1
+        if checkout == None:
+            checkout = now
+        num_hours = num_hours + (checkout - checkin).total_seconds() / 3600
+    for member_id, checkin, checkout, clubhouse_id in rows:
+        if checkin < start:
+            continue
+        if checkout == None:
+            checkout = now
+        day = checkin.replace(hour=0, minute=0, second=0, microsecond=0)
+        if day in hours_per_day:
+            hours_per_day[day] = hours_per_day[day] + (checkout - checkin).total_seconds() / 3600
+    return {
+        'checkins': [counts[day] for day in sorted(counts)],
+        'timeofday': [timeofday[hour] for hour in range(24)],
+        'dayofweek': dayofweek,
+        'stats': (num_checkins, num_hours),
+        'hours_per_day': [hours_per_day[day] for day in sorted(hours_per_day)],
+    }
+
+EPOCH = datetime(1970, 1, 1)
+
+# the rows as datetime64 columns, once; seconds since the epoch convert far faster than datetime objects
+def engine_columns(rows, now):
+    import numpy as np
+    checkin = np.fromiter(((row[1] - EPOCH).total_seconds() for row in rows), dtype=np.int64, count=len(rows))
+    checkout = np.fromiter((((row[2] or now) - EPOCH).total_seconds() for row in rows), dtype=np.int64, count=len(rows))
+    return checkin.astype('datetime64[s]'), checkout.astype('datetime64[s]')
+
+# every view in one vectorized pass over the columns, with plot.py's scatter and distribution
+def engine_views(checkin, checkout, now):
+    import numpy as np
+    from application import plot
+    axis, start, current = plot.bucket_axis('365', now)
+    recent = checkin >= np.datetime64(now - plot.delta['365'], 's')
+    checkin, checkout = checkin[recent], checkout[recent]
+    ones = np.ones(len(checkin))
+    days = checkin.astype('datetime64[D]')
+    day_keys = days.astype('datetime64[s]')
+    stays = (checkout - checkin).astype(float) / 3600
+    return {
+        'checkins': plot.scatter(axis, day_keys, ones).tolist(),
+        'timeofday': plot.distribution((checkin - day_keys).astype(int) // 3600, ones, 24).tolist(),
+        'dayofweek': plot.distribution((days.astype(int) + 3) % 7, ones, 7).tolist(), # 1970-01-01 was a Thursday
+        'stats': (len(checkin), float(stays.sum())),
+        'hours_per_day': plot.scatter(axis, day_keys, stays).tolist(),
+    }
+
+# best of `repeat` timings of each implementation on `count` rows, and whether their results agree
+def compare_engine(count=1000000, repeat=3, seed=1):
+    import numpy as np
+    rows, now = engine_rows(count, seed)
+    timings = {'loops': [], 'engine (columns)': [], 'engine (views)': []}
+    for _ in range(repeat):
+        started = time.perf_counter()
+        expected = loop_views(rows, now)
+        timings['loops'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        checkin, checkout = engine_columns(rows, now)
+        timings['engine (columns)'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        views = engine_views(checkin, checkout, now)
+        timings['engine (views)'].append(time.perf_counter() - started)
+    agree = all(np.allclose(np.array(views[name], dtype=float), np.array(expected[name], dtype=float))
+                for name in expected)
+    return {
+        'rows': len(rows),
+        'seconds': {name: round(min(times), 3) for name, times in timings.items()},
+        'agree': agree,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(application.root_path)).stdout.strip() or None
+    except OSError:
+        return None
+
+# write results to directory/<time>-<revision>.json, returns the path
+def save(results, directory, iterations, cold=False):
+    os.makedirs(directory, exist_ok=True)
+    revision = git_revision()
+    started = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, "%s-%s.json" % (started, revision or 'unknown'))
+    with open(path, 'w') as output:
+        json.dump({'revision': revision, 'time': started, 'python': platform.python_version(),
+                   'iterations': iterations, 'cold': cold, 'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   'routes': results}, output, indent=2)
+    return path
+
+def load(path):
+    with open(path) as saved:
+        return json.load(saved)['routes']
+
+### check-in throughput (flask benchmark-checkins)
+
+# check members of club_id in and out from several threads, `threads` at a time like kiosks, calling
+# db.add_checkin/add_checkout directly; each member is checked in and then out again, so every call writes
+# with queue_path, the write-behind queue is used (see checkinqueue.py) and the time until everything is
+# in MySQL is measured too; returns the acknowledged and stored events per second and the latency per call
+def checkin_throughput(club_id, events=2000, threads=4, queue_path=None):
+    return contextvars.Context().run(run_checkins, club_id, events, threads, queue_path)
+
+def run_checkins(club_id, events, threads, queue_path):
+    with application.app_context():
+        member_ids = [row[0] for row in get_clubhouse_roster(club_id) if not row[3]]
+    if len(member_ids) < threads:
+        raise RuntimeError("clubhouse %s needs at least %d checked-out members, run flask seed first" % (club_id, threads))
+    saved_path = application.config['CHECKIN_QUEUE_PATH']
+    application.config['CHECKIN_QUEUE_PATH'] = queue_path
+    checkinqueue.checkin_queue = None
+    latencies = []
+
+    def kiosk(members, count):
+        timings = []
+        with application.app_context():
+            for i in range(count):
+                member_id = members[(i // 2) % len(members)]
+                started = time.perf_counter()
+                (add_checkin if i % 2 == 0 else add_checkout)(member_id, club_id)
+                timings.append((time.perf_counter() - started) * 1000)
+        latencies.extend(timings)
+
+    try:
+        per_thread = (events // threads) & ~1 # even, every member ends checked out
+        workers = [threading.Thread(target=kiosk, args=(member_ids[n::threads], per_thread)) for n in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        acked = time.perf_counter() - started
+        stored = acked
+        if queue_path:
+            with application.app_context():
+                checkinqueue.get_checkin_queue().drain(timeout=600)
+            stored = time.perf_counter() - started
+    finally:
+        application.config['CHECKIN_QUEUE_PATH'] = saved_path
+        checkinqueue.checkin_queue = None
+    total = per_thread * threads
+    return {
+        'events': total,
+        'threads': threads,
+        'acked_per_second': round(total / acked, 1),
+        'stored_per_second': round(total / stored, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+    }
+
+# run checkin_throughput without and with the write-behind queue (in a temporary directory)
+def compare_checkins(club_id, events=2000, threads=4):
+    results = {'direct': checkin_throughput(club_id, events, threads)}
+    with tempfile.TemporaryDirectory() as directory:
+        results['write-behind'] = checkin_throughput(club_id, events, threads, os.path.join(directory, 'checkins.sqlite'))
+    return results
@@ -0,0 +1,133 @@
+# small in-process caches, one set per worker
+
+import threading
+import time
+from collections import OrderedDict
+from application import application
+
+# dictionary with a time-to-live per entry and a least-recently-used size limit
+class TTLCache:
+    def __init__(self, ttl=300, maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict() # key -> (expiry, value), most recently used last
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    # return the cached value or None
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            expiry, value = entry
+            if expiry < time.monotonic():
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    # drop every entry for which predicate(key, value) is true
+    def invalidate(self, predicate):
+        with self._lock:
+            stale = [key for key, (expiry, value) in self._entries.items() if predicate(key, value)]
+            for key in stale:
+                del self._entries[key]
+            self._stats['invalidations'] += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['maxsize'] = self.maxsize
+        return stats
+
+# rendered plot HTML and JSON series keyed by (club_id, member_id, time_range, data_format), club_id None is the network view
+# writes for a clubhouse invalidate its entries in this worker, other workers and the network view rely on the TTL
+plot_cache = TTLCache(application.config['PLOT_CACHE_TTL'], application.config['PLOT_CACHE_SIZE'])
+
+# called by the db.py write helpers
+def invalidate_club_plots(club_id):
+    plot_cache.invalidate(lambda key, html: key[0] == club_id)
+
+# authenticated User objects keyed by login id, saves the login lookup on every request (see models.load_user)
+# they hold no password hash (check_password reads it fresh). password changes, clubhouse edits and removals
+# must reach every worker at once, so users are only cached with a shared invalidation counter: ROSTER_REDIS_URL's
+# redis, where every invalidation bumps USERS_VERSION and a cached user is used only while it is unchanged
+# (one redis GET per request instead of a MySQL query); without redis users are loaded on every request
+user_cache = TTLCache(application.config['USER_CACHE_TTL'], application.config['USER_CACHE_SIZE'])
+USERS_VERSION = 'users:version'
+
+# single-process stand-in for the redis counter, for tests and benchmarks
+class LocalVersions:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+if application.config['ROSTER_REDIS_URL']:
+    import redis # optional dependency, like the roster backend
+    shared_versions = redis.Redis.from_url(application.config['ROSTER_REDIS_URL'], decode_responses=True)
+else:
+    shared_versions = None
+
+# current invalidation counter, None when users can't be cached
+def users_version():
+    if shared_versions is None:
+        return None
+    try:
+        return int(shared_versions.get(USERS_VERSION) or 0)
+    except Exception:
+        application.logger.exception("could not read the user cache version, loading the user")
+        return None
+
+# returns (cached user or None, version to cache a freshly loaded user under)
+def cached_user(user_id):
+    version = users_version()
+    if version is None:
+        return None, None
+    entry = user_cache.get(user_id)
+    if entry is None or entry[0] != version:
+        return None, version
+    return entry[1], version
+
+def cache_user(user_id, user, version):
+    if version is not None:
+        user_cache.set(user_id, (version, user))
+
+# every worker drops its cached users on its next request
+def bump_users_version():
+    if shared_versions is not None:
+        try:
+            shared_versions.incr(USERS_VERSION)
+        except Exception:
+            application.logger.exception("could not invalidate cached users in other workers")
+
+def invalidate_user(user_id):
+    user_cache.invalidate(lambda key, entry: key == user_id)
+    bump_users_version()
+
+def invalidate_club_users(club_id):
+    user_cache.invalidate(lambda key, entry: entry[1].club_id == club_id)
+    bump_users_version()
@@ -0,0 +1,164 @@
+# optional write-behind for check-ins and check-outs, enabled by CHECKIN_QUEUE_PATH
+# a tap is acknowledged as soon as its event is in a local SQLite queue (WAL with synchronous=FULL, so it
+# survives a crash or power loss); a flusher thread moves queued events to MySQL in batches of up to
+# CHECKIN_QUEUE_BATCH, each batch one transaction (db.apply_checkin_events). events that arrive while a
+# batch is being written simply wait for the next one, so a burst or a slow database makes batches
+# bigger instead of making kiosks wait
+# every worker on the host shares the queue file, only the worker holding its lock file flushes; events
+# are deleted after their batch commits, so after a crash the last batch may be applied twice, which
+# apply_checkin_events turns into a no-op; it also checks every event against what MySQL has stored, since
+# the roster that accepted the tap may have been out of date
+
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from application import application
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS events (
+  event_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+  clubhouse_id  INTEGER NOT NULL,
+  member_id     INTEGER NOT NULL,
+  checked_in    INTEGER NOT NULL,
+  event_time    TEXT NOT NULL
+)"""
+
+class CheckinQueue:
+    def __init__(self, path, batch_size=500, interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval # seconds between flushes when nothing wakes the flusher
+        self.local = threading.local() # sqlite connections can't be shared between threads
+        self.wake = threading.Event()
+        self.flusher = None
+        self.lock_file = None
+        self.start_lock = threading.Lock()
+        self.counters = {'queued': 0, 'flushed': 0, 'batches': 0, 'errors': 0, 'last_batch': 0}
+        self.connect().execute(SCHEMA)
+
+    def connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None) # every statement commits
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self.local.conn = conn
+        return conn
+
+    # durably queue one check-in (checked_in True) or check-out
+    def put(self, clubhouse_id, member_id, checked_in, event_time):
+        self.connect().execute("INSERT INTO events (clubhouse_id, member_id, checked_in, event_time) VALUES (?, ?, ?, ?)",
+                               (clubhouse_id, member_id, int(checked_in), event_time.isoformat(sep=' ')))
+        self.counters['queued'] += 1
+        self.start()
+        self.wake.set()
+
+    # whether the member's newest event still waiting in the queue is a check-in, None if none is waiting
+    def pending(self, clubhouse_id, member_id):
+        row = self.connect().execute("""SELECT checked_in FROM events WHERE clubhouse_id = ? AND member_id = ?
+                                        ORDER BY event_id DESC LIMIT 1""", (clubhouse_id, member_id)).fetchone()
+        return None if row is None else bool(row[0])
+
+    # oldest queued events: [(event_id, clubhouse_id, member_id, checked_in, event_time)]
+    def peek(self, limit):
+        rows = self.connect().execute("""SELECT event_id, clubhouse_id, member_id, checked_in, event_time
+                                         FROM events ORDER BY event_id LIMIT ?""", (limit,)).fetchall()
+        return [(event_id, club_id, member_id, bool(checked_in), datetime.fromisoformat(event_time))
+                for event_id, club_id, member_id, checked_in, event_time in rows]
+
+    def delete_through(self, event_id):
+        self.connect().execute("DELETE FROM events WHERE event_id <= ?", (event_id,))
+
+    def depth(self):
+        return self.connect().execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    # take the queue's lock file if no other process has it, kept until this process exits
+    def holds_lock(self):
+        if self.lock_file is None:
+            lock_file = open(self.path + '.lock', 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return False
+            self.lock_file = lock_file
+        return True
+
+    # write one batch to MySQL, returns the number of events written
+    def flush_batch(self):
+        from application.db import apply_checkin_events
+        events = self.peek(self.batch_size)
+        if not events:
+            return 0
+        with application.app_context(): # a pooled connection for this batch
+            apply_checkin_events([event[1:] for event in events])
+        self.delete_through(events[-1][0])
+        self.counters['flushed'] += len(events)
+        self.counters['batches'] += 1
+        self.counters['last_batch'] = len(events)
+        return len(events)
+
+    # write everything queued, returns the number of events written; None if another process is flushing
+    def flush(self):
+        if not self.holds_lock():
+            return None
+        flushed = 0
+        while True:
+            written = self.flush_batch()
+            if not written:
+                return flushed
+            flushed += written
+
+    def run(self):
+        delay = self.interval
+        while True:
+            self.wake.wait(delay)
+            self.wake.clear()
+            try:
+                self.flush()
+                delay = self.interval
+            except Exception:
+                # the events stay queued, back off while MySQL is unavailable
+                self.counters['errors'] += 1
+                application.logger.exception("flushing queued check-ins failed, retrying")
+                delay = min(delay * 2, 30)
+
+    # start the flusher thread of this process (again after a fork)
+    def start(self):
+        with self.start_lock:
+            if self.flusher is None or not self.flusher.is_alive():
+                self.flusher = threading.Thread(target=self.run, name='checkin-queue', daemon=True)
+                self.flusher.start()
+
+    # wait until every queued event is in MySQL (e.g. before a mass checkout), False after timeout seconds
+    def drain(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        self.start()
+        while self.depth():
+            if time.monotonic() > deadline:
+                return False
+            self.wake.set()
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        return dict(self.counters, depth=self.depth(), flushing=self.lock_file is not None)
+
+checkin_queue = None
+queue_lock = threading.Lock()
+queue_pid = None
+
+# the queue of this process, None unless CHECKIN_QUEUE_PATH is set
+def get_checkin_queue():
+    global checkin_queue, queue_pid
+    path = application.config['CHECKIN_QUEUE_PATH']
+    if not path:
+        return None
+    if checkin_queue is None or queue_pid != os.getpid(): # threads and sqlite handles don't survive a fork
+        with queue_lock:
+            if checkin_queue is None or queue_pid != os.getpid():
+                checkin_queue = CheckinQueue(path, application.config['CHECKIN_QUEUE_BATCH'], application.config['CHECKIN_QUEUE_INTERVAL'])
+                queue_pid = os.getpid()
+    return checkin_queue
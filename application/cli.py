@@ -0,0 +1,434 @@
+# maintenance commands, run with `flask <command>` (FLASK_APP=app.py)
+
+import click
+import os
+import resource
+import subprocess
+import sys
+import time
+import pymysql
+from datetime import datetime, timedelta
+from flask import g
+from application import application
+from application import db
+
+### index check
+
+# helpers that are expected to read a whole table
+FULL_SCAN_ALLOWED = {'get_all_checkins', 'get_all_joindates', 'get_all_clubhouses'}
+
+# stands in for a connection: every statement is EXPLAINed, and reads (SELECT) are then also run for real
+# so that helpers go on to their next statement with the rows they expect; writes are only EXPLAINed
+class ExplainConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.plans = []
+
+    def cursor(self):
+        return ExplainCursor(self.conn.cursor(pymysql.cursors.DictCursor), self.conn.cursor(), self.plans)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class ExplainCursor:
+    lastrowid = 0
+    rowcount = 0
+
+    def __init__(self, cursor, reader, plans):
+        self.cursor = cursor
+        self.reader = reader
+        self.plans = plans
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.cursor.execute("EXPLAIN " + query, args)
+        self.plans.append((query, self.cursor.fetchall()))
+        self.rows = []
+        if query.lstrip().upper().startswith('SELECT'):
+            self.reader.execute(query, args)
+            self.rows = list(self.reader.fetchall())
+
+    def executemany(self, query, args):
+        for row in args[:1]:
+            self.execute(query, row)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self.cursor.close()
+        self.reader.close()
+
+# run one helper on the explainer, every statement it executes is recorded separately
+# returns ([(statement, plan rows)], None) or, when the helper fails part way, (statements so far, the error):
+# the statements after the failure were never EXPLAINed
+def explain_helper(explainer, helper, args):
+    del explainer.plans[:]
+    try:
+        helper(*args)
+    except Exception as error:
+        return list(explainer.plans), error
+    return list(explainer.plans), None
+
+# full table scans in one statement's plan: [(table, access type)]
+# derived tables (<derivedN>) are small intermediate results, clubhouses is tiny
+def full_scans(plan):
+    scans = []
+    for step in plan:
+        table = step['table'] or ''
+        if step['type'] in ('ALL', 'index') and table != 'clubhouses' and not table.startswith('<'):
+            scans.append((table, step['type']))
+    return scans
+
+# every db.py helper that runs on a request path, with sample arguments
+# add_checkin and add_checkout are a single CALL that can't be EXPLAINed, their procedures use the same
+# indexes as close_open_checkins
+def explain_targets(club_id, member_id, user_id):
+    start = datetime.now() - timedelta(days=30)
+    targets = [
+        ('get_clubhouse_members', (club_id,)),
+        ('get_clubhouse_member_joindates', (club_id,)),
+        ('get_all_joindates', ()),
+        ('get_specific_member', (club_id, member_id)),
+        ('is_checked_in', (club_id, member_id)),
+        ('get_checked_in_members', (club_id,)),
+        ('get_clubhouse_roster', (club_id,)),
+        ('get_roster_versions', (club_id,)),
+        ('get_roster_state', (club_id,)),
+        ('get_checked_out_members', (club_id,)),
+        ('get_checkins_by_clubhouse', (club_id,)),
+        ('get_checkins_by_member', (club_id, member_id)),
+        ('get_checkins_by_clubhouse', (club_id, start)),
+        ('get_checkins_by_member', (club_id, member_id, start)),
+        ('get_checkin_totals', (start,)),
+        ('get_checkin_totals', (start, club_id)),
+        ('get_checkin_totals', (start, club_id, member_id)),
+        ('get_checkin_hours', (start, 'day', club_id, member_id)),
+        ('get_rollup_totals', (start,)),
+        ('get_rollup_totals', (start, club_id)),
+        ('change_member_checkin', (member_id, club_id, False)),
+        ('checkout_all_from_clubhouse', (club_id,)),
+        ('auto_checkout_clubhouse', (club_id, start)),
+        ('delete_specific_member', (club_id, member_id)),
+        ('get_clubhouse_from_id', (club_id,)),
+        ('get_all_clubhouses', ()),
+        ('get_id_from_username', ('username',)),
+        ('get_club_id_from_user', (user_id,)),
+        ('get_user_id_from_club', (club_id,)),
+        ('get_user_from_id', (user_id,)),
+        ('update_password', (user_id, 'password')),
+        ('update_club_info', (club_id, 'name', 'name', False)),
+    ]
+    for bucket in db.CHECKIN_BUCKETS:
+        targets.append(('get_checkin_counts', (start, bucket)))
+        targets.append(('get_checkin_counts', (start, bucket, club_id)))
+        targets.append(('get_checkin_counts', (start, bucket, club_id, member_id)))
+        targets.append(('get_rollup_counts', (start, bucket)))
+        targets.append(('get_rollup_counts', (start, bucket, club_id)))
+    return targets
+
+@application.cli.command('check-indexes')
+def check_indexes():
+    """EXPLAIN every db.py query and fail if one scans a whole table or could not be checked."""
+    conn = db.get_conn()
+    cursor = conn.cursor()
+    cursor.execute("SELECT member_id, clubhouse_id FROM members LIMIT 1")
+    member_id, club_id = cursor.fetchone() or (1, 1)
+    cursor.execute("SELECT user_id FROM logins LIMIT 1")
+    user_id = (cursor.fetchone() or (1,))[0]
+    cursor.close()
+
+    pooled = g.db_conn
+    explainer = ExplainConnection(pooled.raw)
+    failures = []
+    try:
+        for name, args in explain_targets(club_id, member_id, user_id):
+            g.db_conn = type(pooled)(explainer)
+            plans, error = explain_helper(explainer, getattr(db, name), args)
+            for number, (query, plan) in enumerate(plans, 1):
+                label = "%s #%d" % (name, number)
+                if name not in FULL_SCAN_ALLOWED:
+                    for table, scan_type in full_scans(plan):
+                        failures.append("%s: full scan of %s (%s): %s" % (label, table, scan_type, " ".join(query.split())))
+                for step in plan:
+                    # partitions lists what a partitioned checkins table reads, date bounds should prune it
+                    click.echo("%-36s %-12s %-8s %-28s %s" % (label, step['table'], step['type'], step['key'], step.get('partitions') or ''))
+            if error is not None:
+                failures.append("%s: stopped after %d statements (%s: %s), the rest were not checked"
+                                % (name, len(plans), type(error).__name__, error))
+    finally:
+        g.db_conn = pooled
+        pooled.raw.rollback() # locking reads ran for real
+    if failures:
+        click.echo("\nfailed:")
+        for failure in failures:
+            click.echo("  " + failure)
+        raise SystemExit(1)
+    click.echo("\nevery statement checked, no full table scans")
+
+### rollups
+
+@application.cli.command('rebuild-rollups')
+@click.option('--club', 'club_id', type=int, default=None, help="Only rebuild this clubhouse.")
+def rebuild_rollups(club_id):
+    """Recreate the hourly check-in rollups from the checkins table."""
+    count = db.rebuild_checkin_rollups(club_id)
+    click.echo("rebuilt rollups for %d clubhouse(s)" % count)
+
+### check-in partitions
+
+@application.cli.command('roll-partitions')
+@click.option('--months-ahead', default=3, show_default=True, help="Months to create partitions for in advance.")
+def roll_partitions(months_ahead):
+    """Add the coming months' partitions to the checkins table."""
+    from application.partitions import roll
+    added = roll(months_ahead)
+    if added is None:
+        click.echo("checkins is not partitioned, run flask partition-checkins first")
+        return
+    click.echo("added %d partition(s)" % len(added))
+    for name, bound, rows in db.get_checkin_partitions():
+        click.echo("%-10s < %-24s ~%d rows" % (name, bound, rows))
+
+@application.cli.command('partition-checkins')
+@click.option('--batch-size', default=10000, show_default=True, help="Rows copied per transaction.")
+@click.option('--months-ahead', default=3, show_default=True, help="Months to create partitions for in advance.")
+def partition_checkins(batch_size, months_ahead):
+    """Convert the checkins table to monthly partitions while the site keeps running."""
+    from application import partitions
+    def progress(copied_to, last_id, rows):
+        click.echo("copied up to id %d of %d (%d rows)" % (copied_to, last_id, rows))
+    try:
+        copied = partitions.migrate(batch_size, months_ahead, progress=progress)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo("copied %d check-ins, the old table is kept as %s" % (copied, partitions.OLD_TABLE))
+
+### auto-checkout
+
+@application.cli.command('auto-checkout')
+@click.option('--club', 'club_id', type=int, default=None, help="Only sweep this clubhouse.")
+@click.option('--every', type=int, default=0, help="Keep running, sweeping every this many seconds.")
+@click.option('--drop-events', is_flag=True, help="First drop the per-member MySQL events of the old auto-checkout.")
+@click.option('--roll-partitions', 'months_ahead', type=int, default=None,
+              help="Also keep checkins partitioned this many months ahead on every run (see roll-partitions).")
+def auto_checkout(club_id, every, drop_events, months_ahead):
+    """Close check-ins left open past each clubhouse's local midnight."""
+    from application.autocheckout import sweep
+    from application.partitions import roll
+    if drop_events:
+        click.echo("dropped %d auto-checkout event(s)" % db.drop_auto_checkout_events())
+    while True:
+        with application.app_context(): # a fresh pooled connection for every run
+            if months_ahead is not None:
+                added = roll(months_ahead)
+                if added:
+                    click.echo("added %d partition(s) to checkins" % len(added))
+            results = sweep(club_id)
+        for swept_id, cutoff, closed in results:
+            if closed:
+                click.echo("clubhouse %d: closed %d check-in(s) started before %s" % (swept_id, closed, cutoff))
+        click.echo("%s: closed %d check-in(s) in %d clubhouse(s)" % (datetime.now().replace(microsecond=0), sum(r[2] for r in results), len(results)))
+        if not every:
+            break
+        time.sleep(every)
+
+### write-behind check-in queue
+
+@application.cli.command('flush-checkins')
+def flush_checkins():
+    """Write the check-ins waiting in the write-behind queue (CHECKIN_QUEUE_PATH) to MySQL."""
+    from application.checkinqueue import get_checkin_queue
+    queue = get_checkin_queue()
+    if queue is None:
+        raise click.ClickException("CHECKIN_QUEUE_PATH is not set")
+    flushed = queue.flush()
+    if flushed is None:
+        click.echo("a running worker is flushing the queue (%d event(s) waiting)" % queue.depth())
+    else:
+        click.echo("wrote %d queued event(s)" % flushed)
+
+### bulk member import
+
+@application.cli.command('import-members')
+@click.argument('club_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=500, show_default=True, help="Rows per transaction.")
+def import_members_command(club_id, path, chunk_size):
+    """Import members into a clubhouse from a CSV or XLSX file."""
+    from application.importer import import_members
+    with open(path, 'rb') as stream:
+        result = import_members(club_id, stream, path, chunk_size)
+    for line, message in result.errors:
+        click.echo("line %d: %s" % (line, message), err=True)
+    click.echo("imported %d members, %d rows skipped" % (result.imported, result.failed))
+
+### startup profile
+
+@application.cli.command('startup-profile')
+@click.option('--top', default=15, show_default=True, help="Number of slowest imports to list.")
+def startup_profile(top):
+    """Import the application in a fresh interpreter (-X importtime) and report time and memory."""
+    code = ("import resource, sys, application; "
+            "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'matplotlib' in sys.modules)")
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(application.root_path))
+    if result.returncode != 0:
+        click.echo(result.stderr, err=True)
+        raise SystemExit(result.returncode)
+    # lines look like "import time:  self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if line.startswith('import time:') and len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((int(fields[1]), fields[2].rstrip()))
+    total = max(cumulative for cumulative, name in imports if name.strip() == 'application')
+    for cumulative, name in sorted(imports, reverse=True)[:top]:
+        click.echo("%10.1f ms  %s" % (cumulative / 1000.0, name))
+    max_rss, plotting_loaded = result.stdout.split()
+    click.echo("\nimport application: %.1f ms, max RSS %s kB, matplotlib loaded: %s" % (total / 1000.0, max_rss, plotting_loaded))
+
+### plot rendering soak test
+
+@application.cli.command('plot-soak')
+@click.option('--renders', default=10000, show_default=True, help="Number of plots to render.")
+@click.option('--club', 'club_id', type=int, default=None, help="Clubhouse to plot, the whole network by default.")
+@click.option('--format', 'data_format', type=click.Choice(['0', '1', '2', '4']), default='0', show_default=True)
+def plot_soak(renders, club_id, data_format):
+    """Render the same plot repeatedly (bypassing the cache) and report memory along the way."""
+    from application.plot import render_plot, rss_kb, render_stats
+    render_plot('7', data_format, club_id) # load matplotlib before the baseline
+    baseline = rss_kb()
+    click.echo("baseline: %d kB" % baseline)
+    step = max(renders // 10, 1)
+    for i in range(1, renders + 1):
+        render_plot('7', data_format, club_id)
+        if i % step == 0:
+            click.echo("%6d renders: %d kB (%+d kB)" % (i, rss_kb(), rss_kb() - baseline))
+    click.echo("watermark: %d kB" % render_stats['rss_watermark_kb'])
+
+### synthetic data and benchmarks
+
+@application.cli.command('seed')
+@click.option('--clubhouses', default=10, show_default=True)
+@click.option('--members', default=200, show_default=True, help="Members per clubhouse.")
+@click.option('--years', default=1.0, show_default=True, help="Years of check-in history.")
+@click.option('--seed', default=1, show_default=True, help="Random seed, the same seed gives the same data.")
+@click.option('--batch-size', default=5000, show_default=True, help="Rows per insert batch.")
+@click.option('--reset', is_flag=True, help="Delete all clubhouses, members, logins and check-ins first.")
+def seed(clubhouses, members, years, seed, batch_size, reset):
+    """Fill the database with deterministic synthetic clubhouses, members, logins and check-ins."""
+    from application import seed as seeding
+    if reset:
+        click.confirm("Delete every clubhouse, member, login and check-in in %s?" % application.config['MYSQL_DATABASE_DB'], abort=True)
+        seeding.clear_tables()
+    started = time.perf_counter()
+    def progress(number, member_count, checkin_count):
+        click.echo("clubhouse %d/%d: %d members, %d check-ins" % (number, clubhouses, member_count, checkin_count))
+    created = seeding.generate(clubhouses, members, years, seed, batch_size, progress=progress)
+    click.echo("created %d clubhouses, %d members, %d check-ins in %.0f s (password: %s)"
+               % (created + (time.perf_counter() - started, seeding.SEED_PASSWORD)))
+
+@application.cli.command('benchmark')
+@click.option('--iterations', default=100, show_default=True, help="Requests per route.")
+@click.option('--club-user', default='seed-club-1', show_default=True)
+@click.option('--admin-user', default='seed-admin', show_default=True)
+@click.option('--password', default=None, help="Defaults to the seed password.")
+@click.option('--cold', is_flag=True, help="Clear the plot cache before every request.")
+@click.option('--output', default='benchmark-results', show_default=True, help="Directory for the results file.")
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), default=None, help="Earlier results file to compare with.")
+def benchmark(iterations, club_user, admin_user, password, cold, output, compare):
+    """Drive the main routes through the test client and report latency, queries per request and RSS."""
+    from application import benchmark as bench
+    def progress(name, result):
+        click.echo("%-34s p50 %8.2f ms  p99 %8.2f ms  %6.2f queries  %7.2f db ms" % (
+            name, result['p50_ms'], result['p99_ms'], result['queries_per_request'], result['db_ms_per_request']))
+    results = bench.run(iterations, club_user, admin_user, password or bench.SEED_PASSWORD, cold, progress)
+    path = bench.save(results, output, iterations, cold)
+    click.echo("\npeak RSS %d kB, results saved to %s" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, path))
+    if compare:
+        before = bench.load(compare)
+        click.echo("\ncompared with %s:" % compare)
+        for name, result in results.items():
+            if name in before:
+                click.echo("%-34s p50 %+8.2f ms  p99 %+8.2f ms  %+6.2f queries" % (name,
+                    result['p50_ms'] - before[name]['p50_ms'], result['p99_ms'] - before[name]['p99_ms'],
+                    result['queries_per_request'] - before[name]['queries_per_request']))
+
+@application.cli.command('benchmark-roster')
+@click.option('--sizes', default='50,500,5000', show_default=True, help="Comma-separated clubhouse sizes (members).")
+@click.option('--iterations', default=3, show_default=True, help="Requests per route and size.")
+def benchmark_roster(sizes, iterations):
+    """Show that the check-in page and mass checkout run the same number of queries at any clubhouse size."""
+    from application import benchmark as bench
+    def progress(size, counts):
+        click.echo("%6d members  check-in page %3d queries  mass checkout %3d queries"
+                   % (size, counts['checkin page'], counts['mass checkout']))
+    results = bench.roster_queries([int(size) for size in sizes.split(',')], iterations, progress)
+    for route in ('checkin page', 'mass checkout'):
+        if len({counts[route] for counts in results.values()}) > 1:
+            raise click.ClickException("%s queries grow with the number of members" % route)
+    click.echo("query counts are constant")
+
+@application.cli.command('benchmark-user-cache')
+@click.option('--iterations', default=50, show_default=True, help="Requests per mode.")
+@click.option('--club-user', default='seed-club-1', show_default=True)
+@click.option('--password', default=None, help="Defaults to the seed password.")
+def benchmark_user_cache(iterations, club_user, password):
+    """Compare queries per request with and without the user cache."""
+    from application import benchmark as bench
+    for mode, queries in bench.user_cache_queries(iterations, club_user, password or bench.SEED_PASSWORD).items():
+        click.echo("%-9s %5.2f queries per request" % (mode, queries))
+
+@application.cli.command('benchmark-roster-burst')
+@click.option('--members', default=5000, show_default=True, help="Members of the clubhouse.")
+@click.option('--taps', default=5000, show_default=True, help="Check-ins and check-outs in the burst.")
+def benchmark_roster_burst(members, taps):
+    """Time in-memory roster updates and renders during a burst of taps at a large clubhouse."""
+    from application import benchmark as bench
+    result = bench.roster_burst(members, taps)
+    click.echo("%d members, %d taps: %.0f taps/s" % (result['members'], result['taps'], result['taps_per_second']))
+    click.echo("tap     p50 %7.1f us  p99 %7.1f us" % (result['tap_p50_us'], result['tap_p99_us']))
+    click.echo("render  p50 %7.1f us  p99 %7.1f us" % (result['render_p50_us'], result['render_p99_us']))
+    click.echo("backend calls: %s" % ", ".join("%s %d" % call for call in sorted(result['backend_calls'].items())))
+
+@application.cli.command('benchmark-engine')
+@click.option('--rows', default=1000000, show_default=True, help="Check-in rows to shape.")
+@click.option('--repeat', default=3, show_default=True, help="Runs per implementation, the best one counts.")
+@click.option('--seed', default=1, show_default=True, help="Random seed of the generated rows.")
+def benchmark_engine(rows, repeat, seed):
+    """Compare the numpy bucketing engine with the old per-row loops on generated check-ins."""
+    from application import benchmark as bench
+    result = bench.compare_engine(rows, repeat, seed)
+    seconds = result['seconds']
+    engine = seconds['engine (columns)'] + seconds['engine (views)']
+    for name, value in seconds.items():
+        click.echo("%-18s %8.3f s" % (name, value))
+    click.echo("%d rows, engine %.1fx faster than the loops (%.1fx without loading the columns), peak RSS %d kB"
+               % (result['rows'], seconds['loops'] / engine, seconds['loops'] / max(seconds['engine (views)'], 1e-6), result['max_rss_kb']))
+    if not result['agree']:
+        raise click.ClickException("the engine and the loops disagree")
+
+@application.cli.command('benchmark-checkins')
+@click.option('--club-user', default='seed-club-1', show_default=True, help="Login whose clubhouse is used.")
+@click.option('--events', default=2000, show_default=True, help="Check-ins and check-outs per run.")
+@click.option('--threads', default=4, show_default=True, help="Simultaneous kiosks, at most DB_POOL_SIZE.")
+def benchmark_checkins(club_user, events, threads):
+    """Measure sustained check-ins per second with and without the write-behind queue."""
+    from application import benchmark as bench
+    club_id = db.get_club_id_from_user(db.get_id_from_username(club_user))
+    if club_id is None:
+        raise click.ClickException("no clubhouse for login %s, run flask seed first" % club_user)
+    for mode, result in bench.compare_checkins(club_id, events, threads).items():
+        click.echo("%-13s %6d events  %8.1f acked/s  %8.1f stored/s  p50 %7.2f ms  p99 %7.2f ms" % (
+            mode, result['events'], result['acked_per_second'], result['stored_per_second'], result['p50_ms'], result['p99_ms']))
@@ -1,16 +1,29 @@
 # helper functions for database operations, all functions with db accesses should be here
 
-from datetime import datetime
+import os
+import time
+import pymysql
+from datetime import datetime, timedelta
 #from application import application, conn
-from application import application, mysql
+from application import application, pool
+from application.cache import invalidate_club_plots, invalidate_user, invalidate_club_users
+from application.roster import get_roster, is_member, roster_mark, roster_clear, invalidate_roster
+from application.checkinqueue import get_checkin_queue
+from application.search import index_member, unindex_member
+from application.metrics import InstrumentedConnection, record_acquire
+from flask import g
 from werkzeug.security import generate_password_hash
 from flask_babel import lazy_gettext as _l
 
 # retrieve connection for MySQL database defined in env vars
+# the connection is borrowed from the pool once per request (app context) and given back at teardown,
+# so callers must not close it; statements are timed per request (see metrics.py)
 def get_conn():
-    conn = mysql.connect()
-#    cursor = conn.cursor()
-    return conn
+    if 'db_conn' not in g:
+        started = time.perf_counter()
+        g.db_conn = pool.acquire()
+        record_acquire(time.perf_counter() - started)
+    return InstrumentedConnection(g.db_conn.raw)
 
 # retrieve members from a clubhouse: returns (id, first, last)
 def get_clubhouse_members(clubhouse_id, sort_by_last=True):
@@ -25,7 +38,6 @@ def get_clubhouse_members(clubhouse_id, sort_by_last=True):
 #    for row in rows: # for debugging purposes?
 #        print(row)
     cursor.close()
-    conn.close()
     return rows
 
 # retrieve member join dates: returns (id, join date)
@@ -35,7 +47,6 @@ def get_clubhouse_member_joindates(clubhouse_id):
     cursor.execute("SELECT member_id, join_date FROM members WHERE clubhouse_id = %s AND active = 1 ORDER BY join_date", (clubhouse_id))
     rows = cursor.fetchall()
     cursor.close()
-    conn.close()
     return rows
 
 def get_all_joindates():
@@ -44,7 +55,25 @@ def get_all_joindates():
     cursor.execute("SELECT member_id, join_date FROM members WHERE active = 1 ORDER BY join_date")
     rows = cursor.fetchall()
     cursor.close()
-    conn.close()
+    return rows
+
+# number of active members that joined on each date, for a clubhouse or the whole network: returns (join date, count)
+def get_join_date_counts(clubhouse_id=None):
+    conditions = ""
+    params = ()
+    if clubhouse_id is not None:
+        conditions = " AND clubhouse_id = %s"
+        params = (clubhouse_id,)
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT join_date, COUNT(*)
+                      FROM members
+                      WHERE active = 1
+                      AND join_date IS NOT NULL%s
+                      GROUP BY join_date
+                      ORDER BY join_date""" % conditions, params)
+    rows = cursor.fetchall()
+    cursor.close()
     return rows
 
 # retrieve a specific member: returns the whole row by default
@@ -64,7 +93,6 @@ def get_specific_member(clubhouse_id, member_id, short_form=False):
     if len(member) < 1:
         application.logger.error("error: didn't find anyone with these ids")
     cursor.close()
-    conn.close()
     application.logger.info("get specific member debug: ", member)
     return member[0]
 
@@ -83,21 +111,71 @@ def is_checked_in(clubhouse_id, member_id):
     if len(member) < 1:
         application.logger.error("error: didn't find anyone with these ids")
     cursor.close()
-    conn.close()
     return member[0][0]
 
 # retrieve a list of members that are currently checked into a clubhouse: returns (id, (first, last))
+# single query, same display order as get_clubhouse_members
 def get_checked_in_members(clubhouse_id, sort_by_last=True):
-    members = get_clubhouse_members(clubhouse_id, sort_by_last)
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT member_id, first_name, last_name
+                      FROM members
+                      WHERE clubhouse_id = %s
+                      AND active = 1
+                      AND is_checked_in = 1
+                      ORDER BY last_name, first_name""", (clubhouse_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return [(member_id, (first, last)) for member_id, first, last in rows]
 
-    result = []
-    for (member_id, first, last) in members:
-        if is_checked_in(clubhouse_id, member_id):
-            result.append((member_id, (first, last)))
-    return result
+# retrieve every active member with their check-in status in one query: returns (id, first, last, is_checked_in)
+# used to build both check-in lists at once
+def get_clubhouse_roster(clubhouse_id):
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT member_id, first_name, last_name, is_checked_in
+                      FROM members
+                      WHERE clubhouse_id = %s
+                      AND active = 1
+                      ORDER BY last_name, first_name""", (clubhouse_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+# every process's rosters notice changes through two counters on the clubhouse row (see roster.py):
+# roster_version goes up with every change to who is checked in, members_version with every change to the
+# member list (which also bumps roster_version); writers bump them last in their own transaction, so the
+# row lock is held only until the commit
+def bump_roster_version(cursor, clubhouse_id, members=False):
+    cursor.execute("""UPDATE clubhouses
+                      SET roster_version = roster_version + 1%s
+                      WHERE clubhouse_id = %%s""" % (", members_version = members_version + 1" if members else ""),
+                      (clubhouse_id,))
+
+# returns (roster_version, members_version), (0, 0) for an unknown clubhouse
+def get_roster_versions(clubhouse_id):
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("SELECT roster_version, members_version FROM clubhouses WHERE clubhouse_id = %s", (clubhouse_id,))
+    versions = cursor.fetchone()
+    cursor.close()
+    return versions or (0, 0)
+
+# the checked-in members with the roster_version they belong to, in one read: returns (version, [member ids])
+def get_roster_state(clubhouse_id):
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT c.roster_version, m.member_id
+                      FROM clubhouses c
+                      LEFT JOIN members m ON m.clubhouse_id = c.clubhouse_id AND m.active = 1 AND m.is_checked_in = 1
+                      WHERE c.clubhouse_id = %s""", (clubhouse_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        return 0, []
+    return rows[0][0], [member_id for version, member_id in rows if member_id is not None]
 
 # same but for currently checked out: returns list of member_ids who have checked in but not out
-    # may have to be called directly inside enable_auto_checkout
 def get_checked_out_members(clubhouse_id):
     conn = get_conn()
     cursor = conn.cursor()
@@ -109,58 +187,85 @@ def get_checked_out_members(clubhouse_id):
     checked_out = cursor.fetchall()
     conn.commit()
     cursor.close()
-    conn.close()
     return checked_out
 
 # retrieve only certain members (for filtering)
 def query_members():
     pass
 
+# columns the member forms may write, anything else in the form dictionary is ignored
+# (keys are interpolated into the SQL as column names, so they must come from this list)
+MEMBER_COLUMNS = ('first_name', 'last_name', 'street_address', 'city', 'state', 'zip_code', 'country',
+                  'member_email', 'member_phone', 'join_date', 'birthday', 'school', 'gender', 'race_ethnicity',
+                  'guardian_first_name', 'guardian_last_name', 'guardian_relation', 'guardian_email', 'guardian_phone')
+
+# same for the clubhouse forms (username and password go to logins)
+CLUBHOUSE_COLUMNS = ('short_name', 'full_name', 'join_date', 'time_zone', 'image', 'display_by_last')
+
+# HELPER FUNCTION: (columns, values) of the whitelisted keys present in update_dict
+def writable_fields(update_dict, allowed):
+    columns = [key for key in allowed if key in update_dict]
+    return columns, [update_dict[key] for key in columns]
+
 # register a new member, starts checked out by default
 # returns message, member id
 def add_member(club_id, update_dict):
+    columns, values = writable_fields(update_dict, MEMBER_COLUMNS)
     conn = get_conn()
     cursor = conn.cursor()
-    # insert blank row with just member_id
-    cursor.execute("""INSERT INTO members (member_id, first_name, last_name, clubhouse_id)
-                        VALUES (DEFAULT, 'temp_first', 'temp_last', %s)""",
-                        (club_id, ))
-
-    # get this id that we just created (LAST_INSERT_ID() apparently not supported w/ our v of MySQL?)
-    cursor.execute("""SELECT LAST_INSERT_ID()""")
-    member_ids = cursor.fetchall()
-    if len(member_ids) != 1:
-        application.logger.error("There should only be one ID.")
-        application.logger.error(member_ids)
-    new_member_id = member_ids[0]
-
-    # update each field separately
-    for key in update_dict:
-        query = """UPDATE members
-                    SET %s = %%s
-                    WHERE clubhouse_id = %%s
-                    AND member_id = %%s""" % key
-        cursor.execute(query, (update_dict[key], club_id, new_member_id))
-
+    # one insert with every field
+    cursor.execute("""INSERT INTO members (clubhouse_id, %s)
+                        VALUES (%%s, %s)""" % (", ".join(columns), ", ".join(["%s"] * len(columns))),
+                        [club_id] + values)
+    new_member_id = cursor.lastrowid
+    bump_roster_version(cursor, club_id, members=True)
     conn.commit()
     cursor.close()
-    conn.close()
+    invalidate_club_plots(club_id)
+    members_version = invalidate_roster(club_id)
+    index_member(club_id, new_member_id, update_dict['first_name'], update_dict['last_name'], members_version)
     return (_l("Member added successfully."), new_member_id) # again could be more specific
 
-# edit a member
-def edit_member(club_id, mem_id, update_dict):
+# register many members at once (bulk import), rows are tuples in MEMBER_COLUMNS order
+# one batched multi-row insert and one commit per call, callers chunk large files
+def add_members_bulk(club_id, rows):
     conn = get_conn()
     cursor = conn.cursor()
-    for key in update_dict: # key has to match exact vocabulary of table
-        query = """UPDATE members
-                   SET %s = %%s
-                   WHERE clubhouse_id = %%s
-                   AND member_id = %%s""" % key
-        cursor.execute(query, (update_dict[key], club_id, mem_id))
+    try:
+        cursor.executemany("""INSERT INTO members (clubhouse_id, %s)
+                                VALUES (%s)""" % (", ".join(MEMBER_COLUMNS), ", ".join(["%s"] * (len(MEMBER_COLUMNS) + 1))),
+                                [(club_id,) + tuple(row) for row in rows])
+        bump_roster_version(cursor, club_id, members=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    invalidate_club_plots(club_id)
+    invalidate_roster(club_id)
+    return len(rows)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+# edit a member
+def edit_member(club_id, mem_id, update_dict):
+    columns, values = writable_fields(update_dict, MEMBER_COLUMNS)
+    if columns:
+        conn = get_conn()
+        cursor = conn.cursor()
+        # one update with every changed field
+        cursor.execute("""UPDATE members
+                          SET %s
+                          WHERE clubhouse_id = %%s
+                          AND member_id = %%s""" % ", ".join(column + " = %s" for column in columns),
+                          values + [club_id, mem_id])
+        bump_roster_version(cursor, club_id, members=True)
+        conn.commit()
+        cursor.close()
+        # nothing to drop when nothing was written
+        invalidate_club_plots(club_id)
+        members_version = invalidate_roster(club_id)
+        if 'first_name' in update_dict and 'last_name' in update_dict: # otherwise the search index is rebuilt
+            index_member(club_id, mem_id, update_dict['first_name'], update_dict['last_name'], members_version)
     return _l("Member updated successfully.") # could be more specific but that requires getting more info
 
 # delete a specific member
@@ -181,15 +286,13 @@ def delete_specific_member(club_id, mem_id):
     # delete from checkins table
     # temporary patch to ensure user does not appear in checked-in users -- where did attempted actual sol'tn go?
     current_time = datetime.now()
-    cursor.execute("""UPDATE checkins
-                      SET checkout_datetime = %s
-                      WHERE member_id = %s
-                      AND clubhouse_id = %s
-                      AND checkout_datetime IS NULL""",
-                      (current_time, mem_id, club_id))
+    close_open_checkins(cursor, current_time, club_id, mem_id, opened_after=open_checkins_since(current_time))
+    bump_roster_version(cursor, club_id, members=True)
     conn.commit()
     cursor.close()
-    conn.close()
+    invalidate_club_plots(club_id)
+    members_version = invalidate_roster(club_id)
+    unindex_member(club_id, mem_id, members_version)
     return _l("Member deleted successfully.") # could be more specific but that requires getting more info
 
 # retrieve all check-ins
@@ -199,32 +302,276 @@ def get_all_checkins():
     cursor.execute("SELECT * FROM checkins")
     rows = cursor.fetchall()
     cursor.close()
-    conn.close()
     return rows
 
+# optional check-in time range for the queries below, start inclusive and end exclusive
+# with a range MySQL only reads the monthly partitions of checkins it overlaps (see partitions.py)
+def checkin_range(start=None, end=None):
+    conditions = ""
+    params = []
+    if start is not None:
+        conditions += " AND checkin_datetime >= %s"
+        params.append(start)
+    if end is not None:
+        conditions += " AND checkin_datetime < %s"
+        params.append(end)
+    return conditions, params
+
 # retrieve check-ins from a certain clubhouse
-def get_checkins_by_clubhouse(clubhouse_id):
+def get_checkins_by_clubhouse(clubhouse_id, start=None, end=None):
+    conditions, params = checkin_range(start, end)
     conn = get_conn()
     cursor = conn.cursor()
     cursor.execute("""SELECT * FROM checkins
-                      WHERE clubhouse_id = %s""", (clubhouse_id, ))
+                      WHERE clubhouse_id = %%s%s""" % conditions, [clubhouse_id] + params)
     rows = cursor.fetchall()
     cursor.close()
-    conn.close()
     return rows
 
 # retrieve check-ins for a given member
-def get_checkins_by_member(clubhouse_id, member_id):
+def get_checkins_by_member(clubhouse_id, member_id, start=None, end=None):
+    conditions, params = checkin_range(start, end)
     conn = get_conn()
     cursor = conn.cursor()
     cursor.execute("""SELECT * FROM checkins
-                      WHERE clubhouse_id = %s
-                      AND member_id = %s""", (clubhouse_id, member_id))
+                      WHERE clubhouse_id = %%s
+                      AND member_id = %%s%s""" % conditions, [clubhouse_id, member_id] + params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+# member columns that can be joined onto a check-in export (see export.py)
+EXPORT_DEMOGRAPHICS = ('join_date', 'birthday', 'school', 'gender', 'race_ethnicity', 'city', 'state', 'zip_code', 'country')
+
+# rows of an unbuffered (server-side) cursor, read in batches; holds a connection borrowed from the pool
+# just for this result, so the request's own connection stays free, and hands it back once the rows
+# are exhausted or close() is called (flask calls close() on streamed responses)
+class RowStream:
+    def __init__(self, query, params, columns, batch_size=1000):
+        self.columns = columns
+        self.batch_size = batch_size
+        self.pooled = pool.acquire()
+        try:
+            self.cursor = self.pooled.raw.cursor(pymysql.cursors.SSCursor)
+            self.cursor.execute(query, params)
+        except Exception:
+            pool.release(self.pooled, broken=True)
+            raise
+
+    def __iter__(self):
+        while self.pooled is not None:
+            rows = self.cursor.fetchmany(self.batch_size)
+            if not rows:
+                self.cursor.close()
+                self.release(broken=False)
+                break
+            yield rows
+
+    # an unfinished unbuffered result leaves the connection unusable, drop it instead of draining it
+    def close(self):
+        self.release(broken=True)
+
+    def release(self, broken):
+        if self.pooled is not None:
+            pool.release(self.pooled, broken=broken)
+            self.pooled = None
+
+# stream check-ins started in [start, end), optionally for one clubhouse and with member demographics
+def stream_checkins(start, end, clubhouse_id=None, demographics=False):
+    columns = ['checkin_id', 'clubhouse_id', 'member_id', 'checkin_datetime', 'checkout_datetime']
+    query = "SELECT c.checkin_id, c.clubhouse_id, c.member_id, c.checkin_datetime, c.checkout_datetime"
+    if demographics:
+        columns.extend(EXPORT_DEMOGRAPHICS)
+        query += "".join(", m." + column for column in EXPORT_DEMOGRAPHICS)
+    query += " FROM checkins c"
+    if demographics:
+        query += " LEFT JOIN members m ON m.member_id = c.member_id"
+    query += " WHERE c.checkin_datetime >= %s AND c.checkin_datetime < %s"
+    params = [start, end]
+    if clubhouse_id is not None:
+        query += " AND c.clubhouse_id = %s"
+        params.append(clubhouse_id)
+    query += " ORDER BY c.checkin_datetime" # served by idx_checkins_club_time / idx_checkins_time, no filesort
+    return RowStream(query, params, columns)
+
+# grouping expressions for pre-aggregated check-in queries (see plot.py)
+# hour/day buckets come back as datetimes, hourofday as 0-23, weekday as 0-6 with Monday = 0 like datetime.weekday()
+CHECKIN_BUCKETS = {
+    'hour': "TIMESTAMP(DATE(checkin_datetime), MAKETIME(HOUR(checkin_datetime), 0, 0))",
+    'day': "TIMESTAMP(DATE(checkin_datetime))",
+    'hourofday': "HOUR(checkin_datetime)",
+    'weekday': "WEEKDAY(checkin_datetime)"
+}
+
+# build the WHERE clause shared by the aggregate queries: check-ins since start, optionally for one clubhouse/member
+def checkin_scope(start, clubhouse_id=None, member_id=None):
+    conditions = ["checkin_datetime >= %s"]
+    params = [start]
+    if clubhouse_id is not None:
+        conditions.append("clubhouse_id = %s")
+        params.append(clubhouse_id)
+    if member_id is not None:
+        conditions.append("member_id = %s")
+        params.append(member_id)
+    return " AND ".join(conditions), params
+
+# number of check-ins since start grouped by bucket (a key of CHECKIN_BUCKETS): returns (bucket, count)
+def get_checkin_counts(start, bucket, clubhouse_id=None, member_id=None):
+    where, params = checkin_scope(start, clubhouse_id, member_id)
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT %s AS bucket, COUNT(*)
+                      FROM checkins
+                      WHERE %s
+                      GROUP BY bucket
+                      ORDER BY bucket""" % (CHECKIN_BUCKETS[bucket], where), params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+# hours stayed since start grouped by bucket, open check-ins count up to now: returns (bucket, hours)
+def get_checkin_hours(start, bucket, clubhouse_id=None, member_id=None):
+    where, params = checkin_scope(start, clubhouse_id, member_id)
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT %s AS bucket,
+                        SUM(TIMESTAMPDIFF(SECOND, checkin_datetime, COALESCE(checkout_datetime, %%s))) / 3600
+                      FROM checkins
+                      WHERE %s
+                      GROUP BY bucket
+                      ORDER BY bucket""" % (CHECKIN_BUCKETS[bucket], where), [datetime.now()] + params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+# total number of check-ins and hours stayed since start: returns (count, hours)
+def get_checkin_totals(start, clubhouse_id=None, member_id=None):
+    where, params = checkin_scope(start, clubhouse_id, member_id)
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT COUNT(*),
+                        COALESCE(SUM(TIMESTAMPDIFF(SECOND, checkin_datetime, COALESCE(checkout_datetime, %%s))), 0) / 3600
+                      FROM checkins
+                      WHERE %s""" % where, [datetime.now()] + params)
+    num_checkins, num_hours = cursor.fetchone()
+    cursor.close()
+    return (int(num_checkins), float(num_hours))
+
+### hourly rollups ###
+# checkin_rollups keeps, per clubhouse and hour, the number of check-ins and the seconds stayed by
+# check-ins that started in that hour and have been closed; the write helpers below and the check-in
+# procedures (.schema.sql) keep it current and rebuild_checkin_rollups recreates it from the raw checkins table
+
+# the auto-checkout sweep closes every check-in at the latest at the next local midnight, so outside the
+# sweep open check-ins are looked for among the last OPEN_CHECKIN_DAYS days only; the bound keeps those
+# lookups in the newest partitions of checkins
+def open_checkins_since(now):
+    return now - timedelta(days=application.config['OPEN_CHECKIN_DAYS'])
+
+# close the open check-ins of a clubhouse (or of one member) at checkout_time
+# their stays are added to the rollups before the rows are closed, all on the caller's cursor
+# opened_before/opened_after limit it to check-ins started before/since those times
+# returns the number of check-ins closed
+def close_open_checkins(cursor, checkout_time, clubhouse_id, member_id=None, opened_before=None, opened_after=None):
+    conditions = "clubhouse_id = %s AND checkout_datetime IS NULL"
+    params = [clubhouse_id]
+    if member_id is not None:
+        conditions += " AND member_id = %s"
+        params.append(member_id)
+    if opened_before is not None:
+        conditions += " AND checkin_datetime < %s"
+        params.append(opened_before)
+    if opened_after is not None:
+        conditions += " AND checkin_datetime >= %s"
+        params.append(opened_after)
+    cursor.execute("""INSERT INTO checkin_rollups (clubhouse_id, bucket, checkins, stay_seconds)
+                      SELECT * FROM (
+                        SELECT clubhouse_id, %s AS bucket, 0 AS checkins,
+                          SUM(TIMESTAMPDIFF(SECOND, checkin_datetime, %%s)) AS stay_seconds
+                        FROM checkins
+                        WHERE %s
+                        GROUP BY clubhouse_id, bucket) AS closed
+                      ON DUPLICATE KEY UPDATE stay_seconds = checkin_rollups.stay_seconds + closed.stay_seconds"""
+                      % (CHECKIN_BUCKETS['hour'], conditions), [checkout_time] + params)
+    return cursor.execute("""UPDATE checkins
+                      SET checkout_datetime = %%s
+                      WHERE %s""" % conditions, [checkout_time] + params)
+
+# grouping expressions over the rollup buckets, same keys and result types as CHECKIN_BUCKETS
+ROLLUP_BUCKETS = {
+    'hour': "bucket",
+    'day': "TIMESTAMP(DATE(bucket))",
+    'hourofday': "HOUR(bucket)",
+    'weekday': "WEEKDAY(bucket)"
+}
+
+# rollup equivalent of get_checkin_counts for a clubhouse or, with clubhouse_id None, the whole network
+def get_rollup_counts(start, bucket, clubhouse_id=None):
+    conditions = "bucket >= %s"
+    params = [start.replace(minute=0, second=0, microsecond=0)]
+    if clubhouse_id is not None:
+        conditions += " AND clubhouse_id = %s"
+        params.append(clubhouse_id)
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT %s AS grouped, SUM(checkins)
+                      FROM checkin_rollups
+                      WHERE %s
+                      GROUP BY grouped
+                      ORDER BY grouped""" % (ROLLUP_BUCKETS[bucket], conditions), params)
     rows = cursor.fetchall()
     cursor.close()
-    conn.close()
     return rows
 
+# rollup equivalent of get_checkin_totals: returns (count, hours)
+# stays that are still open are not in the rollups yet, they are added up to now from checkins
+def get_rollup_totals(start, clubhouse_id=None):
+    current_time = datetime.now()
+    bucket_start = start.replace(minute=0, second=0, microsecond=0)
+    conditions = ""
+    params = []
+    if clubhouse_id is not None:
+        conditions = " AND clubhouse_id = %s"
+        params.append(clubhouse_id)
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT COALESCE(SUM(checkins), 0), COALESCE(SUM(stay_seconds), 0)
+                      FROM checkin_rollups
+                      WHERE bucket >= %%s%s""" % conditions, [bucket_start] + params)
+    num_checkins, closed_seconds = cursor.fetchone()
+    cursor.execute("""SELECT COALESCE(SUM(TIMESTAMPDIFF(SECOND, checkin_datetime, %%s)), 0)
+                      FROM checkins
+                      WHERE checkout_datetime IS NULL
+                      AND checkin_datetime >= %%s%s""" % conditions, [current_time, bucket_start] + params)
+    open_seconds = cursor.fetchone()[0]
+    cursor.close()
+    # MySQL sums are DECIMAL, the callers divide them by plain numbers
+    return (int(num_checkins), float(closed_seconds + open_seconds) / 3600)
+
+# recreate the rollups from the checkins table, for one clubhouse or all of them
+# each clubhouse is rebuilt and committed separately to keep transactions short
+# returns the number of clubhouses rebuilt
+def rebuild_checkin_rollups(clubhouse_id=None):
+    conn = get_conn()
+    cursor = conn.cursor()
+    if clubhouse_id is None:
+        cursor.execute("SELECT DISTINCT clubhouse_id FROM checkins WHERE clubhouse_id IS NOT NULL")
+        club_ids = [row[0] for row in cursor.fetchall()]
+    else:
+        club_ids = [clubhouse_id]
+    for club_id in club_ids:
+        cursor.execute("DELETE FROM checkin_rollups WHERE clubhouse_id = %s", (club_id,))
+        cursor.execute("""INSERT INTO checkin_rollups (clubhouse_id, bucket, checkins, stay_seconds)
+                          SELECT clubhouse_id, %s AS bucket, COUNT(*),
+                            COALESCE(SUM(TIMESTAMPDIFF(SECOND, checkin_datetime, checkout_datetime)), 0)
+                          FROM checkins
+                          WHERE clubhouse_id = %%s
+                          AND checkin_datetime IS NOT NULL
+                          GROUP BY clubhouse_id, bucket""" % CHECKIN_BUCKETS['hour'], (club_id,))
+        conn.commit()
+    cursor.close()
+    return len(club_ids)
+
 # changes the is_checked_in field for a given member
 def change_member_checkin(member_id, clubhouse_id, checked_in):
     conn = get_conn()
@@ -233,95 +580,280 @@ def change_member_checkin(member_id, clubhouse_id, checked_in):
                       SET is_checked_in = %s
                       WHERE clubhouse_id = %s
                       AND member_id = %s""", (checked_in, clubhouse_id, member_id))
+    bump_roster_version(cursor, clubhouse_id)
     conn.commit()
     cursor.close()
-    conn.close()
     return "Check-in status changed successfully."
 
-# add a new check-in
-def add_checkin(member_id, clubhouse_id):
+# check a member in or out with a single CALL to the checkin_member/checkout_member procedures
+# (.schema.sql), which lock the member row and write checkins, checkin_rollups and members in one transaction
+# idempotent: checking in a member who already has a check-in open (a double tap) changes nothing, and
+# checking in again within the second of a check-out reopens that check-in instead of hitting the unique key
+# returns (checked_in, changed), or None if the member is not an active member of the clubhouse
+def set_member_checkin(member_id, clubhouse_id, checked_in):
+    queue = get_checkin_queue()
+    if queue is not None:
+        return queue_member_checkin(queue, member_id, clubhouse_id, checked_in)
     current_time = datetime.now()
     conn = get_conn()
     cursor = conn.cursor()
-    # for testing, change later
-    cursor.execute("""INSERT INTO checkins (member_id, checkin_datetime, clubhouse_id)
-                      VALUES (%s, %s, %s)""",
-                      (member_id, current_time, clubhouse_id))
+    cursor.execute("CALL %s(%%s, %%s, %%s, %%s)" % ('checkin_member' if checked_in else 'checkout_member'),
+                   (clubhouse_id, member_id, current_time, open_checkins_since(current_time)))
+    row = cursor.fetchone()
+    while cursor.nextset(): # a CALL ends with a status result
+        pass
+    cursor.close()
+    if row is None:
+        return None
+    state = (bool(row[0]), bool(row[1]))
+    if state[1]:
+        invalidate_club_plots(clubhouse_id)
+    roster_mark(clubhouse_id, member_id, state[0]) # also when unchanged, in case the roster missed the change
+    return state
+
+# write-behind version of set_member_checkin (see checkinqueue.py): the event is acknowledged once it is
+# queued and apply_checkin_events stores it a moment later, skipping it if MySQL already has that state
+# (record_checkin/record_checkout), so the tap neither reads nor waits for MySQL: the roster only has to
+# know the member, and only the member's event still in the queue, if any, is used to spot a double tap
+# (the roster can't tell, it doesn't have the queued events yet)
+def queue_member_checkin(queue, member_id, clubhouse_id, checked_in):
+    if not is_member(clubhouse_id, member_id, get_clubhouse_roster):
+        return None
+    if queue.pending(clubhouse_id, member_id) == checked_in: # double tap
+        return (checked_in, False)
+    queue.put(clubhouse_id, member_id, checked_in, datetime.now().replace(microsecond=0)) # DATETIME keeps whole seconds
+    roster_mark(clubhouse_id, member_id, checked_in)
+    return (checked_in, True)
+
+# store a batch of queued events (clubhouse_id, member_id, checked_in, event_time) in order, in one transaction:
+# each event goes through record_checkin/record_checkout (.schema.sql), the steps of the checkin_member and
+# checkout_member procedures without their transaction, so the batch is checked against what is stored
+# rather than against the roster of the worker that queued it
+# applying a batch again (after a crash between the commit and the queue cleanup) changes nothing: a
+# check-in adds nothing while one is open or its second is already stored, a check-out only closes
+# check-ins started at or before it, and the rollups are only counted when a row actually changes
+def apply_checkin_events(events):
+    conn = get_conn()
+    cursor = conn.cursor()
+    for club_id, member_id, checked_in, event_time in events:
+        cursor.execute("CALL %s(%%s, %%s, %%s, %%s, @found, @checked_in, @changed)" % ('record_checkin' if checked_in else 'record_checkout'),
+                       (club_id, member_id, event_time, open_checkins_since(event_time)))
     conn.commit()
     cursor.close()
-    conn.close()
-    change_member_checkin(member_id, clubhouse_id, True)
+    for club_id in set(event[0] for event in events):
+        invalidate_club_plots(club_id)
 
-# add a new check-out, edits checkins table
+# add a new check-in
+def add_checkin(member_id, clubhouse_id):
+    return set_member_checkin(member_id, clubhouse_id, True)
+
+# add a new check-out
 def add_checkout(member_id, clubhouse_id):
+    return set_member_checkin(member_id, clubhouse_id, False)
+
+# mass checkout, two set-based updates regardless of how many members are checked in
+# with the write-behind queue, queued check-ins are stored first so none of them lands after the checkout
+def checkout_all_from_clubhouse(clubhouse_id):
+    queue = get_checkin_queue()
+    if queue is not None and not queue.drain():
+        application.logger.warning("check-in queue not drained before checking out clubhouse %s", clubhouse_id)
     current_time = datetime.now()
     conn = get_conn()
     cursor = conn.cursor()
-    cursor.execute("""UPDATE checkins
-                      SET checkout_datetime = %s
-                      WHERE member_id = %s
-                      AND clubhouse_id = %s
-                      AND checkout_datetime IS NULL""",
-                      (current_time, member_id, clubhouse_id))
+    close_open_checkins(cursor, current_time, clubhouse_id, opened_after=open_checkins_since(current_time))
+    cursor.execute("""UPDATE members
+                      SET is_checked_in = 0
+                      WHERE clubhouse_id = %s
+                      AND is_checked_in = 1""", (clubhouse_id,))
+    bump_roster_version(cursor, clubhouse_id)
     conn.commit()
     cursor.close()
-    conn.close()
-    change_member_checkin(member_id, clubhouse_id, False)
+    invalidate_club_plots(clubhouse_id)
+    roster_clear(clubhouse_id)
 
-# mass checkout, code repeated for efficiency
-def checkout_all_from_clubhouse(clubhouse_id):
-    current_time = datetime.now()
-    checked_in_members = get_checked_in_members(clubhouse_id)
+### auto-checkout (see autocheckout.py)
+
+# active clubhouses and their time zone names: returns (id, time_zone)
+def get_clubhouse_time_zones(clubhouse_id=None):
     conn = get_conn()
     cursor = conn.cursor()
-    for member_id, mem_name in checked_in_members:
-        cursor.execute("""UPDATE checkins
-                          SET checkout_datetime = %s
-                          WHERE member_id = %s
-                          AND clubhouse_id = %s
-                          AND checkout_datetime IS NULL""",
-                          (current_time, member_id, clubhouse_id))
-        cursor.execute("""UPDATE members
-                      SET is_checked_in = %s
+    if clubhouse_id is None:
+        cursor.execute("SELECT clubhouse_id, time_zone FROM clubhouses WHERE active = 1")
+    else:
+        cursor.execute("SELECT clubhouse_id, time_zone FROM clubhouses WHERE active = 1 AND clubhouse_id = %s", (clubhouse_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+# close every check-in of a clubhouse still open and started before cutoff, with cutoff as the checkout time
+# one set-based pass per clubhouse; idempotent, a second run finds nothing left to close
+# returns the number of check-ins closed
+def auto_checkout_clubhouse(clubhouse_id, cutoff):
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT member_id FROM checkins
                       WHERE clubhouse_id = %s
-                      AND member_id = %s""", (False, clubhouse_id, member_id))
+                      AND checkout_datetime IS NULL
+                      AND checkin_datetime < %s""", (clubhouse_id, cutoff))
+    member_ids = sorted(set(row[0] for row in cursor.fetchall()))
+    closed = 0
+    if member_ids:
+        closed = close_open_checkins(cursor, cutoff, clubhouse_id, opened_before=cutoff)
+        cursor.execute("""UPDATE members
+                          SET is_checked_in = 0
+                          WHERE clubhouse_id = %%s
+                          AND member_id IN (%s)""" % ", ".join(["%s"] * len(member_ids)),
+                          [clubhouse_id] + member_ids)
+        bump_roster_version(cursor, clubhouse_id)
+        conn.commit()
+    cursor.close()
+    if closed:
+        invalidate_club_plots(clubhouse_id)
+        for member_id in member_ids:
+            roster_mark(clubhouse_id, member_id, False)
+    return closed
 
-    conn.commit()
+# drop the per-member events the old enable_auto_checkout created, returns how many were dropped
+def drop_auto_checkout_events():
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT EVENT_NAME FROM information_schema.EVENTS
+                      WHERE EVENT_SCHEMA = DATABASE()
+                      AND EVENT_NAME LIKE 'autocheckoutc%%'""")
+    events = [row[0] for row in cursor.fetchall()]
+    for event in events:
+        cursor.execute("DROP EVENT IF EXISTS `%s`" % event.replace("`", "``"))
     cursor.close()
-    conn.close()
+    return len(events)
 
-def enable_auto_checkout(clubhouse_id):
+### monthly partitions of checkins (see partitions.py)
+
+# the checkins table of .schema.sql, the one definition of its columns and keys, as a CREATE TABLE for
+# table with the monthly partition definitions before pfuture (MySQL wants the partitioning column in
+# every unique key, so the primary key is (checkin_id, checkin_datetime) and checkin_datetime can't be NULL)
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.schema.sql')
+
+def checkins_table_sql(table, definitions):
+    with open(SCHEMA_PATH) as schema:
+        text = schema.read()
+    start = text.index("CREATE TABLE IF NOT EXISTS checkins (")
+    statement = text[start:text.index(";", start)].replace("CREATE TABLE IF NOT EXISTS checkins", "CREATE TABLE %s" % table, 1)
+    future = "PARTITION pfuture VALUES LESS THAN (MAXVALUE)"
+    return statement.replace(future, "".join(definition + ",\n  " for definition in definitions) + future)
+
+# columns copied into the partitioned table, rows without a check-in time get their check-out time
+# (or 1970-01-01) since the partitioned table needs one; {row} is the source table or trigger row (NEW)
+CHECKINS_COPY_COLUMNS = "checkin_id, member_id, checkin_datetime, checkout_datetime, clubhouse_id"
+CHECKINS_COPY_START = "COALESCE({row}.checkin_datetime, {row}.checkout_datetime, '1970-01-01')"
+CHECKINS_COPY_VALUES = ("{row}.checkin_id, {row}.member_id, " + CHECKINS_COPY_START + ", "
+                        "{row}.checkout_datetime, {row}.clubhouse_id")
+
+# partitions of a table in order: returns (name, upper bound as stored by MySQL or 'MAXVALUE', approximate rows)
+# empty when the table does not exist or is not partitioned
+def get_checkin_partitions(table='checkins'):
     conn = get_conn()
     cursor = conn.cursor()
-    members = [x[0] for x in get_clubhouse_members(clubhouse_id)] # only gets list of member_ids
+    cursor.execute("""SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+                      FROM information_schema.PARTITIONS
+                      WHERE TABLE_SCHEMA = DATABASE()
+                      AND TABLE_NAME = %s
+                      AND PARTITION_NAME IS NOT NULL
+                      ORDER BY PARTITION_ORDINAL_POSITION""", (table,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+# split the catch-all partition pfuture into new monthly partitions followed by a new pfuture
+# only pfuture's rows are moved, so this is instant while pfuture is still empty
+def split_future_partition(definitions, table='checkins'):
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""ALTER TABLE %s REORGANIZE PARTITION pfuture INTO (
+                        %s,
+                        PARTITION pfuture VALUES LESS THAN (MAXVALUE))""" % (table, ",\n".join(definitions)))
+    cursor.close()
+
+# time of the earliest check-in, None without check-ins
+def get_first_checkin_time():
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(checkin_datetime) FROM checkins")
+    first = cursor.fetchone()[0]
+    cursor.close()
+    return first
+
+def get_max_checkin_id():
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(checkin_id), 0) FROM checkins")
+    max_id = cursor.fetchone()[0]
+    cursor.close()
+    return max_id
 
-    for member_id in members:
-        event_name = 'autocheckoutc' + str(clubhouse_id) + 'm' + str(member_id)
+### online partitioning of an existing checkins table (see partitions.migrate)
+# triggers mirror every write on checkins into the partitioned copy while the existing rows are copied
+# over in batches, then the two tables swap names in one atomic RENAME
 
-        # set up recurring database event: sketch things: may need to set event-scheduler=ON in mysql config file
-        cursor.execute("""CREATE EVENT IF NOT EXISTS %s
-                            ON SCHEDULE AT addtime(CURDATE(), '23:59:59') + INTERVAL 1 DAY ON COMPLETION PRESERVE ENABLE DO IF ((SELECT checkout_datetime FROM checkins
-                                    WHERE member_id = %%s
-                                    ORDER BY checkin_datetime DESC
-                                    LIMIT 1) = NULL) THEN
-                                    UPDATE checkins
-                                        SET checkout_datetime =  CURRENT_TIMESTAMP
-                                        WHERE member_id = %%s
-                                        ORDER BY checkin_datetime DESC
-                                        LIMIT 1;
-                                END IF
-                                """ % (event_name, ),
-                            (member_id, member_id))
+CHECKINS_COPY_TRIGGERS = ('checkins_copy_insert', 'checkins_copy_update', 'checkins_copy_delete')
+
+# (re)create the empty partitioned copy and the triggers feeding it, dropping what an earlier attempt left
+def start_checkins_copy(table, definitions):
+    conn = get_conn()
+    cursor = conn.cursor()
+    for trigger in CHECKINS_COPY_TRIGGERS:
+        cursor.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+    cursor.execute("DROP TABLE IF EXISTS %s" % table)
+    cursor.execute(checkins_table_sql(table, definitions))
+    values = CHECKINS_COPY_VALUES.format(row='NEW')
+    cursor.execute("""CREATE TRIGGER checkins_copy_insert AFTER INSERT ON checkins FOR EACH ROW
+                      REPLACE INTO %s (%s) VALUES (%s)""" % (table, CHECKINS_COPY_COLUMNS, values))
+    cursor.execute("""CREATE TRIGGER checkins_copy_update AFTER UPDATE ON checkins FOR EACH ROW
+                      REPLACE INTO %s (%s) VALUES (%s)""" % (table, CHECKINS_COPY_COLUMNS, values))
+    cursor.execute("""CREATE TRIGGER checkins_copy_delete AFTER DELETE ON checkins FOR EACH ROW
+                      DELETE FROM %s WHERE checkin_id = OLD.checkin_id""" % table)
+    cursor.close()
+
+# copy the check-ins with after_id < checkin_id <= up_to_id into table, in one short transaction
+# rows the triggers already wrote are newer and are kept (skipped by checkin_id); anything else that
+# conflicts with the copy's keys fails the batch instead of being dropped; returns the number of rows copied
+def copy_checkins(table, after_id, up_to_id):
+    conn = get_conn()
+    cursor = conn.cursor()
+    copied = cursor.execute("""INSERT INTO %s (%s)
+                               SELECT %s FROM checkins
+                               WHERE checkin_id > %%s
+                               AND checkin_id <= %%s
+                               AND NOT EXISTS (SELECT 1 FROM %s AS copied WHERE copied.checkin_id = checkins.checkin_id)"""
+                               % (table, CHECKINS_COPY_COLUMNS, CHECKINS_COPY_VALUES.format(row='checkins'), table),
+                               (after_id, up_to_id))
     conn.commit()
     cursor.close()
-    conn.close()
+    return copied
+
+# check-ins of one member starting at the same time as another of theirs (as the copy stores the start),
+# which the unique key idx_checkins_member_start of the partitioned copy can't hold
+# returns [(clubhouse_id, member_id, start, rows)], the first limit of them
+def get_duplicate_checkins(limit=20):
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""SELECT clubhouse_id, member_id, %s AS start, COUNT(*)
+                      FROM checkins
+                      WHERE clubhouse_id IS NOT NULL
+                      GROUP BY clubhouse_id, member_id, start
+                      HAVING COUNT(*) > 1
+                      LIMIT %%s""" % CHECKINS_COPY_START.format(row='checkins'), (limit,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
 
-# sketch mysql variable thing, recently deleted:
-                            # -- SET @check_row := (SELECT checkout_datetime FROM checkins
-                            # --         WHERE member_id = %%s
-                            # --         ORDER BY checkin_datetime DESC
-                            # --         LIMIT 1);
-                            # --     SELECT @check_row;
+# put the partitioned copy in place of checkins and keep the old table as old_table
+def swap_checkins(table, old_table):
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("RENAME TABLE checkins TO %s, %s TO checkins" % (old_table, table))
+    for trigger in CHECKINS_COPY_TRIGGERS:
+        cursor.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+    cursor.close()
 
 ### admin side ###
 
@@ -339,7 +871,6 @@ def get_clubhouse_from_id(club_id, field="short_name"):
     club_info = cursor.fetchall()
     conn.commit()
     cursor.close()
-    conn.close()
     if len(club_info) > 1:
         application.logger.error("error: found more than two clubhouses with these ids")
     elif len(club_info) < 1:
@@ -358,7 +889,6 @@ def get_all_clubhouses(name="short_name"):
     rows = cursor.fetchall()
     conn.commit()
     cursor.close()
-    conn.close()
     return rows
 
 # check to make sure usernames are distinct
@@ -378,44 +908,27 @@ def check_distinct_clubhouse_usernames(proposed_username):
 
 # adds and creates a clubhouse, similar to add_member
 def add_clubhouse(update_dict):
+    update_dict = dict(update_dict)
+    # set short_name to full_name if short_name does not exist
+    if 'short_name' not in update_dict or len(update_dict['short_name']) == 0:
+        update_dict['short_name'] = update_dict['full_name']
+    columns, values = writable_fields(update_dict, CLUBHOUSE_COLUMNS)
+    pw = generate_password_hash(update_dict['password'])
+
     conn = get_conn()
     cursor = conn.cursor()
-
-    # create clubhouse row
-    cursor.execute("""INSERT INTO clubhouses (clubhouse_id, short_name, full_name)
-                        VALUES (DEFAULT, 'NULL', 'temp_full')""") # may error if other values have no default
-
-    # get this id that we just created
-    cursor.execute("""SELECT LAST_INSERT_ID()""")
-    club_ids = cursor.fetchall()
-    if len(club_ids) != 1:
-        application.logger.error("There should only be one ID.")
-        application.logger.error(club_ids)
-    new_club_id = club_ids[0]
-
-    pw = generate_password_hash(update_dict['password'])
+    # create clubhouse row with every field
+    cursor.execute("""INSERT INTO clubhouses (%s)
+                        VALUES (%s)""" % (", ".join(columns), ", ".join(["%s"] * len(columns))),
+                        values)
+    new_club_id = cursor.lastrowid
 
     # create login row
     cursor.execute("""INSERT INTO logins (user_id, username, password, clubhouse_id, is_admin)
                         VALUES (DEFAULT, %s, %s, %s, DEFAULT)""",
                         (update_dict['username'], pw, new_club_id))
-    # update each field separately
-    for key in update_dict:
-        # logins already done
-        if key == "username" or key == "password":
-            pass
-        # update clubhouse fields
-        else:
-            query = """UPDATE clubhouses
-                        SET %s = %%s
-                        WHERE clubhouse_id = %%s""" % key
-            cursor.execute(query, (update_dict[key], new_club_id))
-    # set short_name to full_name if short_name does not exist
-    if 'short_name' not in update_dict or len(update_dict['short_name']) == 0:
-        cursor.execute("""UPDATE clubhouses SET short_name = %s WHERE clubhouse_id = %s""", (update_dict['full_name'], new_club_id))
     conn.commit()
     cursor.close()
-    conn.close()
     return (_l("Clubhouse added successfully."), new_club_id) # again could be more specific
 
 def delete_clubhouse(club_id):
@@ -439,6 +952,7 @@ def delete_clubhouse(club_id):
                         SET active = 0
                         WHERE clubhouse_id = %s""",
                         (club_id, ))
+    bump_roster_version(cursor, club_id, members=True)
 
     # delete clubhouse login row
     cursor.execute("""DELETE FROM logins
@@ -447,7 +961,9 @@ def delete_clubhouse(club_id):
 
     conn.commit()
     cursor.close()
-    conn.close()
+    invalidate_club_plots(club_id)
+    invalidate_roster(club_id)
+    invalidate_club_users(club_id)
     return _l("Clubhouse removed successfully.")
 
 # get login information
@@ -461,7 +977,6 @@ def get_id_from_username(username):
                     WHERE username = %s""", (username,))
     users = cursor.fetchall()
     cursor.close()
-    conn.close()
     if len(users) == 0: # no such user
         return None
     if len(users) > 1:
@@ -479,7 +994,6 @@ def get_club_id_from_user(user_id = None):
                     WHERE user_id = %s""", (user_id,))
         club_ids = cursor.fetchall()
         cursor.close()
-        conn.close()
         if len(club_ids) != 1:
             application.logger.error("There should be exactly one clubhouse with this user id")
         else:
@@ -494,7 +1008,6 @@ def get_user_id_from_club(club_id):
                     WHERE clubhouse_id = %s""", (club_id,))
     user_ids = cursor.fetchall()
     cursor.close()
-    conn.close()
     if len(user_ids) != 1:
         application.logger.error("Only one clubhouse should have this id.")
     else:
@@ -502,25 +1015,27 @@ def get_user_id_from_club(club_id):
 
 # given id number of user, retrieve user info or tuple of None
 # if last_name is True, members will be listed by last name
-# return (id, username, password hash, club_id, is_admin, last_name)
+# return (id, username, password hash, club_id, is_admin, last_name, club full name)
 # here id is the user login id
+# one query, the clubhouse preferences are joined in
 def get_user_from_id(id_num):
     conn = get_conn()
     cursor = conn.cursor()
-    cursor.execute("""SELECT user_id, username, password, clubhouse_id, is_admin FROM logins
-                    WHERE user_id = %s""", (id_num,))
+    cursor.execute("""SELECT logins.user_id, logins.username, logins.password, logins.clubhouse_id, logins.is_admin,
+                        clubhouses.display_by_last, clubhouses.full_name
+                    FROM logins
+                    LEFT JOIN clubhouses ON clubhouses.clubhouse_id = logins.clubhouse_id
+                    WHERE logins.user_id = %s""", (id_num,))
     users = cursor.fetchall()
+    cursor.close()
     if len(users) != 1:
         application.logger.error("There should be exactly one user with this user id.")
     else:
-        u_id, username, password, club_id, is_admin = users[0]
+        u_id, username, password, club_id, is_admin, last_name, full_name = users[0]
         if is_admin:
             last_name = False
-        else:
-            # get user preference for name display order
-            last_name = get_clubhouse_from_id(club_id, field="display_by_last")
-        return (u_id, username, password, club_id, is_admin, last_name)
-    return (None, None, None, None, None, None)
+        return (u_id, username, password, club_id, is_admin, last_name, full_name)
+    return (None, None, None, None, None, None, None)
 
 # HELPER FUNCTION: also removes empty fields
 def convert_form_to_dict(form, to_remove):
@@ -553,7 +1068,7 @@ def update_password(id_num, password):
                         (pw, id_num))
     conn.commit()
     cursor.close()
-    conn.close()
+    invalidate_user(id_num)
 
 # update clubhouse info given clubhouse id
 def update_club_info(club_id, full_name, short_name, display_by_last = None):
@@ -582,4 +1097,4 @@ def update_club_info(club_id, full_name, short_name, display_by_last = None):
 #                            (join_date, club_id))
     conn.commit()
     cursor.close()
-    conn.close()
+    invalidate_club_users(club_id)
@@ -0,0 +1,149 @@
+# live roster updates for check-in kiosks, streamed as server-sent events from /clubhouse/checkin/events
+# roster.py publishes a compact delta after every check-in and check-out ({"id", "in", "time"}), mass
+# checkout ({"all_out", "time"}) and member list change ({"reset", "time"}); with ROSTER_REDIS_URL the deltas
+# travel over redis pub/sub so kiosks on every worker get them, otherwise only kiosks connected to the
+# worker that made the change do, plus, with ROSTER_EVENTS_POLL, a reset whenever the clubhouse's
+# roster_version moves (for a separate events service that doesn't make the changes itself)
+# every open stream waits on its own small queue: on the gevent events service (see Procfile) that is a
+# parked greenlet, so hundreds of idle kiosks cost a little memory each instead of a worker each
+
+import json
+import queue
+import threading
+import time
+from application import application
+
+KEEPALIVE = 15 # seconds between comment lines, keeps idle connections open through proxies
+BACKLOG = 100 # deltas a slow connection may fall behind before it is told to reload its lists
+
+# fan-out to the streams connected to this worker
+# poll is the number of seconds between roster_version reads of the clubhouses with open streams, 0 for none
+class Broker:
+    def __init__(self, poll=0):
+        self.lock = threading.Lock()
+        self.subscribers = {} # club id -> set of queues, one per open stream
+        self.poll = poll
+        self.watcher = None
+
+    def subscribe(self, club_id):
+        if self.poll:
+            with self.lock:
+                if self.watcher is None or not self.watcher.is_alive():
+                    self.watcher = threading.Thread(target=self.watch, name='roster-versions', daemon=True)
+                    self.watcher.start()
+        deltas = queue.Queue(BACKLOG)
+        with self.lock:
+            self.subscribers.setdefault(club_id, set()).add(deltas)
+        return deltas
+
+    def unsubscribe(self, club_id, deltas):
+        with self.lock:
+            streams = self.subscribers.get(club_id)
+            if streams is not None:
+                streams.discard(deltas)
+                if not streams:
+                    del self.subscribers[club_id]
+
+    # hand a delta to this worker's streams of a clubhouse; a stream that fell too far behind gets a reset
+    def deliver(self, club_id, delta):
+        with self.lock:
+            streams = list(self.subscribers.get(club_id, ()))
+        for deltas in streams:
+            try:
+                deltas.put_nowait(delta)
+            except queue.Full:
+                with deltas.mutex:
+                    deltas.queue.clear()
+                deltas.put_nowait({'reset': True, 'time': delta['time']})
+
+    def publish(self, club_id, delta):
+        self.deliver(club_id, delta)
+
+    def connections(self):
+        with self.lock:
+            return sum(len(streams) for streams in self.subscribers.values())
+
+    # tell the streams of a clubhouse to reload their lists when its roster_version moved since the last read
+    # (changes made by other processes), one primary-key read per clubhouse and poll
+    def watch(self):
+        from application.db import get_roster_versions
+        seen = {}
+        while True:
+            time.sleep(self.poll)
+            with self.lock:
+                club_ids = list(self.subscribers)
+            try:
+                with application.app_context(): # one pooled connection for every clubhouse
+                    for club_id in club_ids:
+                        version = get_roster_versions(club_id)[0]
+                        if seen.get(club_id, version) != version:
+                            self.deliver(club_id, {'reset': True, 'time': int(time.time())})
+                        seen[club_id] = version
+            except Exception:
+                application.logger.exception("reading roster versions failed, retrying")
+            for club_id in set(seen).difference(club_ids):
+                del seen[club_id]
+
+# shared across workers through redis pub/sub (optional dependency); each worker runs one listener
+# thread, started with its first stream, that delivers every clubhouse's deltas to its own streams
+class RedisBroker(Broker):
+    CHANNEL = 'roster:%s:events'
+
+    def __init__(self, url):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.listener = None
+
+    def publish(self, club_id, delta):
+        self.redis.publish(self.CHANNEL % club_id, json.dumps(delta))
+
+    def subscribe(self, club_id):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name='roster-events', daemon=True)
+                self.listener.start()
+        return super().subscribe(club_id)
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.CHANNEL % '*')
+                for message in pubsub.listen():
+                    club_id = int(message['channel'].split(':')[1])
+                    self.deliver(club_id, json.loads(message['data']))
+            except Exception:
+                # deltas published while disconnected are lost, kiosks reload their lists on the reset
+                application.logger.exception("roster event listener lost redis, reconnecting")
+                for club_id in list(self.subscribers):
+                    self.deliver(club_id, {'reset': True, 'time': int(time.time())})
+                time.sleep(1)
+
+if application.config['ROSTER_REDIS_URL']:
+    broker = RedisBroker(application.config['ROSTER_REDIS_URL'])
+else:
+    broker = Broker(application.config['ROSTER_EVENTS_POLL'])
+
+# called by roster.py after each change; a lost delta only delays a kiosk until its next list refresh
+def publish(club_id, **delta):
+    delta['time'] = int(time.time())
+    try:
+        broker.publish(club_id, delta)
+    except Exception:
+        application.logger.exception("could not publish roster event for clubhouse %s", club_id)
+
+# the text/event-stream body of one kiosk connection, runs until the client goes away
+def stream(club_id):
+    deltas = broker.subscribe(club_id)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                delta = deltas.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield "data: %s\n\n" % json.dumps(delta)
+    finally:
+        broker.unsubscribe(club_id, deltas)
@@ -0,0 +1,86 @@
+# check-in history export for /admin/export and /clubhouse/export
+# rows come from db.stream_checkins in batches and are encoded one batch at a time,
+# so a multi-year network-wide export uses the same memory as a one-day one
+
+import csv
+import io
+from datetime import datetime, timedelta
+from .db import stream_checkins
+
+# format key -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows')
+}
+
+# Arrow IPC needs pyarrow, which is optional
+def arrow_available():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+def csv_chunks(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def arrow_type(pa, column):
+    if column.endswith('_id'):
+        return pa.int64()
+    if column.endswith('_datetime'):
+        return pa.timestamp('s')
+    if column in ('join_date', 'birthday'):
+        return pa.date32()
+    return pa.string()
+
+# Arrow IPC stream: a schema message followed by one record batch per database batch
+def arrow_chunks(columns, batches):
+    import pyarrow as pa
+    schema = pa.schema([(column, arrow_type(pa, column)) for column in columns])
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for rows in batches:
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+# response body: iterates over the encoded chunks, close() also gives the database connection back
+class ExportStream:
+    def __init__(self, chunks, rows):
+        self.chunks = chunks
+        self.rows = rows
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        self.chunks.close()
+        self.rows.close()
+
+# returns (response body, mimetype, filename)
+# start_date and end_date are inclusive dates, clubhouse_id None exports every clubhouse
+def export_checkins(start_date, end_date, data_format='csv', clubhouse_id=None, demographics=False):
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+    rows = stream_checkins(start, end, clubhouse_id, demographics)
+    mimetype, extension = EXPORT_FORMATS[data_format]
+    if data_format == 'arrow':
+        chunks = arrow_chunks(rows.columns, iter(rows))
+    else:
+        chunks = csv_chunks(rows.columns, iter(rows))
+    scope = "all" if clubhouse_id is None else "clubhouse-%s" % clubhouse_id
+    filename = "checkins-%s-%s-to-%s.%s" % (scope, start_date.isoformat(), end_date.isoformat(), extension)
+    return ExportStream(chunks, rows), mimetype, filename
@@ -1,11 +1,13 @@
 # login form and checkin form
 
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectField, HiddenField, DateField
-from wtforms.validators import DataRequired, Optional, EqualTo, Length
+from wtforms.validators import DataRequired, Optional, EqualTo, Length, ValidationError
 from flask_babel import lazy_gettext as _l
-from helpers import binary_search
 from .db import *
+from .roster import get_roster
+from .search import get_member_index, PAGE_SIZE
 from application import application
 
 # login forms
@@ -26,7 +28,25 @@ class MemberViewForm(FlaskForm):
     edit = SubmitField(_l("View/Edit"))
     new_member = SubmitField(_l("New Member"))
 
+# one page of member search results for a clubhouse, see search.py
+# status is 'all', 'in' (checked in) or 'out' (checked out)
+# returns ([(id, name)], whether more pages follow)
+def search_members(clubhouse, query="", status="all", page=0, display_last=False):
+    index = get_member_index(clubhouse, get_clubhouse_members)
+    keep = None
+    if status in ("in", "out"):
+        members_in, members_out = get_roster(clubhouse, get_clubhouse_roster).lists()
+        keep = set(members_in if status == "in" else members_out)
+    return index.search(query, keep, page, display_last=display_last)
+
+# sort strings of search results, for the options search.js adds to the check-in lists
+def search_order(clubhouse, query, mem_ids):
+    index = get_member_index(clubhouse, get_clubhouse_members)
+    with index.lock:
+        return [index.sort_string(mem_id, query) if mem_id in index else None for mem_id in mem_ids] # None: removed meanwhile
+
 # wrapper class for MemberViewForm
+# the page starts with the first page of members, the search box (search.js) fetches the rest
 class MemberManager:
     def __init__(self, clubhouse=None, display_last=False):
         if clubhouse:
@@ -35,13 +55,14 @@ class MemberManager:
             self.clubhouse = 1 # for testing only
         self.member_form = MemberViewForm()
         self.display_last = display_last
-        # get all members in desired format
-        if self.display_last:
-            self.memberlist = [(num, last + ", " + first) for num, first, last in get_clubhouse_members(self.clubhouse)]
-        else:
-            self.memberlist = [(num, first + " " + last) for num, first, last in get_clubhouse_members(self.clubhouse)]
+        self.memberlist, self.more = search_members(self.clubhouse, display_last=self.display_last)
+        # a submitted member may come from a later page, accept it if it belongs to the clubhouse
+        selected = self.member_form.memberselect.data
+        index = get_member_index(self.clubhouse, get_clubhouse_members)
+        if selected in index and str(selected) not in dict(self.memberlist):
+            self.memberlist.append((str(selected), index.display(str(selected), self.display_last)))
         # set member list selection options
-        self.member_form.memberselect.choices = self.memberlist
+        self.member_form.memberselect.choices = [(int(num), name) for num, name in self.memberlist]
 
 # form and handler for adding or editing member
 class MemberAddForm(FlaskForm):
@@ -69,6 +90,12 @@ class MemberAddForm(FlaskForm):
     cancel_btn = SubmitField(_l('Cancel'))
     delete_btn = SubmitField(_l('Remove Member'))
 
+# bulk import of a member file, see importer.py
+class MemberImportForm(FlaskForm):
+    member_file = FileField(_l('Member File (CSV or XLSX)'), validators = [FileRequired(), FileAllowed(['csv', 'xlsx'], _l('Please upload a .csv or .xlsx file.'))])
+    import_btn = SubmitField(_l('Import Members'))
+    cancel_btn = SubmitField(_l('Cancel'))
+
 # handle form pre-population, loading data, etc.
 class MemberInfoHandler:
     def __init__(self, data):
@@ -116,6 +143,19 @@ class MemberInfoHandler:
         if guardianphone:
             self.form.guardian_phone.render_kw = {'value': guardianphone}
 
+# check-in history export, see export.py
+class CheckinExportForm(FlaskForm):
+    clubhouse = SelectField(_l("Clubhouse"), choices = [], coerce = int) # admin only, 0 is every clubhouse
+    start_date = DateField(_l('From (y-m-d)'), format='%Y-%m-%d', validators = [DataRequired()])
+    end_date = DateField(_l('To (y-m-d)'), format='%Y-%m-%d', validators = [DataRequired()])
+    data_format = SelectField(_l("File format"), choices = [('csv', _l("CSV")), ('arrow', _l("Arrow IPC stream"))])
+    demographics = BooleanField(_l('Include member demographics'))
+    export_btn = SubmitField(_l('Export'))
+
+    def validate_end_date(self, field):
+        if self.start_date.data and field.data and field.data < self.start_date.data:
+            raise ValidationError(_l("The end date must not be before the start date."))
+
 # forms to view and manage clubhouses
 
 # these are mostly copied from the member view
@@ -190,77 +230,47 @@ class CheckinForm(FlaskForm):
     all_check_out = SubmitField(_l('Check Out All Students'))
 
 # handle all check in/out operations
+# the member lists live in the clubhouse's shared roster (roster.py), this only binds them to the form
 class CheckinManager:
     def __init__(self, clubhouse=None, display_last=False):
         self.check_in_form = CheckinForm()
+        self.display_last = display_last # whether to display last name first
         if clubhouse:
             self.clubhouse = clubhouse # clubhouse is id number
-            self.display_last = display_last # whether to display last name first
-            # get list of all members and key by member id
-            self.id_to_name = {}
-            self.members_out = []
-            for mem_id, first, last in get_clubhouse_members(self.clubhouse):
-                # separate first and last names for sorting purposes
-                self.id_to_name[str(mem_id)] = (first, last)
-                # list is already sorted, initialize members_out here
-                self.members_out.append(self.get_member_display(mem_id))
-            self.members_in = []
-            # parse checked-in members and remove them from checked-out list
-            for mem_id, name in get_checked_in_members(self.clubhouse):
-                member = self.get_member_display(mem_id)
-                self.members_in.append(member)
-                self.members_out.remove(member)
-            # uncomment if sorting is broken
-#            self.members_in.sort(key = lambda x: self.id_to_name[x[0]][1] + ", " + self.id_to_name[x[0]][0])
-        if not clubhouse: # testing purposes
-            self.members_in = [(123,"manager signed-in 1"), (234,"manager signed-in 2")]
-            self.members_out = [(12,"manager signed-out 3"),(23,"manager signed-out 4")]
-            # dictionary linking member id to member name
-            self.id_to_name = {
-                    123: "manager signed-in 1",
-                    234: "manager signed-in 2",
-                    12: "manager signed-out 3",
-                    23: "manager signed-out 4"}
+            self.roster = get_roster(self.clubhouse, get_clubhouse_roster)
+        if not clubhouse: # testing purposes, uses a local roster for clubhouse 0
+            self.clubhouse = 0
+            self.roster = get_roster(self.clubhouse, lambda club_id: [
+                (12, "manager", "signed-out 3", False), (23, "manager", "signed-out 4", False),
+                (123, "manager", "signed-in 1", True), (234, "manager", "signed-in 2", True)])
         self.setfields()
 
-    # reset the SelectField choices
+    # reset the SelectField choices to the first page of each list, search.js fetches the rest
     def setfields(self):
-        self.check_in_form.check_in_id.choices = self.members_out
-        self.check_in_form.check_out_id.choices = self.members_in
+        members_in, members_out = self.roster.lists(PAGE_SIZE + 1)
+        self.more_out = len(members_out) > PAGE_SIZE
+        self.more_in = len(members_in) > PAGE_SIZE
+        self.check_in_form.check_in_id.choices = self.roster.choices(members_out[:PAGE_SIZE], self.display_last)
+        self.check_in_form.check_out_id.choices = self.roster.choices(members_in[:PAGE_SIZE], self.display_last)
 
     # return (id_num, first last) or (id_num, last first)
-    # id_num gets cast to a string
+    # id_num gets cast to a string; a member the roster doesn't know yet (added since it was built) is looked up
     def get_member_display(self, id_num):
-        mem_id = str(id_num)
-        first, last = self.id_to_name[mem_id]
-        if self.display_last:
-            return (mem_id, last + ", " + first)
-        return (mem_id, first + " " + last)
+        choices = self.roster.display([str(id_num)], self.display_last)
+        if choices:
+            return choices[0]
+        first, last = get_specific_member(self.clubhouse, id_num, short_form=True)
+        return (str(id_num), last + ", " + first if self.display_last else first + " " + last)
 
-    # check in member id_num
-    # move from out list to in list
+    # check in member id_num, db.add_checkin moves them in the shared roster
+    # repeating it (double tap, form resubmission) changes nothing
+    # returns (checked_in, changed), None if id_num is not a member of this clubhouse
     def checkin_member(self, id_num):
-        # extract member to be removed
-        member = self.get_member_display(id_num)
-        self.members_out.remove(member)
-        # check-in to database
-        add_checkin(id_num, self.clubhouse)
-        # insert member into sorted members_in list
-        # x[0] gets member id, the rest gets last, first for sorting order
-        self.members_in.insert(binary_search(self.members_in, member, key = lambda x: self.id_to_name[x[0]][1].lower() + ", " + self.id_to_name[x[0]][0].lower()), member)
-#        self.members_in.insert(binary_search(self.members_in, self.id_to_name[id_num], key = lambda x: x[1]), member)
-        self.setfields() # update visual
+        return add_checkin(id_num, self.clubhouse)
 
-    # check out member id_num
-    # move from in list to out list
+    # check out member id_num, same as checkin_member
     def checkout_member(self, id_num):
-        # extract member to be removed
-        member = self.get_member_display(id_num)
-        self.members_in.remove(member)
-        add_checkout(id_num, self.clubhouse)
-        self.members_out.insert(binary_search(self.members_out, member, key = lambda x: self.id_to_name[x[0]][1].lower() + ", " + self.id_to_name[x[0]][0].lower()), member)
-#       self.members_out.insert(binary_search(self.members_out, self.id_to_name[id_num], key = lambda x: x[1]), member)
-        self.setfields()
+        return add_checkout(id_num, self.clubhouse)
 
     # checks out all currently checked in students
     # not used
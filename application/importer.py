@@ -0,0 +1,103 @@
+# bulk member import from CSV or XLSX files, used by /clubhouse/importmembers and `flask import-members`
+# rows are streamed, validated one at a time and inserted in chunks, so memory does not grow with the file
+
+import codecs
+import csv
+from datetime import date, datetime
+from pymysql import MySQLError
+from .db import MEMBER_COLUMNS, add_members_bulk
+
+REQUIRED_COLUMNS = ('first_name', 'last_name')
+DATE_COLUMNS = ('join_date', 'birthday')
+MAX_REPORTED_ERRORS = 1000 # errors past this are only counted
+
+# header cell to column name: "First Name" -> first_name
+def normalize_header(header):
+    return "_".join(str(header or "").strip().lower().split())
+
+# yield one dictionary per data row, keyed by normalized header
+# uploads arrive as a SpooledTemporaryFile, which io.TextIOWrapper only accepts from Python 3.11 on (it
+# lacks readable() before), a codecs reader only needs read()
+def read_csv(stream):
+    text = codecs.getreader('utf-8-sig')(stream)
+    reader = csv.reader(text)
+    header = [normalize_header(cell) for cell in next(reader, [])]
+    for row in reader:
+        yield dict(zip(header, row))
+
+def read_xlsx(stream):
+    from openpyxl import load_workbook # optional dependency, only needed for spreadsheets
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [normalize_header(cell) for cell in next(rows, ())]
+        for row in rows:
+            yield dict(zip(header, row))
+    finally:
+        workbook.close()
+
+def read_rows(stream, filename):
+    if filename.lower().endswith('.xlsx'):
+        return read_xlsx(stream)
+    return read_csv(stream)
+
+# one data row to a tuple in MEMBER_COLUMNS order, raises ValueError with a readable message
+def validate_row(row):
+    values = []
+    for column in MEMBER_COLUMNS:
+        value = row.get(column)
+        if isinstance(value, datetime):
+            value = value.date()
+        elif isinstance(value, str):
+            value = value.strip() or None
+        elif value is not None and not isinstance(value, date):
+            value = str(value)
+        if column in DATE_COLUMNS and isinstance(value, str):
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError("%s must be a y-m-d date, got %r" % (column, value))
+        if column in REQUIRED_COLUMNS and not value:
+            raise ValueError("%s is required" % column)
+        values.append(value)
+    return tuple(values)
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = [] # (line number, message), the header is line 1
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+# insert the rows of an open file into a clubhouse, chunk_size rows per transaction
+# a chunk the database rejects is retried row by row so only the bad rows are reported
+def import_members(club_id, stream, filename, chunk_size=500):
+    result = ImportResult()
+    chunk = [] # (line, values)
+    for line, row in enumerate(read_rows(stream, filename), start=2):
+        if not any(value not in (None, "") for value in row.values()):
+            continue # blank line
+        try:
+            chunk.append((line, validate_row(row)))
+        except ValueError as e:
+            result.error(line, str(e))
+        if len(chunk) >= chunk_size:
+            insert_chunk(club_id, chunk, result)
+            chunk = []
+    if chunk:
+        insert_chunk(club_id, chunk, result)
+    return result
+
+def insert_chunk(club_id, chunk, result):
+    try:
+        result.imported += add_members_bulk(club_id, [values for line, values in chunk])
+    except MySQLError:
+        for line, values in chunk:
+            try:
+                result.imported += add_members_bulk(club_id, [values])
+            except MySQLError as e:
+                result.error(line, str(e.args[-1]) if e.args else str(e))
@@ -0,0 +1,156 @@
+# per-request database instrumentation
+# db.get_conn() hands out connections wrapped by InstrumentedConnection, whose cursors time every statement
+# into flask.g; at the end of each request one structured log line is written and the per-worker
+# counters served at /metrics (Prometheus text format) are updated
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from application import application, pool
+
+request_log = logging.getLogger(application.logger.name + '.requests')
+request_log.setLevel(logging.INFO)
+
+### wrappers
+
+class InstrumentedConnection:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def cursor(self, *args):
+        return InstrumentedCursor(self.raw.cursor(*args))
+
+    def __getattr__(self, name): # commit, rollback, ...
+        return getattr(self.raw, name)
+
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return self.cursor.execute(query, args)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, args):
+        started = time.perf_counter()
+        try:
+            return self.cursor.executemany(query, args)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def __getattr__(self, name): # fetchall, lastrowid, close, ...
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+### per-request statistics, kept on flask.g
+
+def db_stats():
+    if 'db_stats' not in g:
+        g.db_stats = {'queries': 0, 'db_seconds': 0.0, 'acquire_seconds': 0.0,
+                      'slowest_seconds': 0.0, 'slowest': None, 'statements': Counter()}
+    return g.db_stats
+
+# query is the statement template (before parameters), so repeats of one statement count together
+def record_query(query, seconds):
+    stats = db_stats()
+    stats['queries'] += 1
+    stats['db_seconds'] += seconds
+    stats['statements'][query] += 1
+    if seconds > stats['slowest_seconds']:
+        stats['slowest_seconds'] = seconds
+        stats['slowest'] = query
+
+def record_acquire(seconds):
+    db_stats()['acquire_seconds'] += seconds
+
+# statements run at least DB_N_PLUS_ONE_THRESHOLD times in one request: [(statement, count)]
+def repeated_statements(stats):
+    threshold = application.config['DB_N_PLUS_ONE_THRESHOLD']
+    if not threshold:
+        return []
+    return [(query, count) for query, count in stats['statements'].most_common() if count >= threshold]
+
+def one_line(query, limit=200):
+    return " ".join(query.split())[:limit]
+
+### per-worker counters for /metrics
+
+counters_lock = threading.Lock()
+counters = {} # (metric name, endpoint) -> value
+
+observers = [] # callables given each request summary, e.g. the benchmark (see benchmark.py)
+
+def add_counter(name, endpoint, value):
+    key = (name, endpoint)
+    counters[key] = counters.get(key, 0) + value
+
+@application.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@application.after_request
+def log_request(response):
+    if 'request_started' not in g:
+        return response
+    duration = time.perf_counter() - g.request_started
+    stats = db_stats()
+    endpoint = request.endpoint or 'unknown'
+    repeated = repeated_statements(stats)
+    with counters_lock:
+        add_counter('clubhouse_requests_total', endpoint, 1)
+        add_counter('clubhouse_request_seconds_total', endpoint, duration)
+        add_counter('clubhouse_db_queries_total', endpoint, stats['queries'])
+        add_counter('clubhouse_db_seconds_total', endpoint, stats['db_seconds'])
+        add_counter('clubhouse_db_acquire_seconds_total', endpoint, stats['acquire_seconds'])
+        add_counter('clubhouse_db_repeated_statements_total', endpoint, len(repeated))
+    summary = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'ms': round(duration * 1000, 2),
+        'queries': stats['queries'],
+        'db_ms': round(stats['db_seconds'] * 1000, 2),
+        'acquire_ms': round(stats['acquire_seconds'] * 1000, 2),
+        'slowest_ms': round(stats['slowest_seconds'] * 1000, 2),
+        'slowest': one_line(stats['slowest']) if stats['slowest'] else None,
+        'n_plus_one': [[one_line(query), count] for query, count in repeated]
+    }
+    request_log.info(json.dumps(summary))
+    for observer in observers:
+        observer(summary)
+    return response
+
+HELP = {
+    'clubhouse_requests_total': "Requests handled by this worker.",
+    'clubhouse_request_seconds_total': "Time spent handling requests.",
+    'clubhouse_db_queries_total': "Database statements executed.",
+    'clubhouse_db_seconds_total': "Time spent executing database statements.",
+    'clubhouse_db_acquire_seconds_total': "Time spent waiting for a pooled connection.",
+    'clubhouse_db_repeated_statements_total': "Statements repeated past DB_N_PLUS_ONE_THRESHOLD within one request (N+1 patterns).",
+}
+
+# counters of this worker in the Prometheus text format, plus the pool gauges
+def prometheus_text():
+    lines = []
+    with counters_lock:
+        snapshot = dict(counters)
+    for name in HELP:
+        lines.append("# HELP %s %s" % (name, HELP[name]))
+        lines.append("# TYPE %s counter" % name)
+        for (metric, endpoint), value in sorted(snapshot.items()):
+            if metric == name:
+                lines.append('%s{endpoint="%s"} %s' % (name, endpoint, value))
+    for key, value in sorted(pool.stats().items()):
+        kind = 'gauge' if key in ('size', 'open', 'idle', 'in_use') else 'counter'
+        lines.append("# TYPE clubhouse_pool_%s %s" % (key, kind))
+        lines.append("clubhouse_pool_%s %s" % (key, value))
+    return "\n".join(lines) + "\n"
@@ -5,25 +5,31 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from .db import *
+from .cache import cached_user, cache_user
 from application import login_manager
 
+# runs on every authenticated request, users are cached per worker while the shared version allows (see cache.py)
 @login_manager.user_loader
 def load_user(id_num):
-    user = User(int(id_num))
-    if user.id:
-        return user
-    return None
+    id_num = int(id_num)
+    user, version = cached_user(id_num)
+    if user is None:
+        user = User(id_num)
+        if not user.id:
+            return None
+        cache_user(id_num, user, version)
+    return user
 
 # user class, this is needed for compatibility with flask-login
 class User(UserMixin):
     def __init__(self, id_num):
         super()
         # get user information
-        num, username, password_hash, club_id, is_admin, last_name = get_user_from_id(id_num)
+        num, username, password_hash, club_id, is_admin, last_name, full_name = get_user_from_id(id_num)
         if username: # valid id
             self.username = username
             self.id = id_num
-            self.hash = password_hash
+            self.club_id = club_id
             self.last_name_first = last_name
             # set user access level
             if is_admin:
@@ -32,11 +38,12 @@ class User(UserMixin):
             else:
                 self.access = "clubhouse"
                 # display full name of clubhouse
-                self.name = get_clubhouse_from_id(club_id, field="full_name")
+                self.name = full_name
         else: # this shouldn't happen
             self.id = None
 
+    # the hash is read fresh, a cached user never carries an old one
     def check_password(self, password):
-        if check_password_hash(self.hash, password): # correct combo
+        if check_password_hash(get_user_from_id(self.id)[2], password): # correct combo
             return True
         return False
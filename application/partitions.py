@@ -0,0 +1,86 @@
+# monthly partitions of checkins on checkin_datetime (p202610 holds October 2026), plus a catch-all pfuture
+# every check-in query in db.py that is bounded by date (dashboards, rollup totals, exports, and the open
+# check-in lookups limited to OPEN_CHECKIN_DAYS) only reads the partitions it overlaps, so open check-ins
+# are found in the newest month while years of closed history stay in partitions nothing touches
+# `flask roll-partitions` creates the coming months ahead of time (see cli.py); `flask partition-checkins`
+# converts an existing unpartitioned table while the site keeps running
+
+from datetime import date, datetime
+from .db import (get_checkin_partitions, split_future_partition, get_first_checkin_time, get_max_checkin_id,
+                 get_duplicate_checkins, start_checkins_copy, copy_checkins, swap_checkins)
+
+COPY_TABLE = 'checkins_partitioned' # the partitioned copy filled by migrate()
+OLD_TABLE = 'checkins_unpartitioned' # where migrate() leaves the original table
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+# first day of the month months_ahead months after now's
+def months_after(now, months_ahead):
+    month = month_start(now)
+    for _ in range(months_ahead):
+        month = next_month(month)
+    return month
+
+# partition definitions for every month from first to last (first days of months), both included
+def month_definitions(first, last):
+    definitions = []
+    month = first
+    while month <= last:
+        definitions.append("PARTITION p%s VALUES LESS THAN ('%s')" % (month.strftime('%Y%m'), next_month(month).isoformat()))
+        month = next_month(month)
+    return definitions
+
+# upper bound (a date) of the last monthly partition, None when there is only pfuture
+# MySQL stores the bounds quoted, e.g. '2026-11-01' or '2026-11-01 00:00:00'
+def last_bound(partitions):
+    bounds = [bound for name, bound, rows in partitions if bound != 'MAXVALUE']
+    if not bounds:
+        return None
+    return datetime.strptime(bounds[-1].strip("'")[:10], '%Y-%m-%d').date()
+
+# make sure checkins has a partition for every month up to months_ahead months from now
+# a table with only pfuture (new databases, see .schema.sql) gets partitions from its first check-in on
+# returns the partition definitions added, None when checkins is not partitioned
+def roll(months_ahead=3, now=None):
+    now = now or datetime.now()
+    partitions = get_checkin_partitions()
+    if not partitions:
+        return None
+    first = last_bound(partitions) or month_start(get_first_checkin_time() or now)
+    definitions = month_definitions(first, months_after(now, months_ahead))
+    if definitions:
+        split_future_partition(definitions)
+    return definitions
+
+# partition an existing checkins table without blocking the site: copy it into a partitioned table in
+# batches of batch_size rows while triggers mirror new writes, then swap the tables
+# progress(copied up to id, last id, rows copied) is called after every batch
+# returns the number of rows copied; raises ValueError when checkins is already partitioned, or holds
+# check-ins the copy's unique key (clubhouse, member, check-in time) would reject, before copying anything
+def migrate(batch_size=10000, months_ahead=3, now=None, progress=None):
+    now = now or datetime.now()
+    if get_checkin_partitions():
+        raise ValueError("checkins is already partitioned")
+    duplicates = get_duplicate_checkins()
+    if duplicates:
+        raise ValueError("checkins has members with several check-ins starting at the same time, which the partitioned "
+                         "table can't hold; merge or remove them first (see migrations/005_checkin_queue_key.sql):\n" +
+                         "\n".join("clubhouse %s, member %s, %s: %d rows" % row for row in duplicates))
+    first = month_start(get_first_checkin_time() or now)
+    start_checkins_copy(COPY_TABLE, month_definitions(first, months_after(now, months_ahead)))
+    # rows past last_id are written by the triggers
+    last_id = get_max_checkin_id()
+    copied_to = copied = 0
+    while copied_to < last_id:
+        up_to = min(copied_to + batch_size, last_id)
+        rows = copy_checkins(COPY_TABLE, copied_to, up_to)
+        copied += rows
+        copied_to = up_to
+        if progress:
+            progress(copied_to, last_id, rows)
+    swap_checkins(COPY_TABLE, OLD_TABLE)
+    return copied
@@ -1,210 +1,294 @@
-import matplotlib.pyplot as plt, mpld3
+import os
+import resource
+import signal
+import threading
+import numpy as np
 import datetime as dt
+from contextlib import contextmanager
+from application import application
 from .db import *
-
-def plot(time_range, data_format, club_id = None, member_id = None):
-    if club_id == None:
-        rows = get_all_checkins()
-    elif member_id == None:
-        rows = get_checkins_by_clubhouse(club_id)
+from .cache import plot_cache
+
+# matplotlib and mpld3 are only needed for the no-JavaScript fallback (the dashboards draw JSON series),
+# so they are imported on first use instead of at worker boot; figures are drawn on the Agg canvas
+# through the object-oriented API, pyplot (and its global list of open figures) is never used
+# dates are drawn with Axes.plot on datetime values, which gives a date axis (Axes.plot_date is gone from matplotlib 3.9 on)
+_plotting = None
+
+def plotting():
+    global _plotting
+    if _plotting is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        import mpld3
+        _plotting = (Figure, FigureCanvasAgg, mpld3)
+    return _plotting
+
+# worker memory, sampled after every server-side render and reported by /admin/stats
+render_stats = {'renders': 0, 'rss_kb': 0, 'rss_watermark_kb': 0}
+render_lock = threading.Lock()
+
+# current resident memory of this process, peak RSS where /proc is not available
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# owns a figure for the duration of one render: yields (figure, axes, mpld3) and tears the figure down after
+@contextmanager
+def rendering():
+    Figure, FigureCanvasAgg, mpld3 = plotting()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    try:
+        yield fig, fig.subplots(), mpld3
+    finally:
+        fig.clear()
+        record_render()
+
+# past PLOT_RSS_LIMIT_MB the worker asks to be replaced, gunicorn finishes the current request first
+def record_render():
+    rss = rss_kb()
+    with render_lock:
+        render_stats['renders'] += 1
+        render_stats['rss_kb'] = rss
+        render_stats['rss_watermark_kb'] = max(render_stats['rss_watermark_kb'], rss)
+    limit = application.config['PLOT_RSS_LIMIT_MB']
+    if limit and rss > limit * 1024:
+        application.logger.warning("worker %d uses %d kB after rendering a plot, over PLOT_RSS_LIMIT_MB, restarting", os.getpid(), rss)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+# how far back each time range looks
+delta = {'1': dt.timedelta(hours=24), '7': dt.timedelta(days=7), '30': dt.timedelta(days=30), '365': dt.timedelta(days=365)}
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# the database does the filtering and grouping, the functions below only shape the buckets for plotting
+# clubhouse and network views read the hourly rollups, member views group that member's raw check-ins
+
+def checkin_counts(start, bucket, club_id = None, member_id = None):
+    if member_id == None:
+        return get_rollup_counts(start, bucket, club_id)
+    return get_checkin_counts(start, bucket, club_id, member_id)
+
+def checkin_totals(start, club_id = None, member_id = None):
+    if member_id == None:
+        return get_rollup_totals(start, club_id)
+    return get_checkin_totals(start, club_id, member_id)
+
+### bucketing engine
+# query rows are loaded once into columnar arrays (datetime64 or int keys, float values)
+# and every view is shaped from them with vectorized numpy operations
+
+# split (key, value) rows into a key array and a float value array
+def columns(rows, key_dtype='datetime64[s]'):
+    if len(rows) == 0:
+        return np.empty(0, dtype=key_dtype), np.empty(0)
+    keys, values = zip(*rows)
+    return np.array(keys, dtype=key_dtype), np.array(values, dtype=float)
+
+# ascending bucket starts covering a time range: hours for '1', days otherwise
+# returns (axis, start of the oldest bucket, start of the current bucket)
+def bucket_axis(time_range, now):
+    if time_range == '1':
+        current = now.replace(minute=0, second=0, microsecond=0)
+        steps = np.arange(-24, 1) * np.timedelta64(1, 'h')
     else:
-        rows = get_checkins_by_member(club_id, member_id)
-
+        current = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        steps = np.arange(-int(time_range), 1) * np.timedelta64(1, 'D')
+    axis = np.datetime64(current, 's') + steps
+    return axis, current - delta[time_range], current
+
+# sum values into the axis bucket equal to their key, keys outside the axis are dropped
+def scatter(axis, keys, values):
+    totals = np.zeros(len(axis))
+    index = np.searchsorted(axis, keys)
+    inside = index < len(axis)
+    inside[inside] = axis[index[inside]] == keys[inside]
+    np.add.at(totals, index[inside], values[inside])
+    return totals
+
+# sum values per small integer key (hour of day, weekday)
+def distribution(keys, values, size):
+    return np.bincount(keys.astype(int), weights=values, minlength=size)[:size]
+
+# check-ins per hour (last 24 hours) or per day: returns (axis, counts, xlim)
+def checkins_series(time_range, club_id = None, member_id = None):
+    now = dt.datetime.now()
+    axis, start, current = bucket_axis(time_range, now)
+    bucket = 'hour' if time_range == '1' else 'day'
+    keys, values = columns(checkin_counts(now - delta[time_range], bucket, club_id, member_id))
+    return axis, scatter(axis, keys, values), (start, current)
+
+# check-ins per hour of the day (0-23)
+def timeofday_series(time_range, club_id = None, member_id = None):
+    start = dt.datetime.now() - delta[time_range]
+    keys, values = columns(checkin_counts(start, 'hourofday', club_id, member_id), int)
+    return distribution(keys, values, 24)
+
+# check-ins per weekday, Monday first
+def dayofweek_series(time_range, club_id = None, member_id = None):
+    start = dt.datetime.now() - delta[time_range]
+    keys, values = columns(checkin_counts(start, 'weekday', club_id, member_id), int)
+    return distribution(keys, values, 7)
+
+# number of members over time: returns (dates, cumulative count), starting from zero the day before the first join
+def nummembers_series(club_id = None):
+    keys, values = columns(get_join_date_counts(club_id), 'datetime64[D]')
+    if len(keys) == 0:
+        return keys, values
+    dates = np.concatenate(([keys[0] - np.timedelta64(1, 'D')], keys))
+    return dates, np.concatenate(([0], np.cumsum(values)))
+
+# hours a member stayed per day: returns (axis, hours, xlim)
+def member_hours_series(club_id, member_id, time_range):
+    axis, start, current = bucket_axis(str(time_range), dt.datetime.now())
+    keys, values = columns(get_checkin_hours(start, 'day', club_id, member_id))
+    return axis, np.round(scatter(axis, keys, values), 2), (start, current)
+
+# datetime64 arrays back to datetime objects for plotting
+def as_datetimes(axis):
+    return axis.astype('datetime64[s]').astype(object)
+
+### JSON series for the dashboards
+# the view pages fetch these (a few hundred numbers) and draw them in the browser with static/charts.js
+# kind is 'line', 'bar', 'stats' or 'empty'; labels and values are parallel lists
+
+def series_dict(kind, title, labels=(), values=(), **extra):
+    return dict(kind=kind, title=title, labels=list(labels), values=list(values), **extra)
+
+# datetime64 axis to labels, hours when the buckets are hours
+def axis_labels(axis, unit):
+    return np.datetime_as_string(axis, unit=unit).tolist()
+
+# series are cached next to the rendered plots, under the format prefixed with 'series'
+def series(time_range, data_format, club_id = None, member_id = None):
+    key = (club_id, member_id, str(time_range), 'series' + str(data_format))
+    data = plot_cache.get(key)
+    if data is None:
+        data = build_series(str(time_range), str(data_format), club_id, member_id)
+        plot_cache.set(key, data)
+    return data
+
+def build_series(time_range, data_format, club_id = None, member_id = None):
+    if data_format == '0':
+        axis, counts, xlim = checkins_series(time_range, club_id, member_id)
+        unit = 'm' if time_range == '1' else 'D'
+        title = 'Checkins Per Hour' if time_range == '1' else 'Checkins Per Day'
+        return series_dict('line', title, axis_labels(axis, unit), counts.astype(int).tolist())
+    elif data_format == '1':
+        values = timeofday_series(time_range, club_id, member_id).astype(int).tolist()
+        return series_dict('line', 'Checkins By Hour of the Day', ['%02d:00' % hour for hour in range(24)], values)
+    elif data_format == '2':
+        values = dayofweek_series(time_range, club_id, member_id).astype(int).tolist()
+        return series_dict('bar', 'Checkins By Day of the Week', DAYS, values)
+    elif data_format == '3':
+        num_checkins, num_hours = checkin_totals(dt.datetime.now() - delta[time_range], club_id, member_id)
+        if num_checkins == 0:
+            return series_dict('empty', 'No checkins in this time range')
+        return series_dict('stats', 'Statistics', ['Average Number of Checkins Per Day', 'Average Number of Hours Stayed Per Checkin'],
+                           [round(num_checkins / int(time_range), 2), round(float(num_hours) / num_checkins, 2)])
+    elif data_format == '4':
+        dates, counts = nummembers_series(club_id)
+        if len(dates) == 0:
+            return series_dict('empty', 'No members with a join date')
+        return series_dict('line', 'Number of Members Over Time', axis_labels(dates, 'D'), counts.astype(int).tolist())
+    elif data_format == 'hours':
+        axis, hours, xlim = member_hours_series(club_id, member_id, time_range)
+        return series_dict('line', 'Hours Spent Per Day', axis_labels(axis, 'D'), hours.tolist())
+
+# rendered plots are cached per (clubhouse, member, range, format), see cache.py for invalidation
+# only used by the no-JavaScript fallback of the view pages
+def plot(time_range, data_format, club_id = None, member_id = None):
+    key = (club_id, member_id, str(time_range), str(data_format))
+    html = plot_cache.get(key)
+    if html is None:
+        html = render_plot(str(time_range), str(data_format), club_id, member_id)
+        plot_cache.set(key, html)
+    return html
+
+def render_plot(time_range, data_format, club_id = None, member_id = None):
     if data_format == '0':
-        return plot_checkins(time_range, rows)
+        return plot_checkins(time_range, club_id, member_id)
     elif data_format == '1':
-        return plot_timeofday(time_range, rows)
+        return plot_timeofday(time_range, club_id, member_id)
     elif data_format == '2':
-        return plot_dayofweek(time_range, rows)
+        return plot_dayofweek(time_range, club_id, member_id)
     elif data_format == '3':
-        return avg_stats(time_range, rows)
+        return avg_stats(time_range, club_id, member_id)
     elif data_format == '4':
         return plot_nummembers(club_id)
 
-def plot_checkins(time_range, rows):
-    fig, ax = plt.subplots()
-
-    current_time = dt.datetime.now()
-
-    delta = {'1': dt.timedelta(hours=24), '7': dt.timedelta(days=7), '30': dt.timedelta(days=30), '365': dt.timedelta(days=365)}
-
-    timecounts = {}
-    if time_range == '1':
-        current_group = current_time.replace(minute=0, second=0, microsecond=0)
-        for i in range(25):
-            timecounts[current_group - dt.timedelta(hours=i)] = 0
-    else:
-        current_group = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
-        for i in range(int(time_range)+1):
-            timecounts[current_group - dt.timedelta(days=i)] = 0
-
-    max_y = 0
-
-    for (member_id, checkin, checkout, clubhouse_id) in rows:
-        if checkin < current_time - delta[time_range]:
-            continue
-        checkin_group = checkin.replace(minute=0, second=0, microsecond=0)
-        if time_range != '1':
-            checkin_group = checkin_group.replace(hour=0)
-        if checkin_group in timecounts.keys():
-            timecounts[checkin_group] = timecounts[checkin_group] + 1
-            max_y = max(max_y, timecounts[checkin_group])  
-
-    try:
-        keys, values = zip(*timecounts.items())
-    except ValueError:
-        return 'No checkins in this time range'
-    points = ax.plot_date(keys, values, xdate=True)
-    ax.plot_date(keys, values, 'b-', xdate=True)
-    ax.set_xlim([current_group - delta[time_range], current_group])
-    ax.set_ylim([0, max_y+2])
-    if time_range == '1':
-        ax.set_title('Checkins Per Hour')
-    else:
-        ax.set_title('Checkins Per Day')
-    tooltip = mpld3.plugins.PointLabelTooltip(points[0], values)
-    mpld3.plugins.connect(fig, tooltip)
-    return mpld3.fig_to_html(fig)
-
-def plot_timeofday(time_range, rows):
-    fig, ax = plt.subplots()
+def plot_checkins(time_range, club_id = None, member_id = None):
+    axis, counts, xlim = checkins_series(time_range, club_id, member_id)
+    keys, values = as_datetimes(axis), counts.astype(int).tolist()
+
+    with rendering() as (fig, ax, mpld3):
+        points = ax.plot(keys, values, 'o')
+        ax.plot(keys, values, 'b-')
+        ax.set_xlim(list(xlim))
+        ax.set_ylim([0, max(values)+2])
+        if time_range == '1':
+            ax.set_title('Checkins Per Hour')
+        else:
+            ax.set_title('Checkins Per Day')
+        tooltip = mpld3.plugins.PointLabelTooltip(points[0], values)
+        mpld3.plugins.connect(fig, tooltip)
+        return mpld3.fig_to_html(fig)
 
+def plot_timeofday(time_range, club_id = None, member_id = None):
     current_time = dt.datetime.now()
     start_time = current_time.replace(hour=0, minute=30, second=0, microsecond=0)
-
-    delta = {'1': dt.timedelta(hours=24), '7': dt.timedelta(days=7), '30': dt.timedelta(days=30), '365': dt.timedelta(days=365)}
-
-    timecounts = {}
-    for i in range(24):
-        timecounts[i] = 0
-
-    max_y = 0
-
-    for (member_id, checkin, checkout, clubhouse_id) in rows:
-        if checkin < current_time - delta[time_range]:
-            continue 
-        timecounts[checkin.hour] = timecounts[checkin.hour] + 1
-        max_y = max(max_y, timecounts[checkin.hour])  
-
-    try:
-        keys, values = zip(*timecounts.items())
-    except ValueError:
-        return 'No checkins in this time range'
-    datetimes = [current_time.replace(hour=item, minute=30, second=0, microsecond=0) for item in keys]
-    points = ax.plot_date(datetimes, values, xdate=True)
-    ax.plot_date(datetimes, values, 'b-', xdate=True)
-    ax.set_xlim([start_time, start_time + dt.timedelta(hours=23)])
-    ax.set_ylim([0, max_y+2])
-    ax.set_title('Checkins By Hour of the Day')
-    tooltip = mpld3.plugins.PointLabelTooltip(points[0], values)
-    mpld3.plugins.connect(fig, tooltip)
-    return mpld3.fig_to_html(fig)
-
-def plot_dayofweek(time_range, rows):
-    fig, ax = plt.subplots()
-
-    current_time = dt.datetime.now()
-
-    delta = {'1': dt.timedelta(hours=24), '7': dt.timedelta(days=7), '30': dt.timedelta(days=30), '365': dt.timedelta(days=365)}
-
-    timecounts = [0, 0, 0, 0, 0, 0, 0]
-    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    x = [0, 1, 2, 3, 4, 5, 6]
-    max_y = 0
-
-    for (member_id, checkin, checkout, clubhouse_id) in rows:
-        if checkin < current_time - delta[time_range]:
-            continue
-        timecounts[checkin.weekday()] = timecounts[checkin.weekday()] + 1
-        max_y = max(max_y, timecounts[checkin.weekday()])
-
-    boxes = ax.bar(x, timecounts)
-    ax.set_xticks(x)
-    ax.set_xticklabels(days)
-    ax.set_title('Checkins By Day of the Week')
-    for i in range(7):
-        label = ['<div> ' + str(timecounts[i]) + '</div>']
-        tooltip = mpld3.plugins.PointHTMLTooltip(boxes[i], label, hoffset=15, voffset=-15)
+    values = timeofday_series(time_range, club_id, member_id).astype(int).tolist()
+    datetimes = [start_time.replace(hour=hour) for hour in range(24)]
+
+    with rendering() as (fig, ax, mpld3):
+        points = ax.plot(datetimes, values, 'o')
+        ax.plot(datetimes, values, 'b-')
+        ax.set_xlim([start_time, start_time + dt.timedelta(hours=23)])
+        ax.set_ylim([0, max(values)+2])
+        ax.set_title('Checkins By Hour of the Day')
+        tooltip = mpld3.plugins.PointLabelTooltip(points[0], values)
         mpld3.plugins.connect(fig, tooltip)
-    return mpld3.fig_to_html(fig)
-
-def avg_stats(time_range, rows):
+        return mpld3.fig_to_html(fig)
+
+def plot_dayofweek(time_range, club_id = None, member_id = None):
+    timecounts = dayofweek_series(time_range, club_id, member_id).astype(int).tolist()
+    x = list(range(7))
+
+    with rendering() as (fig, ax, mpld3):
+        boxes = ax.bar(x, timecounts)
+        ax.set_xticks(x)
+        ax.set_xticklabels(DAYS)
+        ax.set_title('Checkins By Day of the Week')
+        for i in range(7):
+            label = ['<div> ' + str(timecounts[i]) + '</div>']
+            tooltip = mpld3.plugins.PointHTMLTooltip(boxes[i], label, hoffset=15, voffset=-15)
+            mpld3.plugins.connect(fig, tooltip)
+        return mpld3.fig_to_html(fig)
+
+def avg_stats(time_range, club_id = None, member_id = None):
     current_time = dt.datetime.now()
 
-    delta = {'1': dt.timedelta(hours=24), '7': dt.timedelta(days=7), '30': dt.timedelta(days=30), '365': dt.timedelta(days=365)}
-
     num_days = int(time_range)
-    num_checkins = 0
-    num_hours = 0
-
-    for (member_id, checkin, checkout, clubhouse_id) in rows:
-        if checkin < current_time - delta[time_range]:
-            continue
-        num_checkins = num_checkins + 1
-        if checkout == None:
-            checkout = dt.datetime.now()
-        num_hours = num_hours + round((checkout - checkin).total_seconds() / 3600, 2)
-    return '<div> Average Number of Checkins Per Day: ' + str(round(num_checkins / num_days, 2)) + '</div><br><div> Average Number of Hours Stayed Per Checkin: ' + str(round(num_hours / num_checkins, 2)) + '</div>'
+    num_checkins, num_hours = checkin_totals(current_time - delta[time_range], club_id, member_id)
+    if num_checkins == 0:
+        return 'No checkins in this time range'
+    return '<div> Average Number of Checkins Per Day: ' + str(round(num_checkins / num_days, 2)) + '</div><br><div> Average Number of Hours Stayed Per Checkin: ' + str(round(float(num_hours) / num_checkins, 2)) + '</div>'
 
 def plot_nummembers(club_id):
-    fig, ax = plt.subplots()
-
-    if club_id == None:
-        rows = get_all_joindates()
-    else:
-        rows = get_clubhouse_member_joindates(club_id)
-    
-    timecounts = {}
-    current_count = 0
-
-    for (member_id, join_date) in rows:
-        if join_date == None:
-            continue
-        join_date = dt.datetime(join_date.year, join_date.month, join_date.day)
-        if current_count == 0:
-            timecounts[join_date - dt.timedelta(days=1)] = 0
-        current_count = current_count + 1
-        timecounts[join_date] = current_count
-
-    keys, values = zip(*timecounts.items())
-    points = ax.plot_date(keys, values, xdate=True)
-    ax.plot_date(keys, values, 'b-', xdate=True)
-    ax.set_ylim([0, current_count + 10])
-    ax.set_title('Number of Members Over Time')
-    tooltip = mpld3.plugins.PointLabelTooltip(points[0], values)
-    mpld3.plugins.connect(fig, tooltip)
-    return mpld3.fig_to_html(fig)
-
-def plot_by_member(club_id, member_id, time_range):
-    fig, ax = plt.subplots()
-
-    rows = get_checkins_by_member(club_id, member_id)
-    current_day = dt.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    delta = dt.timedelta(days=time_range)
-
-    timecounts = {}
-    for i in range(time_range + 1):
-        timecounts[current_day - dt.timedelta(days=i)] = 0
-    max_y = 0
-
-    for (member_id, checkin, checkout, clubhouse_id) in rows:
-        if checkin < current_day - delta:
-            continue
-        if checkout == None:
-            checkout = dt.datetime.now()
-        checkin_day = checkin.replace(hour=0, minute=0, second=0, microsecond=0)
-        timecounts[checkin_day] = timecounts[checkin_day] + round((checkout - checkin).total_seconds() / 3600, 2)
-        max_y = max(max_y, timecounts[checkin_day])
-
-    try:
-        keys, values = zip(*timecounts.items())
-    except ValueError:
-        return 'No checkins by this member'
-    points = ax.plot_date(keys, values, xdate=True)
-    ax.plot_date(keys, values, 'b-', xdate=True)
-    ax.set_xlim([current_day - delta, current_day])
-    ax.set_ylim([0, max_y+10])
-    ax.set_title('Hours Spent Per Day')
-    tooltip = mpld3.plugins.PointLabelTooltip(points[0], values)
-    mpld3.plugins.connect(fig, tooltip)
-    return mpld3.fig_to_html(fig)
+    dates, counts = nummembers_series(club_id)
+    if len(dates) == 0:
+        return 'No members with a join date'
+    keys, values = as_datetimes(dates), counts.astype(int).tolist()
+
+    with rendering() as (fig, ax, mpld3):
+        points = ax.plot(keys, values, 'o')
+        ax.plot(keys, values, 'b-')
+        ax.set_ylim([0, values[-1] + 10])
+        ax.set_title('Number of Members Over Time')
+        tooltip = mpld3.plugins.PointLabelTooltip(points[0], values)
+        mpld3.plugins.connect(fig, tooltip)
+        return mpld3.fig_to_html(fig)
@@ -0,0 +1,151 @@
+# bounded MySQL connection pool, used by db.py through get_conn()
+# each request borrows at most one connection (stored on flask.g) and hands it back at teardown
+
+import threading
+import time
+from collections import deque
+
+class PoolTimeout(Exception):
+    pass
+
+# wraps a raw connection with the bookkeeping the pool needs
+class PooledConnection:
+    def __init__(self, raw):
+        self.raw = raw
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def age(self):
+        return time.monotonic() - self.created
+
+    def idle(self):
+        return time.monotonic() - self.last_used
+
+class ConnectionPool:
+    # connect is a zero-argument callable returning a new DB-API connection
+    # size bounds the number of open connections (idle + borrowed)
+    # max_lifetime (seconds) recycles old connections, ping_after (seconds idle) triggers a health check
+    def __init__(self, connect, size=5, max_lifetime=3600, ping_after=30, timeout=10):
+        self.connect = connect
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self._idle = deque()
+        self._open = 0 # idle + borrowed
+        self._cond = threading.Condition()
+        self._stats = {'checkouts': 0, 'checkins': 0, 'waits': 0, 'wait_seconds': 0.0,
+                       'creations': 0, 'recycled': 0, 'failed_pings': 0, 'timeouts': 0}
+
+    # borrow a connection, blocking up to self.timeout seconds if the pool is exhausted
+    # idle connections are health-checked after they leave the lock, so a slow ping only delays its caller
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        wait_start = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._idle and self._open >= self.size:
+                    # pool exhausted, wait for someone to give a connection back
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout("no database connection available after %s seconds" % self.timeout)
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    pooled = self._idle.pop() # most recently used first, keeps the idle tail cold
+                else:
+                    pooled = None
+                    self._open += 1 # reserve a slot for a new connection
+            if pooled is None:
+                break
+            # the connection still counts as open while it is checked, no one else can take it
+            if self._usable(pooled):
+                with self._cond:
+                    self._stats['checkouts'] += 1
+                    if waited:
+                        self._stats['wait_seconds'] += time.monotonic() - wait_start
+                return pooled
+            self._drop(pooled)
+        # open a new connection outside the lock
+        try:
+            pooled = PooledConnection(self.connect())
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['creations'] += 1
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['wait_seconds'] += time.monotonic() - wait_start
+        return pooled
+
+    # give a connection back, rolling back anything left uncommitted
+    def release(self, pooled, broken=False):
+        if not broken:
+            try:
+                pooled.raw.rollback()
+            except Exception:
+                broken = True
+        with self._cond:
+            self._stats['checkins'] += 1
+            if broken or pooled.age() > self.max_lifetime:
+                self._discard(pooled)
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    # close every idle connection, e.g. after a fork
+    def dispose(self):
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        return stats
+
+    # called without the lock, pooled is reserved by the caller
+    def _usable(self, pooled):
+        if pooled.age() > self.max_lifetime:
+            with self._cond:
+                self._stats['recycled'] += 1
+            return False
+        if pooled.idle() > self.ping_after:
+            try:
+                pooled.raw.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._stats['failed_pings'] += 1
+                return False
+        return True
+
+    # called with the lock held
+    def _discard(self, pooled):
+        self._open -= 1
+        try:
+            pooled.raw.close()
+        except Exception:
+            pass
+
+    # _discard for a reserved connection, closed outside the lock
+    def _drop(self, pooled):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+        try:
+            pooled.raw.close()
+        except Exception:
+            pass
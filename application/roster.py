@@ -0,0 +1,362 @@
+# server-side check-in rosters, one per clubhouse
+# the set of checked-in members lives in a roster backend shared by every process (gunicorn workers, the
+# clock process, CLI commands): redis when ROSTER_REDIS_URL is set, otherwise the database itself, read
+# through version counters on the clubhouse row; each worker keeps the sorted lists derived from it
+# with redis, db.py updates the backend on every check-in/out, so rendering a roster needs no database query;
+# without it a render costs one primary-key read, and the checked-in ids are only read again after a change
+
+import threading
+from flask import g, has_app_context
+from sortedcontainers import SortedList
+from application import application
+from application.events import publish
+
+### backends
+# every backend keeps, per clubhouse, the set of checked-in member ids and a version number that
+# increases with every change, plus a members version that increases whenever the member list changes
+# version() is cheap and called on every read; state() copies the whole set and is only called once the
+# version moved
+
+# single-process stand-in for tests, other processes never see its changes
+class LocalRosterBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_in = {} # club id -> set of member ids
+        self.versions = {} # club id -> version of checked_in
+        self.members_versions = {} # club id -> version of the member list
+
+    # version of the checked-in set, None if the clubhouse is not loaded
+    def version(self, club_id):
+        with self.lock:
+            return self.versions.get(club_id)
+
+    # (version, set of checked-in ids) or None if the clubhouse is not loaded
+    def state(self, club_id):
+        with self.lock:
+            if club_id not in self.versions:
+                return None
+            return self.versions[club_id], set(self.checked_in[club_id])
+
+    # initialize a clubhouse from the database unless it is already loaded
+    def load(self, club_id, member_ids):
+        with self.lock:
+            if club_id not in self.versions:
+                self.checked_in[club_id] = set(member_ids)
+                self.versions[club_id] = 1
+
+    # returns the new version, or None if the clubhouse is not loaded
+    def mark(self, club_id, member_id, checked_in):
+        with self.lock:
+            if club_id not in self.versions:
+                return None
+            if checked_in:
+                self.checked_in[club_id].add(member_id)
+            else:
+                self.checked_in[club_id].discard(member_id)
+            self.versions[club_id] += 1
+            return self.versions[club_id]
+
+    def clear(self, club_id):
+        with self.lock:
+            if club_id not in self.versions:
+                return None
+            self.checked_in[club_id] = set()
+            self.versions[club_id] += 1
+            return self.versions[club_id]
+
+    # forget the check-in state and bump the members version, every worker reloads from the database
+    # returns the new members version
+    def drop(self, club_id):
+        with self.lock:
+            self.checked_in.pop(club_id, None)
+            self.versions.pop(club_id, None)
+            self.members_versions[club_id] = self.members_versions.get(club_id, 0) + 1
+            return self.members_versions[club_id]
+
+    def members_version(self, club_id):
+        with self.lock:
+            return self.members_versions.get(club_id, 0)
+
+# shared across workers through redis (optional dependency)
+class RedisRosterBackend:
+    LOAD = """if redis.call('EXISTS', KEYS[2]) == 1 then return 0 end
+              redis.call('DEL', KEYS[1])
+              for i, member in ipairs(ARGV) do redis.call('SADD', KEYS[1], member) end
+              redis.call('SET', KEYS[2], 1)
+              return 1"""
+    MARK = """if redis.call('EXISTS', KEYS[2]) == 0 then return false end
+              if ARGV[2] == '1' then redis.call('SADD', KEYS[1], ARGV[1]) else redis.call('SREM', KEYS[1], ARGV[1]) end
+              return redis.call('INCR', KEYS[2])"""
+    CLEAR = """if redis.call('EXISTS', KEYS[2]) == 0 then return false end
+               redis.call('DEL', KEYS[1])
+               return redis.call('INCR', KEYS[2])"""
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.load_script = self.redis.register_script(self.LOAD)
+        self.mark_script = self.redis.register_script(self.MARK)
+        self.clear_script = self.redis.register_script(self.CLEAR)
+
+    def keys(self, club_id):
+        return ['roster:%s:in' % club_id, 'roster:%s:version' % club_id]
+
+    def version(self, club_id):
+        version = self.redis.get(self.keys(club_id)[1])
+        return None if version is None else int(version)
+
+    def state(self, club_id):
+        members_key, version_key = self.keys(club_id)
+        pipe = self.redis.pipeline()
+        pipe.get(version_key)
+        pipe.smembers(members_key)
+        version, members = pipe.execute()
+        if version is None:
+            return None
+        return int(version), set(members)
+
+    def load(self, club_id, member_ids):
+        self.load_script(keys=self.keys(club_id), args=list(member_ids))
+
+    def mark(self, club_id, member_id, checked_in):
+        return self.mark_script(keys=self.keys(club_id), args=[member_id, '1' if checked_in else '0'])
+
+    def clear(self, club_id):
+        return self.clear_script(keys=self.keys(club_id))
+
+    def drop(self, club_id):
+        pipe = self.redis.pipeline()
+        pipe.delete(*self.keys(club_id))
+        pipe.incr('roster:%s:members' % club_id)
+        return pipe.execute()[-1]
+
+    def members_version(self, club_id):
+        return int(self.redis.get('roster:%s:members' % club_id) or 0)
+
+# the database as the backend: db.py bumps clubhouses.roster_version in the same transaction as every
+# check-in change and members_version with every member list change (migrations/006_roster_versions.sql),
+# so changes made by any process, including the clock process and CLI commands, reach every worker
+# the versions are read once per request (kept on flask.g), the checked-in ids only when roster_version moved
+class DatabaseRosterBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_in = {} # club id -> (roster_version, set of member ids) last read by this process
+
+    # (roster_version, members_version) of a clubhouse, read at most once per request
+    def versions(self, club_id):
+        from application.db import get_roster_versions
+        if not has_app_context():
+            return get_roster_versions(club_id)
+        if 'roster_versions' not in g:
+            g.roster_versions = {}
+        if club_id not in g.roster_versions:
+            g.roster_versions[club_id] = get_roster_versions(club_id)
+        return g.roster_versions[club_id]
+
+    # the next read in this request sees the write that was just committed
+    def forget(self, club_id):
+        if has_app_context() and 'roster_versions' in g:
+            g.roster_versions.pop(club_id, None)
+
+    def version(self, club_id):
+        return self.versions(club_id)[0]
+
+    def state(self, club_id):
+        from application.db import get_roster_state
+        version = self.versions(club_id)[0]
+        with self.lock:
+            known = self.checked_in.get(club_id)
+        if known is None or known[0] != version:
+            version, member_ids = get_roster_state(club_id)
+            known = (version, set(str(member_id) for member_id in member_ids))
+            with self.lock:
+                self.checked_in[club_id] = known
+        return known[0], set(known[1])
+
+    # the database is always loaded
+    def load(self, club_id, member_ids):
+        pass
+
+    # db.py already bumped the version with its write; None makes the worker's roster read it again
+    def mark(self, club_id, member_id, checked_in):
+        self.forget(club_id)
+        return None
+
+    def clear(self, club_id):
+        self.forget(club_id)
+        return None
+
+    def drop(self, club_id):
+        self.forget(club_id)
+        return self.versions(club_id)[1]
+
+    def members_version(self, club_id):
+        return self.versions(club_id)[1]
+
+if application.config['ROSTER_REDIS_URL']:
+    backend = RedisRosterBackend(application.config['ROSTER_REDIS_URL'])
+else:
+    backend = DatabaseRosterBackend()
+
+### worker-side rosters
+
+# set of member ranks kept sorted; a member's rank is their position in the clubhouse's display order,
+# computed once when the roster is built, so ordering is integer comparison with no name strings involved
+# a SortedList makes add, discard and membership O(log n) instead of shifting a plain list on every tap
+class RankedSet(SortedList):
+    def add(self, rank):
+        if rank not in self:
+            super().add(rank)
+
+# where a member sorts in the check-in lists and search results, as a string the page can compare
+# (static/checkin.js places a moved member by it): names starting with the search come first (group 0),
+# then by last and first name, lowercased, and member id, the order of search.MemberIndex
+def sort_string(first, last, mem_id, group=0):
+    return "%d\n%s\n%s\n%s" % (group, last.lower(), first.lower(), mem_id)
+
+# members of one clubhouse split into checked in / checked out, both in display order (last, first)
+# member ids are kept as strings, like the SelectField values
+class Roster:
+    def __init__(self, club_id, rows, members_version):
+        self.lock = threading.Lock()
+        self.club_id = club_id
+        self.members_version = members_version
+        self.version = None # backend version the sets reflect, None forces a rebuild
+        self.order = [] # every member id, in display order
+        self.rank = {} # member id -> position in order
+        self.labels = [] # per rank, ("first last", "last, first")
+        self.sort_strings = [] # per rank, see sort_string
+        self.loaded_in = set() # checked in according to the database when the roster was built
+        self.members_in = RankedSet()
+        self.members_out = RankedSet()
+        # rows come from get_clubhouse_roster, sorted again here the way the search index sorts (MySQL's
+        # collation orders case and accents differently), so the lists keep their order across searches
+        for mem_id, first, last, checked_in in sorted(rows, key=lambda row: sort_string(row[1], row[2], str(row[0]))):
+            mem_id = str(mem_id)
+            self.rank[mem_id] = len(self.order)
+            self.order.append(mem_id)
+            self.labels.append((first + " " + last, last + ", " + first))
+            self.sort_strings.append(sort_string(first, last, mem_id))
+            if checked_in:
+                self.loaded_in.add(mem_id)
+
+    # bring the sets up to date with the backend; the set is only fetched when its version moved
+    def sync(self):
+        version = backend.version(self.club_id)
+        if version is not None and version == self.version:
+            return
+        state = backend.state(self.club_id)
+        if state is None: # backend lost this clubhouse (e.g. redis restarted), reseed it
+            backend.load(self.club_id, self.loaded_in)
+            state = backend.state(self.club_id)
+        with self.lock:
+            if state is not None and state[0] != self.version:
+                version, checked_in = state
+                ranks_in = [self.rank[mem_id] for mem_id in checked_in if mem_id in self.rank]
+                self.members_in = RankedSet(ranks_in)
+                self.members_out = RankedSet(set(range(len(self.order))).difference(ranks_in))
+                self.version = version
+
+    # (members_in, members_out) as lists of member ids in display order, at most limit of each
+    def lists(self, limit=None):
+        self.sync()
+        with self.lock:
+            return ([self.order[r] for r in self.members_in.islice(0, limit)],
+                    [self.order[r] for r in self.members_out.islice(0, limit)])
+
+    def is_checked_in(self, id_num):
+        self.sync()
+        rank = self.rank.get(str(id_num))
+        return rank is not None and rank in self.members_in
+
+    def is_checked_out(self, id_num):
+        self.sync()
+        rank = self.rank.get(str(id_num))
+        return rank is not None and rank in self.members_out
+
+    # apply a change this worker just made to the backend (which is now at version)
+    # if another change happened in between, fall back to rebuilding from the backend on next read
+    def apply(self, mem_id, checked_in, version):
+        with self.lock:
+            if version is None or self.version is None or version != self.version + 1:
+                self.version = None
+                return
+            self.version = version
+            rank = self.rank.get(mem_id)
+            if rank is None:
+                return
+            if checked_in:
+                self.members_out.discard(rank)
+                self.members_in.add(rank)
+            else:
+                self.members_in.discard(rank)
+                self.members_out.add(rank)
+
+    def apply_clear(self, version):
+        with self.lock:
+            if version is None or self.version is None or version != self.version + 1:
+                self.version = None
+                return
+            self.version = version
+            self.members_in = RankedSet()
+            self.members_out = RankedSet(range(len(self.order)))
+
+    # (id, "first last") or (id, "last, first") choices for a list of member ids
+    # ids the roster doesn't know (members added after it was built) are left out
+    def display(self, mem_ids, display_last=False):
+        column = 1 if display_last else 0
+        return [(mem_id, self.labels[self.rank[mem_id]][column]) for mem_id in mem_ids if mem_id in self.rank]
+
+    # same as display, with each member's sort string as the option's data-sort attribute (SelectField choices)
+    def choices(self, mem_ids, display_last=False):
+        return [(mem_id, label, {'data-sort': self.sort_strings[self.rank[mem_id]]}) for mem_id, label in self.display(mem_ids, display_last)]
+
+rosters = {} # club id -> Roster
+rosters_lock = threading.Lock()
+
+# return the roster of a clubhouse, (re)building it with loader(club_id) when its member list changed
+def get_roster(club_id, loader):
+    members_version = backend.members_version(club_id)
+    roster = rosters.get(club_id)
+    if roster is None or roster.members_version != members_version:
+        rows = loader(club_id)
+        roster = Roster(club_id, rows, members_version)
+        backend.load(club_id, roster.loaded_in)
+        with rosters_lock:
+            rosters[club_id] = roster
+    return roster
+
+# whether a member belongs to a clubhouse, from this worker's roster as it is (no version read); only a
+# member it doesn't know sends it to get_roster, in case they were added since it was built
+def is_member(club_id, member_id, loader):
+    roster = rosters.get(club_id)
+    if roster is not None and str(member_id) in roster.rank:
+        return True
+    return str(member_id) in get_roster(club_id, loader).rank
+
+### hooks called by db.py after its writes commit
+
+# each hook also pushes the change to the clubhouse's kiosks (see events.py)
+
+def roster_mark(club_id, member_id, checked_in):
+    version = backend.mark(club_id, str(member_id), checked_in)
+    roster = rosters.get(club_id)
+    if roster is not None:
+        roster.apply(str(member_id), checked_in, version)
+    publish(club_id, id=str(member_id), **{'in': checked_in})
+
+def roster_clear(club_id):
+    version = backend.clear(club_id)
+    roster = rosters.get(club_id)
+    if roster is not None:
+        roster.apply_clear(version)
+    publish(club_id, all_out=True)
+
+# members were added, edited or removed: every worker rebuilds the roster from the database
+# returns the new members version (see search.py)
+def invalidate_roster(club_id):
+    members_version = backend.drop(club_id)
+    with rosters_lock:
+        rosters.pop(club_id, None)
+    publish(club_id, reset=True)
+    return members_version
@@ -1,18 +1,26 @@
 # handle all routing things
 
 # not sure what the imports should be but these seem to work?
-import jsonpickle
+import os
+import resource
+import sys
 from functools import wraps
 from datetime import datetime
-from flask import render_template, flash, redirect, request, url_for, session
-from application import application
-from application.forms import LoginForm, CheckinManager, MemberManager, MemberAddForm, MemberInfoHandler, AuthenticateForm, ClubhouseManager, ClubhouseAddForm, ClubhouseInfoHandler
+from flask import render_template, flash, redirect, request, url_for, session, jsonify, Response, abort
+from application import application, pool
+from application.forms import LoginForm, CheckinManager, MemberManager, MemberAddForm, MemberImportForm, MemberInfoHandler, CheckinExportForm, search_members, search_order, AuthenticateForm, ClubhouseManager, ClubhouseAddForm, ClubhouseInfoHandler
+from application.importer import import_members
+from application.export import export_checkins, arrow_available
 from flask_babel import lazy_gettext as _l
 from flask_login import current_user, login_user, logout_user
 from werkzeug.urls import url_parse
 from wtforms.validators import DataRequired
 from .db import *
-from .plot import *
+from .plot import plot, series, delta, rss_kb, render_stats
+from .metrics import prometheus_text
+from .cache import plot_cache, user_cache
+from .checkinqueue import get_checkin_queue
+from .events import broker, stream as roster_stream
 from .models import *
 
 # function for two-level authentication
@@ -109,6 +117,78 @@ def admin_view():
     if request.method == 'GET':
         return render_template('/admin/view.html', time_ranges=time_ranges, data_format=data_format, cur_range = time_ranges[0][0], cur_format = data_format[0][0])
 
+# aggregated series behind the view pages, drawn in the browser by static/charts.js
+# the POSTs above only serve browsers without JavaScript
+def series_response(club_id = None, member_id = None):
+    cur_range = request.args.get('range', '1')
+    cur_format = request.args.get('format', '0')
+    formats = ('0', '1', '2', '3', '4', 'hours') if member_id else ('0', '1', '2', '3', '4')
+    if cur_range not in delta or cur_format not in formats:
+        abort(400)
+    return jsonify(series(cur_range, cur_format, club_id, member_id))
+
+@application.route('/clubhouse/view/data')
+@fresh_login_required(impersonate = True)
+def coord_view_data():
+    return series_response(session['club_id'], request.args.get('member', type=int))
+
+@application.route('/admin/view/data')
+@fresh_login_required(access="admin")
+def admin_view_data():
+    return series_response()
+
+# check-in history downloads, streamed so that large ranges are never held in memory
+def export_response(form, clubhouse_id):
+    if form.data_format.data == 'arrow' and not arrow_available():
+        flash(_l("Arrow export is not available on this server, please choose CSV."))
+        return None
+    body, mimetype, filename = export_checkins(form.start_date.data, form.end_date.data, form.data_format.data, clubhouse_id, form.demographics.data)
+    return Response(body, mimetype=mimetype, headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+@application.route('/clubhouse/export', methods=['GET','POST'])
+@fresh_login_required(impersonate = True)
+def coord_export():
+    form = CheckinExportForm()
+    del form.clubhouse
+    if form.validate_on_submit():
+        response = export_response(form, session['club_id'])
+        if response is not None:
+            return response
+    return render_template('/clubhouse/export.html', form=form)
+
+@application.route('/admin/export', methods=['GET','POST'])
+@fresh_login_required(access="admin")
+def admin_export():
+    form = CheckinExportForm()
+    form.clubhouse.choices = [(0, _l("All clubhouses"))] + list(get_all_clubhouses())
+    if form.validate_on_submit():
+        response = export_response(form, form.clubhouse.data or None)
+        if response is not None:
+            return response
+    return render_template('/admin/export.html', form=form)
+
+# per-worker counters: connection pool (used to size DB_POOL_SIZE), cache hits/misses and memory
+@application.route('/admin/stats')
+@fresh_login_required(access="admin")
+def worker_stats():
+    process = {'pid': os.getpid(),
+               'rss_kb': rss_kb(),
+               'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, # kilobytes on Linux
+               'plotting_loaded': 'matplotlib' in sys.modules}
+    queue = get_checkin_queue()
+    return jsonify(pool=pool.stats(), plot_cache=plot_cache.stats(), user_cache=user_cache.stats(), process=process, renders=dict(render_stats),
+                   checkin_queue=queue.stats() if queue else None, kiosk_streams=broker.connections())
+
+# Prometheus scrape endpoint, counters are per worker (see metrics.py)
+@application.route('/metrics')
+def metrics():
+    token = application.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    if request.headers.get('Authorization') != 'Bearer ' + token:
+        abort(401)
+    return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
+
 # logins and logouts, account management
 
 # logout routing
@@ -233,6 +313,33 @@ def create_member():
             return redirect('/clubhouse/editmember') # shows the posted data of newly created member
     return render_template('/clubhouse/edit.html', form=form, new_member=True)
 
+# bulk import members from a CSV/XLSX file
+@application.route('/clubhouse/importmembers', methods=['GET','POST'])
+@fresh_login_required(impersonate = True)
+def import_member_file():
+    form = MemberImportForm()
+    result = None
+    if request.method == 'POST':
+        if "cancel_btn" in request.form:
+            return redirect('/clubhouse/members')
+        elif form.validate_on_submit():
+            upload = form.member_file.data
+            result = import_members(session['club_id'], upload.stream, upload.filename)
+            flash(_l("Imported %(imported)d members, %(failed)d rows skipped.", imported=result.imported, failed=result.failed))
+    return render_template('/clubhouse/import.html', form=form, result=result, columns=MEMBER_COLUMNS)
+
+# typeahead for the member lists, one page of matches as JSON
+# not fresh_login_required because the check-in kiosk runs on a stale session
+@application.route('/clubhouse/search')
+@login_required(impersonate = True)
+def member_search():
+    status = request.args.get('status', 'all')
+    page = request.args.get('page', 0, type=int)
+    query = request.args.get('q', '')
+    results, more = search_members(session['club_id'], query, status, page, session['last_name_first'])
+    order = search_order(session['club_id'], query, [mem_id for mem_id, name in results])
+    return jsonify(results=[{'id': mem_id, 'name': name, 'sort': key} for (mem_id, name), key in zip(results, order)], page=page, more=more)
+
 @application.route('/clubhouse/members', methods=['GET','POST'])
 @fresh_login_required(impersonate = True)
 def manage_members():
@@ -245,7 +352,7 @@ def manage_members():
             # temporarily store member id
             session['edit_member_id'] = int(request.form['memberselect'])
             return redirect('/clubhouse/editmember')
-    return render_template('/clubhouse/membership.html', form=form_manager.member_form)
+    return render_template('/clubhouse/membership.html', form=form_manager.member_form, more=form_manager.more)
 
 @application.route('/clubhouse/editmember',methods=['GET','POST'])
 @fresh_login_required(impersonate = True)
@@ -273,39 +380,48 @@ def edit_member_info():
     if request.method == "GET":
         # pull stored information
         handle = MemberInfoHandler(get_specific_member(club_id, mem_id))
-        return render_template('/clubhouse/edit.html', form=handle.form, new_member=False, plot_month=plot_by_member(club_id, mem_id, 30), plot_year=plot_by_member(club_id, mem_id, 365), plot_time=plot('365', '1', club_id, mem_id), plot_weekday=plot('365', '2', club_id, mem_id))
+        return render_template('/clubhouse/edit.html', form=handle.form, new_member=False, mem_id=mem_id)
 
 # check-in page, main functionality of website
+# the rosters are kept server-side per clubhouse, a POST only carries the member id
 @application.route('/clubhouse/checkin', methods=['GET','POST'])
 @login_required(impersonate = True)
 def checkin_handler():
     # manually set session to stale
     session['fresh'] = False
-    if request.method == "GET":
-        # get checkin manager for this specific clubhouse
-        club_id = session['club_id']
-        testform = CheckinManager(club_id, session['last_name_first'])
-        # enable_auto_checkout(club_id) # should only create db event once to set up auto_checkout
+    session.pop('testform', None) # left over from when the manager was stored in the cookie
+    # get checkin manager for this specific clubhouse
+    club_id = session['club_id']
+    manager = CheckinManager(club_id, session['last_name_first'])
     if request.method == "POST":
-        # deserialize testform and rebind fields
-        testform = jsonpickle.decode(session['testform'])
-        testform.check_in_form.__init__()
-        testform.setfields()
-        # TODO: find a better solution to form resubmission error
+        # check-ins and check-outs are idempotent, so a resubmitted form does no harm
+        if "all_check_out" in request.form:
+            return redirect('/clubhouse/checkout')
+        member_id = state = None
         try:
             if "check_in" in request.form and "check_in_id" in request.form: # check-in button clicked
-                testform.checkin_member(int(request.form["check_in_id"]))
+                member_id = int(request.form["check_in_id"])
+                state = manager.checkin_member(member_id)
             elif "check_out_id" in request.form: # check-out button
-                testform.checkout_member(int(request.form["check_out_id"]))
-            elif "all_check_out" in request.form:
-                return redirect('/clubhouse/checkout')
-            # serialize for persistence
-            session['testform'] = jsonpickle.encode(testform)
-            return render_template('/clubhouse/checkin.html',form=testform.check_in_form)
-        except ValueError: # cheating way to handle form resubmission
-            return redirect('/clubhouse/checkin')
-    session['testform'] = jsonpickle.encode(testform) # serialize, persistence
-    return render_template('/clubhouse/checkin.html',form=testform.check_in_form)
+                member_id = int(request.form["check_out_id"])
+                state = manager.checkout_member(member_id)
+        except ValueError:
+            abort(400)
+        # checkin.js asks for the new state instead of a page
+        if request.accept_mimetypes.best == 'application/json':
+            if state is None:
+                abort(404)
+            return jsonify(id=str(member_id), name=manager.get_member_display(member_id)[1], checked_in=state[0], changed=state[1])
+        return redirect('/clubhouse/checkin')
+    return render_template('/clubhouse/checkin.html',form=manager.check_in_form, more_in=manager.more_in, more_out=manager.more_out)
+
+# live roster deltas for the check-in page (see events.py and checkin.js)
+# the stream does not keep the request context, so the request's pooled connection is given back at once
+@application.route('/clubhouse/checkin/events')
+@login_required(impersonate = True)
+def checkin_events():
+    return Response(roster_stream(session['club_id']), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # mass checkout
 @application.route('/clubhouse/checkout')
@@ -0,0 +1,148 @@
+# member name search for the typeahead on the check-in and membership pages (/clubhouse/search)
+# one index per clubhouse per worker, over both "first last" and "last, first" so either order matches:
+# a sorted key list answers prefix queries by bisection, trigram postings find matches inside a name
+# db.py keeps the index up to date on member add/edit/delete; other workers notice the roster backend's
+# members version moved (see roster.py) and rebuild theirs on next use
+
+import threading
+from bisect import bisect_left, insort
+from application.roster import backend, sort_string
+
+PAGE_SIZE = 50 # results per page
+
+# lowercase, commas dropped, single spaces: "Smith,  John" -> "smith john"
+def normalize(text):
+    return " ".join(text.replace(",", " ").lower().split())
+
+def trigrams(key):
+    return {key[i:i+3] for i in range(len(key) - 2)}
+
+class MemberIndex:
+    def __init__(self, rows, members_version):
+        self.lock = threading.Lock()
+        self.members_version = members_version
+        self.names = {} # member id -> (first, last)
+        self.keys = [] # sorted (normalized name, member id), two per member
+        self.postings = {} # trigram -> set of member ids
+        self.ordered = [] # sort keys (last, first, member id) of every member, in display order
+        # rows come from get_clubhouse_members, (id, first, last); sorted once at the end rather than per insert
+        for mem_id, first, last in rows:
+            mem_id = str(mem_id)
+            self.names[mem_id] = (first, last)
+            self.ordered.append(self.sort_key(mem_id))
+            for key in self.name_keys(mem_id):
+                self.keys.append((key, mem_id))
+                for gram in trigrams(key):
+                    self.postings.setdefault(gram, set()).add(mem_id)
+        self.ordered.sort()
+        self.keys.sort()
+
+    def sort_key(self, mem_id):
+        first, last = self.names[mem_id]
+        return (last.lower(), first.lower(), mem_id)
+
+    def name_keys(self, mem_id):
+        first, last = self.names[mem_id]
+        return normalize(first + " " + last), normalize(last + " " + first)
+
+    # called with the lock held
+    def add(self, mem_id, first, last):
+        self.names[mem_id] = (first, last)
+        insort(self.ordered, self.sort_key(mem_id))
+        for key in self.name_keys(mem_id):
+            insort(self.keys, (key, mem_id))
+            for gram in trigrams(key):
+                self.postings.setdefault(gram, set()).add(mem_id)
+
+    def remove(self, mem_id):
+        if mem_id not in self.names:
+            return
+        self.ordered.remove(self.sort_key(mem_id))
+        for key in self.name_keys(mem_id):
+            self.keys.remove((key, mem_id))
+            for gram in trigrams(key):
+                self.postings[gram].discard(mem_id)
+        del self.names[mem_id]
+
+    # apply a member change this worker just made (the members version is now members_version)
+    # returns False if another change happened in between and the index has to be rebuilt
+    def apply(self, mem_id, name, members_version):
+        with self.lock:
+            if members_version != self.members_version + 1:
+                return False
+            self.remove(mem_id)
+            if name is not None:
+                self.add(mem_id, *name)
+            self.members_version = members_version
+            return True
+
+    # member ids matching query, in display order: names starting with the query first, then names containing it
+    def matches(self, query):
+        query = normalize(query)
+        if not query:
+            return [mem_id for last, first, mem_id in self.ordered]
+        starts = set()
+        i = bisect_left(self.keys, (query,))
+        while i < len(self.keys) and self.keys[i][0].startswith(query):
+            starts.add(self.keys[i][1])
+            i += 1
+        contains = set()
+        if len(query) >= 3:
+            grams = sorted((self.postings.get(gram, set()) for gram in trigrams(query)), key=len)
+            contains = set.intersection(*grams) - starts
+            contains = {mem_id for mem_id in contains if any(query in key for key in self.name_keys(mem_id))}
+        return sorted(starts, key=self.sort_key) + sorted(contains, key=self.sort_key)
+
+    # one page of (id, "first last") or (id, "last, first") choices, plus whether more pages follow
+    # keep is an optional set of member ids to restrict the results to (e.g. checked-in members)
+    def search(self, query="", keep=None, page=0, per_page=PAGE_SIZE, display_last=False):
+        with self.lock:
+            found = self.matches(query)
+            if keep is not None:
+                found = [mem_id for mem_id in found if mem_id in keep]
+            start = max(page, 0) * per_page
+            selected = found[start:start + per_page]
+            return [(mem_id, self.display(mem_id, display_last)) for mem_id in selected], len(found) > start + per_page
+
+    # sort string (roster.sort_string) of a member in the results of query
+    def sort_string(self, mem_id, query=""):
+        first, last = self.names[mem_id]
+        query = normalize(query)
+        starts = not query or any(key.startswith(query) for key in self.name_keys(mem_id))
+        return sort_string(first, last, mem_id, 0 if starts else 1)
+
+    def display(self, mem_id, display_last=False):
+        first, last = self.names[mem_id]
+        if display_last:
+            return last + ", " + first
+        return first + " " + last
+
+    def __contains__(self, mem_id):
+        return str(mem_id) in self.names
+
+indexes = {} # club id -> MemberIndex
+indexes_lock = threading.Lock()
+
+# return the index of a clubhouse, (re)building it with loader(club_id) when its member list changed elsewhere
+def get_member_index(club_id, loader):
+    members_version = backend.members_version(club_id)
+    index = indexes.get(club_id)
+    if index is None or index.members_version != members_version:
+        index = MemberIndex(loader(club_id), members_version)
+        with indexes_lock:
+            indexes[club_id] = index
+    return index
+
+### hooks called by db.py after invalidate_roster, with the members version it returned
+
+def index_member(club_id, member_id, first, last, members_version):
+    update_index(club_id, str(member_id), (first, last), members_version)
+
+def unindex_member(club_id, member_id, members_version):
+    update_index(club_id, str(member_id), None, members_version)
+
+def update_index(club_id, mem_id, name, members_version):
+    index = indexes.get(club_id)
+    if index is not None and not index.apply(mem_id, name, members_version):
+        with indexes_lock:
+            indexes.pop(club_id, None)
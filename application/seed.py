@@ -0,0 +1,138 @@
+# deterministic synthetic data for benchmarks, run with `flask seed` (see cli.py)
+# the same arguments always produce the same rows; rows are generated per clubhouse and bulk-inserted in
+# batches, so memory stays flat at any scale. logins are seed-admin and seed-club-<n>, all with SEED_PASSWORD
+
+import random
+from datetime import date, datetime, timedelta
+from werkzeug.security import generate_password_hash
+from .db import get_conn, bump_roster_version, rebuild_checkin_rollups
+
+SEED_PASSWORD = 'benchmark'
+
+FIRST_NAMES = ['Aaliyah', 'Adrian', 'Aisha', 'Alejandro', 'Amara', 'Andre', 'Ava', 'Brandon', 'Camila', 'Carlos',
+               'Chloe', 'Daniel', 'Destiny', 'Diego', 'Elijah', 'Emily', 'Ethan', 'Fatima', 'Gabriel', 'Grace',
+               'Hana', 'Isaiah', 'Jada', 'Jamal', 'Jasmine', 'Javier', 'Jayden', 'Kai', 'Kayla', 'Kevin',
+               'Layla', 'Leah', 'Liam', 'Lucas', 'Malik', 'Maria', 'Maya', 'Mei', 'Mohammed', 'Nadia',
+               'Noah', 'Olivia', 'Omar', 'Priya', 'Rafael', 'Sofia', 'Tariq', 'Valeria', 'Wei', 'Zoe']
+LAST_NAMES = ['Adams', 'Ali', 'Anderson', 'Brown', 'Chen', 'Clark', 'Davis', 'Diaz', 'Evans', 'Garcia',
+              'Gonzalez', 'Green', 'Hall', 'Harris', 'Hernandez', 'Hill', 'Jackson', 'Johnson', 'Jones', 'Khan',
+              'Kim', 'King', 'Lee', 'Lewis', 'Lopez', 'Martin', 'Martinez', 'Miller', 'Mitchell', 'Moore',
+              'Nguyen', 'Okafor', 'Patel', 'Perez', 'Ramirez', 'Robinson', 'Rodriguez', 'Sanchez', 'Scott', 'Singh',
+              'Smith', 'Taylor', 'Thomas', 'Thompson', 'Torres', 'Walker', 'White', 'Williams', 'Wilson', 'Young']
+GENDERS = ['Female', 'Male', 'Non-binary']
+ETHNICITIES = ['Asian', 'Black', 'Hispanic or Latino', 'Multiracial', 'White', 'Other']
+TIME_ZONES = ['America/New_York', 'America/Chicago', 'America/Denver', 'America/Los_Angeles',
+              'Europe/Amsterdam', 'Asia/Tokyo']
+
+# check-ins per hour of the day (relative), most members come after school
+HOUR_WEIGHTS = [(10, 1), (11, 1), (12, 2), (13, 2), (14, 4), (15, 9), (16, 10), (17, 8), (18, 5), (19, 2), (20, 1)]
+# chance of a visit on each weekday relative to Monday, Monday first
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 0.8, 0.4, 0.1]
+
+MEMBER_FIELDS = ('first_name', 'last_name', 'join_date', 'birthday', 'school', 'gender', 'race_ethnicity', 'zip_code')
+
+# rows for one clubhouse's members, in MEMBER_FIELDS order
+def member_rows(rng, count, first_day, last_day):
+    span = (last_day - first_day).days
+    for i in range(count):
+        join_date = first_day + timedelta(days=rng.randrange(span + 1))
+        birthday = join_date - timedelta(days=rng.randrange(10 * 365, 18 * 365))
+        yield (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), join_date, birthday,
+               "School %d" % rng.randrange(1, 40), rng.choice(GENDERS), rng.choice(ETHNICITIES),
+               "%05d" % rng.randrange(1000, 99999))
+
+# closed check-ins of one member between their join date and now: (member id, check-in, check-out)
+# each member visits on average `visits` times a week, at hours drawn from HOUR_WEIGHTS
+# at most once a day: the days are drawn without replacement, so no member gets two check-ins at the same
+# minute, which the unique key idx_checkins_member_start (.schema.sql) would reject
+def checkin_rows(rng, member_id, join_date, now, hours, hour_weights):
+    days = (now.date() - join_date).days
+    if days <= 0:
+        return
+    visits = min(rng.expovariate(1 / 1.5), 5.0) # visits per week
+    for offset in sorted(rng.sample(range(days), min(int(visits * days / 7), days))):
+        day = join_date + timedelta(days=offset)
+        if rng.random() > WEEKDAY_WEIGHTS[day.weekday()]:
+            continue
+        checkin = datetime(day.year, day.month, day.day, rng.choices(hours, cum_weights=hour_weights)[0], rng.randrange(60))
+        stay = timedelta(minutes=min(max(rng.gauss(90, 45), 10), 300))
+        if checkin + stay < now:
+            yield (member_id, checkin, checkin + stay)
+
+def insert_batches(cursor, conn, query, rows, batch_size):
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            cursor.executemany(query, batch)
+            conn.commit()
+            count += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(query, batch)
+        conn.commit()
+        count += len(batch)
+    return count
+
+# empty every table the generator fills
+def clear_tables():
+    conn = get_conn()
+    cursor = conn.cursor()
+    for table in ('checkin_rollups', 'checkins', 'members', 'logins', 'clubhouses'):
+        cursor.execute("DELETE FROM %s" % table)
+    conn.commit()
+    cursor.close()
+
+# one clubhouse with a login (username, password hash) and `members` members joined between first_day and last_day
+# returns (clubhouse id, members created)
+def seed_clubhouse(cursor, conn, rng, username, short_name, password, members, first_day, last_day, batch_size=5000):
+    cursor.execute("""INSERT INTO clubhouses (short_name, full_name, join_date, time_zone)
+                      VALUES (%s, %s, %s, %s)""",
+                      (short_name, "%s Clubhouse" % short_name, first_day, rng.choice(TIME_ZONES)))
+    club_id = cursor.lastrowid
+    cursor.execute("""INSERT INTO logins (username, password, clubhouse_id, is_admin)
+                      VALUES (%s, %s, %s, 0)""", (username, password, club_id))
+    conn.commit()
+    created = insert_batches(cursor, conn,
+        "INSERT INTO members (clubhouse_id, %s) VALUES (%s)" % (", ".join(MEMBER_FIELDS), ", ".join(["%s"] * (len(MEMBER_FIELDS) + 1))),
+        ((club_id,) + row for row in member_rows(rng, members, first_day, last_day)), batch_size)
+    bump_roster_version(cursor, club_id, members=True) # a worker may have loaded the clubhouse in between
+    conn.commit()
+    return club_id, created
+
+# fill clubhouses, members, logins and checkins, then rebuild the rollups
+# progress(club number, member count, check-in count) is called after each clubhouse
+# returns (clubhouses, members, checkins) created
+def generate(clubhouses=10, members=200, years=1, seed=1, batch_size=5000, now=None, progress=None):
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(second=0, microsecond=0)
+    first_day = (now - timedelta(days=int(years * 365))).date()
+    hours = [hour for hour, weight in HOUR_WEIGHTS]
+    hour_weights = []
+    for hour, weight in HOUR_WEIGHTS:
+        hour_weights.append(weight + (hour_weights[-1] if hour_weights else 0))
+    password = generate_password_hash(SEED_PASSWORD) # hashing is slow, every seed login shares one hash
+
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("""INSERT INTO logins (username, password, clubhouse_id, is_admin)
+                      VALUES ('seed-admin', %s, NULL, 1)""", (password,))
+    total_members = total_checkins = 0
+    for number in range(1, clubhouses + 1):
+        club_id, club_members = seed_clubhouse(cursor, conn, rng, "seed-club-%d" % number, "Seed %d" % number,
+                                               password, members, first_day, now.date(), batch_size)
+        total_members += club_members
+        cursor.execute("SELECT member_id, join_date FROM members WHERE clubhouse_id = %s ORDER BY member_id", (club_id,))
+        joined = cursor.fetchall()
+        checkins = (row + (club_id,) for member_id, join_date in joined
+                    for row in checkin_rows(rng, member_id, join_date, now, hours, hour_weights))
+        club_checkins = insert_batches(cursor, conn,
+            "INSERT INTO checkins (member_id, checkin_datetime, checkout_datetime, clubhouse_id) VALUES (%s, %s, %s, %s)",
+            checkins, batch_size)
+        total_checkins += club_checkins
+        if progress:
+            progress(number, len(joined), club_checkins)
+    cursor.close()
+    rebuild_checkin_rollups()
+    return clubhouses, total_members, total_checkins
@@ -0,0 +1,113 @@
+// client-side charts for the view pages
+// draws the JSON series returned by /clubhouse/view/data and /admin/view/data (see build_series in plot.py)
+// kind is 'line', 'bar', 'stats' or 'empty'; labels and values are parallel lists
+
+var CHART_WIDTH = 640;
+var CHART_HEIGHT = 320;
+var CHART_MARGIN = 40;
+var CHART_COLOR = "#2D2769"; // clubhouse purple
+
+// fetch a series and draw it into element, responses for an older url are dropped
+function load_chart(url, element) {
+	element.dataset.url = url;
+	var request = new XMLHttpRequest();
+	request.open("GET", url);
+	request.onload = function() {
+		if (request.status != 200 || element.dataset.url != url) {
+			return;
+		}
+		draw_chart(JSON.parse(request.responseText), element);
+	};
+	request.send();
+}
+
+function svg_node(name, attributes, text) {
+	var node = document.createElementNS("http://www.w3.org/2000/svg", name);
+	for (var key in attributes) {
+		node.setAttribute(key, attributes[key]);
+	}
+	if (text !== undefined) {
+		node.textContent = text;
+	}
+	return node;
+}
+
+function draw_chart(data, element) {
+	element.innerHTML = "";
+	var title = document.createElement("h5");
+	title.textContent = data.title;
+	element.appendChild(title);
+	if (data.kind == "empty") {
+		return;
+	}
+	if (data.kind == "stats") {
+		for (var i = 0; i < data.labels.length; i++) {
+			var line = document.createElement("div");
+			line.textContent = data.labels[i] + ": " + data.values[i];
+			element.appendChild(line);
+		}
+		return;
+	}
+
+	var n = data.values.length;
+	var top = Math.max.apply(null, data.values.concat([1])) * 1.1;
+	var width = CHART_WIDTH - 2 * CHART_MARGIN;
+	var height = CHART_HEIGHT - 2 * CHART_MARGIN;
+	var slot = width / Math.max(n, 1);
+	function x(i) {
+		if (data.kind == "bar") {
+			return CHART_MARGIN + (i + 0.5) * slot;
+		}
+		return CHART_MARGIN + (n > 1 ? i * width / (n - 1) : width / 2);
+	}
+	function y(value) {
+		return CHART_HEIGHT - CHART_MARGIN - value / top * height;
+	}
+
+	var svg = svg_node("svg", {"viewBox": "0 0 " + CHART_WIDTH + " " + CHART_HEIGHT, "width": "100%", "class": "chart"});
+	// axes, with the y range and a few x labels
+	svg.appendChild(svg_node("line", {"x1": CHART_MARGIN, "y1": y(0), "x2": CHART_WIDTH - CHART_MARGIN, "y2": y(0), "stroke": "black"}));
+	svg.appendChild(svg_node("line", {"x1": CHART_MARGIN, "y1": y(0), "x2": CHART_MARGIN, "y2": CHART_MARGIN, "stroke": "black"}));
+	svg.appendChild(svg_node("text", {"x": CHART_MARGIN - 4, "y": y(0), "text-anchor": "end", "font-size": 10}, "0"));
+	svg.appendChild(svg_node("text", {"x": CHART_MARGIN - 4, "y": y(top) + 10, "text-anchor": "end", "font-size": 10}, String(Math.round(top))));
+	var step = Math.max(1, Math.ceil(n / 7));
+	for (var i = 0; i < n; i += step) {
+		svg.appendChild(svg_node("text", {"x": x(i), "y": CHART_HEIGHT - CHART_MARGIN + 14, "text-anchor": "middle", "font-size": 10}, data.labels[i]));
+	}
+
+	if (data.kind == "line") {
+		var points = [];
+		for (var i = 0; i < n; i++) {
+			points.push(x(i) + "," + y(data.values[i]));
+		}
+		svg.appendChild(svg_node("polyline", {"points": points.join(" "), "fill": "none", "stroke": CHART_COLOR}));
+	}
+	for (var i = 0; i < n; i++) {
+		var mark;
+		if (data.kind == "bar") {
+			mark = svg_node("rect", {"x": x(i) - slot * 0.4, "y": y(data.values[i]), "width": slot * 0.8, "height": y(0) - y(data.values[i]), "fill": CHART_COLOR});
+		} else {
+			mark = svg_node("circle", {"cx": x(i), "cy": y(data.values[i]), "r": 3, "fill": CHART_COLOR});
+		}
+		mark.appendChild(svg_node("title", {}, data.labels[i] + ": " + data.values[i])); // tooltip
+		svg.appendChild(mark);
+	}
+	element.appendChild(svg);
+}
+
+// view pages: redraw when the range or format changes instead of posting the form
+// without JavaScript the form still posts and the server renders the plot
+function chart_form(form, url, element) {
+	function update(event) {
+		if (event) {
+			event.preventDefault();
+		}
+		load_chart(url + "?range=" + form.elements["range"].value + "&format=" + form.elements["format"].value, element);
+	}
+	form.addEventListener("submit", update);
+	form.elements["range"].addEventListener("change", function() { update(); });
+	form.elements["format"].addEventListener("change", function() { update(); });
+	if (!element.innerHTML.trim()) {
+		update();
+	}
+}
@@ -0,0 +1,142 @@
+// check-in page: the Check In and Check Out buttons post in the background instead of reloading the page
+// the server answers with the member's new state ({id, name, checked_in, changed}, see checkin_handler) and
+// the member is moved between the lists in place, so whatever else is selected stays selected
+// changes made on other devices arrive as server-sent events (roster_events)
+// without JavaScript the form posts as usual and the page reloads
+
+function checkin_form(form, fields, search_box, status) {
+	var pending = {}; // member ids with a request in flight, a double tap sends nothing more
+	["check_in", "check_out"].forEach(function(action) {
+		form.elements[action].addEventListener("click", function(event) {
+			var select = form.elements[action + "_id"];
+			if (select.selectedIndex < 0) {
+				return;
+			}
+			event.preventDefault();
+			var member_id = select.value;
+			if (pending[member_id]) {
+				return;
+			}
+			pending[member_id] = true;
+			var data = new FormData(form);
+			data.append(action, form.elements[action].value);
+			var request = new XMLHttpRequest();
+			request.open("POST", window.location.pathname);
+			request.setRequestHeader("Accept", "application/json");
+			request.onload = function() {
+				delete pending[member_id];
+				if (request.status != 200) {
+					window.location.reload();
+					return;
+				}
+				show_checkin(JSON.parse(request.responseText), form, status);
+			};
+			request.onerror = function() {
+				delete pending[member_id];
+			};
+			request.send(data);
+		});
+	});
+}
+
+// move the member to the list matching their new state and say what happened
+function show_checkin(result, form, status) {
+	move_member(form, result.id, result.checked_in);
+	status.textContent = result.name + (result.checked_in ? status.dataset.checkedIn : status.dataset.checkedOut);
+}
+
+// move a member shown in one list to the other, in the server's order: each option carries its sort string
+// in data-sort (roster.sort_string: last name, first name, member id), whichever name order is displayed;
+// the other options and their selection are left as they are
+// a member who sorts past the loaded page of the target list is only taken out of the source list, the
+// More button fetches them in their place
+// returns false when the member isn't in the loaded source list
+// check_in_id lists the members who can check in (checked out), check_out_id the checked-in ones
+function move_member(form, member_id, checked_in) {
+	var from = form.elements[checked_in ? "check_in_id" : "check_out_id"];
+	var to = form.elements[checked_in ? "check_out_id" : "check_in_id"];
+	for (var i = 0; i < from.options.length; i++) {
+		if (from.options[i].value == member_id) {
+			var option = from.options[i];
+			from.remove(i);
+			option.selected = false;
+			var j = 0;
+			while (j < to.options.length && to.options[j].dataset.sort < option.dataset.sort) {
+				j++;
+			}
+			if (j < to.options.length) {
+				to.add(option, j);
+			} else if (!has_more(to)) {
+				to.add(option, null);
+			}
+			return true;
+		}
+	}
+	return false;
+}
+
+// whether a list has members past its loaded pages
+function has_more(select) {
+	var button = document.getElementById("more-" + select.name);
+	return button !== null && button.style.display != "none";
+}
+
+// whether a list shows a member
+function lists_member(select, member_id) {
+	for (var i = 0; i < select.options.length; i++) {
+		if (select.options[i].value == member_id) {
+			return true;
+		}
+	}
+	return false;
+}
+
+// live updates from url (/clubhouse/checkin/events): {id, in, time} moves one member, {all_out, time} moves
+// everyone to the checked-out list and {reset, time} means the member list changed
+// deltas are applied to the lists in place, which keeps the kiosk's selection; both lists are only
+// refreshed from the search index when a delta can't be applied that way (a member on a page that isn't
+// loaded, a reset) and after a reconnect, since deltas sent while disconnected are not replayed
+// refreshes wait a second or two (spread out so kiosks don't all ask at once) and keep the selection too
+function roster_events(url, form, fields, search_box) {
+	if (!window.EventSource) {
+		return;
+	}
+	var refresh_timer = null;
+	function refresh() {
+		if (refresh_timer === null) {
+			refresh_timer = setTimeout(function() {
+				refresh_timer = null;
+				search(search_box.value, form, fields);
+			}, 1000 + Math.random() * 1000);
+		}
+	}
+	var connected = false;
+	var source = new EventSource(url);
+	source.onopen = function() {
+		if (connected) {
+			refresh();
+		}
+		connected = true;
+	};
+	source.onmessage = function(event) {
+		var delta = JSON.parse(event.data);
+		if (delta.id !== undefined) {
+			// already moved (this kiosk's own tap), or a member the loaded pages don't show, who may
+			// belong on the loaded page of the other list
+			var target = form.elements[delta["in"] ? "check_out_id" : "check_in_id"];
+			if (!lists_member(target, delta.id) && !move_member(form, delta.id, delta["in"])) {
+				refresh();
+			}
+		} else if (delta.all_out) {
+			var checked_in = form.elements["check_out_id"];
+			while (checked_in.options.length) {
+				move_member(form, checked_in.options[0].value, false);
+			}
+			if (has_more(checked_in)) {
+				refresh();
+			}
+		} else {
+			refresh();
+		}
+	};
+}
@@ -1,27 +1,50 @@
-// search bar for SelectField
+// search bar for member SelectFields
+// pages only render the first page of members, matches are fetched from /clubhouse/search
 // inp is the current input
 // form is the form being considered
-// fields is a list of fields to search over
+// fields maps each field name to the members it lists: 'all', 'in' (checked in) or 'out'
+
+var search_pages = {}; // field name -> last page loaded
+var search_requests = {}; // field name -> number of the latest request, older responses are dropped
 
 function search(inp, form, fields) {
-	// read input
-	cur_inp = inp.toLowerCase();
-        var n = cur_inp.length;
+	for (var name in fields) {
+		search_pages[name] = 0;
+		fetch_members(inp, form, name, fields[name], 0);
+	}
+}
+
+// append the next page of the current search to one field
+function more(inp, form, name, fields) {
+	search_pages[name] = (search_pages[name] || 0) + 1;
+	fetch_members(inp, form, name, fields[name], search_pages[name]);
+}
 
-	// do the search in every field
-	for (i = 0; i< fields.length; i++) {
-		// get all choices for this field
-		var all_choices = form.elements[fields[i]].options;
-		/* display only the matching strings */
-		for (j = 0; j<all_choices.length; j++) {
-			var choice = all_choices[j].text;
-			/* display only the matching strings */
-			if (choice.substring(0,n).toLowerCase() == cur_inp)
-			{
-				all_choices[j].style.display = "block";
-			} else {
-				all_choices[j].style.display = "none";
-			}
+function fetch_members(inp, form, name, status, page) {
+	var select = form.elements[name];
+	var request_id = (search_requests[name] || 0) + 1;
+	search_requests[name] = request_id;
+	var request = new XMLHttpRequest();
+	request.open("GET", "/clubhouse/search?q=" + encodeURIComponent(inp) + "&status=" + status + "&page=" + page);
+	request.onload = function() {
+		if (request.status != 200 || search_requests[name] != request_id) {
+			return;
 		}
-	}
+		var data = JSON.parse(request.responseText);
+		var selected = select.value; // kept selected if the new results still list the member
+		if (page == 0) {
+			select.options.length = 0;
+		}
+		for (var i = 0; i < data.results.length; i++) {
+			var id = String(data.results[i].id);
+			var option = new Option(data.results[i].name, id, false, id === selected);
+			option.dataset.sort = data.results[i].sort; // where checkin.js puts the member when they move
+			select.add(option);
+		}
+		var button = document.getElementById("more-" + name);
+		if (button) {
+			button.style.display = data.more ? "inline" : "none";
+		}
+	};
+	request.send();
 }
@@ -6,3 +6,29 @@ class Config(object):
     SECRET_KEY = os.getenv('SECRET_KEY','to-be-filled')
     LANGUAGES = ['en', 'es']
     # es is currently garbled English, used for testing only
+    # rendered plots are cached per worker for PLOT_CACHE_TTL seconds, at most PLOT_CACHE_SIZE of them
+    PLOT_CACHE_TTL = int(os.getenv('PLOT_CACHE_TTL', 300))
+    PLOT_CACHE_SIZE = int(os.getenv('PLOT_CACHE_SIZE', 256))
+    # logged-in users are cached per worker for USER_CACHE_TTL seconds, only with ROSTER_REDIS_URL (see application/cache.py)
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+    # redis url shared by all processes for live check-in rosters; when unset, rosters follow version counters
+    # in the database (one primary-key read per request, see application/roster.py)
+    ROSTER_REDIS_URL = os.getenv('ROSTER_REDIS_URL')
+    # without redis, an events service (see Procfile) reads the roster versions of the clubhouses with open
+    # check-in pages every ROSTER_EVENTS_POLL seconds and tells those pages to reload their lists; 0 disables
+    ROSTER_EVENTS_POLL = float(os.getenv('ROSTER_EVENTS_POLL', 0))
+    # a worker whose memory passes PLOT_RSS_LIMIT_MB after rendering a plot asks gunicorn to replace it, 0 disables
+    PLOT_RSS_LIMIT_MB = int(os.getenv('PLOT_RSS_LIMIT_MB', 0))
+    # requests running one statement this many times are flagged as N+1 in the request log, 0 disables
+    DB_N_PLUS_ONE_THRESHOLD = int(os.getenv('DB_N_PLUS_ONE_THRESHOLD', 10))
+    # bearer token for /metrics, the endpoint is disabled when unset
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    # check-ins are closed by the auto-checkout sweep within a day, check-outs only look for open check-ins
+    # started in the last OPEN_CHECKIN_DAYS days so they stay in the newest partitions of checkins
+    OPEN_CHECKIN_DAYS = int(os.getenv('OPEN_CHECKIN_DAYS', 2))
+    # write-behind for check-ins: taps are queued in this local SQLite file and written to MySQL in batches
+    # of up to CHECKIN_QUEUE_BATCH events, at least every CHECKIN_QUEUE_INTERVAL seconds; off when unset
+    CHECKIN_QUEUE_PATH = os.getenv('CHECKIN_QUEUE_PATH')
+    CHECKIN_QUEUE_BATCH = int(os.getenv('CHECKIN_QUEUE_BATCH', 500))
+    CHECKIN_QUEUE_INTERVAL = float(os.getenv('CHECKIN_QUEUE_INTERVAL', 0.5))
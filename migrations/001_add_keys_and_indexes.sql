@@ -0,0 +1,29 @@
+-- adds the keys and indexes from .schema.sql to a database created before they existed
+-- apply with: mysql -h $MYSQL_DATABASE_HOST -u $MYSQL_DATABASE_USER -p $MYSQL_DATABASE_DB < migrations/001_add_keys_and_indexes.sql
+-- then verify with: flask check-indexes
+
+-- secondary indexes are built in place without blocking reads or writes
+ALTER TABLE members
+  ADD INDEX idx_members_club_active (clubhouse_id, active, is_checked_in),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+ALTER TABLE checkins
+  ADD INDEX idx_checkins_open (clubhouse_id, checkout_datetime, member_id),
+  ADD INDEX idx_checkins_club_time (clubhouse_id, checkin_datetime),
+  ADD INDEX idx_checkins_member_time (member_id, checkin_datetime),
+  ADD INDEX idx_checkins_time (checkin_datetime),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- adding the auto-increment key rebuilds the table; reads keep working but writes wait until it finishes,
+-- so run it outside opening hours on large databases
+ALTER TABLE checkins
+  ADD COLUMN checkin_id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST,
+  ALGORITHM=INPLACE, LOCK=SHARED;
+
+-- usernames must already be distinct, check with:
+--   SELECT username, COUNT(*) FROM logins GROUP BY username HAVING COUNT(*) > 1;
+-- TINYTEXT cannot carry a full unique index, usernames are short so VARCHAR(64) is plenty
+ALTER TABLE logins
+  MODIFY username VARCHAR(64) NOT NULL,
+  ADD UNIQUE INDEX idx_logins_username (username),
+  ADD INDEX idx_logins_club (clubhouse_id);
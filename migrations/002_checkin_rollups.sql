@@ -0,0 +1,16 @@
+-- hourly check-in rollups used by the dashboards
+-- after applying, fill the table from history with: flask rebuild-rollups
+
+CREATE TABLE IF NOT EXISTS checkin_rollups (
+  clubhouse_id        INT NOT NULL,
+  bucket              DATETIME NOT NULL,
+  checkins            INT NOT NULL DEFAULT 0,
+  stay_seconds        BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (clubhouse_id, bucket),
+  INDEX idx_rollups_bucket (bucket)
+);
+
+-- open check-ins across the network, used for the stay-hours statistics
+ALTER TABLE checkins
+  ADD INDEX idx_checkins_open_time (checkout_datetime, checkin_datetime),
+  ALGORITHM=INPLACE, LOCK=NONE;
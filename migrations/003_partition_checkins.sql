@@ -0,0 +1,22 @@
+-- partitions checkins by month on checkin_datetime (see application/partitions.py)
+-- on a database in use, run instead: flask partition-checkins
+-- it copies the table in batches while triggers keep the copy current, then swaps the two tables, so
+-- the site keeps working throughout (needs the TRIGGER privilege)
+--
+-- this script is the offline equivalent for small or empty databases: it rebuilds the table and blocks
+-- writes while it runs. afterwards create the monthly partitions with: flask roll-partitions
+
+-- the partitioned table needs a check-in time on every row
+UPDATE checkins
+  SET checkin_datetime = COALESCE(checkout_datetime, '1970-01-01')
+  WHERE checkin_datetime IS NULL;
+
+ALTER TABLE checkins
+  MODIFY checkin_datetime DATETIME NOT NULL,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (checkin_id, checkin_datetime);
+
+ALTER TABLE checkins
+  PARTITION BY RANGE COLUMNS (checkin_datetime) (
+    PARTITION pfuture VALUES LESS THAN (MAXVALUE)
+  );
@@ -0,0 +1,77 @@
+-- stored procedures that check a member in or out in one call and one transaction
+-- apply with: mysql -h $MYSQL_DATABASE_HOST -u $MYSQL_DATABASE_USER -p $MYSQL_DATABASE_DB < migrations/004_checkin_procedures.sql
+-- the MySQL user of the app needs the EXECUTE privilege; deploy this before the code that calls them
+
+DROP PROCEDURE IF EXISTS checkin_member;
+DROP PROCEDURE IF EXISTS checkout_member;
+
+DELIMITER //
+
+-- check a member in: one CALL, one transaction (see add_checkin in application/db.py)
+-- the member row is locked first so simultaneous taps for one member run one after the other; a member
+-- who already has a check-in open since p_open_since is left as is, so a double tap adds nothing
+-- returns one row (checked_in, changed), or no row if the member is not active in the clubhouse
+CREATE PROCEDURE checkin_member(IN p_clubhouse_id INT, IN p_member_id INT, IN p_time DATETIME, IN p_open_since DATETIME)
+BEGIN
+  DECLARE found INT DEFAULT 0;
+  DECLARE open_checkins INT DEFAULT 0;
+  DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+  START TRANSACTION;
+  SELECT COUNT(*) INTO found FROM members
+    WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id AND active = 1
+    FOR UPDATE;
+  IF found = 0 THEN
+    ROLLBACK;
+  ELSE
+    SELECT COUNT(*) INTO open_checkins FROM checkins
+      WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+      AND checkout_datetime IS NULL AND checkin_datetime >= p_open_since;
+    IF open_checkins = 0 THEN
+      INSERT INTO checkins (member_id, checkin_datetime, clubhouse_id)
+        VALUES (p_member_id, p_time, p_clubhouse_id);
+      INSERT INTO checkin_rollups (clubhouse_id, bucket, checkins, stay_seconds)
+        VALUES (p_clubhouse_id, TIMESTAMP(DATE(p_time), MAKETIME(HOUR(p_time), 0, 0)), 1, 0)
+        ON DUPLICATE KEY UPDATE checkins = checkins + 1;
+    END IF;
+    UPDATE members SET is_checked_in = 1
+      WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id;
+    COMMIT;
+    SELECT 1 AS checked_in, open_checkins = 0 AS changed;
+  END IF;
+END //
+
+-- check a member out, same shape as checkin_member: closes the member's check-ins opened since
+-- p_open_since and adds their stays to the rollups; a member with nothing open is left as is
+CREATE PROCEDURE checkout_member(IN p_clubhouse_id INT, IN p_member_id INT, IN p_time DATETIME, IN p_open_since DATETIME)
+BEGIN
+  DECLARE found INT DEFAULT 0;
+  DECLARE closed INT DEFAULT 0;
+  DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+  START TRANSACTION;
+  SELECT COUNT(*) INTO found FROM members
+    WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id AND active = 1
+    FOR UPDATE;
+  IF found = 0 THEN
+    ROLLBACK;
+  ELSE
+    INSERT INTO checkin_rollups (clubhouse_id, bucket, checkins, stay_seconds)
+      SELECT * FROM (
+        SELECT clubhouse_id, TIMESTAMP(DATE(checkin_datetime), MAKETIME(HOUR(checkin_datetime), 0, 0)) AS bucket,
+          0 AS checkins, SUM(TIMESTAMPDIFF(SECOND, checkin_datetime, p_time)) AS stay_seconds
+        FROM checkins
+        WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+        AND checkout_datetime IS NULL AND checkin_datetime >= p_open_since
+        GROUP BY clubhouse_id, bucket) AS closing
+      ON DUPLICATE KEY UPDATE stay_seconds = checkin_rollups.stay_seconds + closing.stay_seconds;
+    UPDATE checkins SET checkout_datetime = p_time
+      WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+      AND checkout_datetime IS NULL AND checkin_datetime >= p_open_since;
+    SET closed = ROW_COUNT();
+    UPDATE members SET is_checked_in = 0
+      WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id;
+    COMMIT;
+    SELECT 0 AS checked_in, closed > 0 AS changed;
+  END IF;
+END //
+
+DELIMITER ;
@@ -0,0 +1,10 @@
+-- one check-in per member and second, lets a batch from the write-behind check-in queue (CHECKIN_QUEUE_PATH)
+-- be applied again after a crash without storing its check-ins twice
+-- apply with: mysql -h $MYSQL_DATABASE_HOST -u $MYSQL_DATABASE_USER -p $MYSQL_DATABASE_DB < migrations/005_checkin_queue_key.sql
+-- fails if duplicates already exist, list them with:
+--   SELECT clubhouse_id, member_id, checkin_datetime, COUNT(*) FROM checkins
+--   GROUP BY clubhouse_id, member_id, checkin_datetime HAVING COUNT(*) > 1;
+
+ALTER TABLE checkins
+  ADD UNIQUE INDEX idx_checkins_member_start (clubhouse_id, member_id, checkin_datetime),
+  ALGORITHM=INPLACE, LOCK=NONE;
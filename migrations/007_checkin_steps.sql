@@ -0,0 +1,131 @@
+-- check-in and check-out procedures that tolerate repeats: the write-behind queue (CHECKIN_QUEUE_PATH) flushes
+-- through the same steps as a direct check-in, so a stale roster or a batch applied again after a crash can't
+-- open a second check-in or count a stay twice, and in, out, in within one second no longer hits the unique key
+-- apply with: mysql -h $MYSQL_DATABASE_HOST -u $MYSQL_DATABASE_USER -p $MYSQL_DATABASE_DB < migrations/007_checkin_steps.sql
+-- deploy this before the code that calls record_checkin and record_checkout
+
+DROP PROCEDURE IF EXISTS checkin_member;
+DROP PROCEDURE IF EXISTS checkout_member;
+DROP PROCEDURE IF EXISTS record_checkin;
+DROP PROCEDURE IF EXISTS record_checkout;
+
+DELIMITER //
+
+-- the check-in and check-out steps shared by the procedures below and the write-behind queue flush
+-- (apply_checkin_events in application/db.py, which calls them for a whole batch in one transaction);
+-- no transaction control of their own, the member row is locked first so simultaneous taps for one
+-- member run one after the other
+-- both are safe to repeat for the same event, which is what makes a replayed queue batch harmless:
+-- - a check-in adds nothing while the member has a check-in open since p_open_since; a check-in already
+--   stored for p_time (the unique key idx_checkins_member_start) is reopened when it was checked out in
+--   the same second (in, out, in within one second, its stay was 0) and left alone otherwise
+-- - a check-out only closes check-ins started at or before p_time, so it never closes a later one
+-- members.is_checked_in is set to whether a check-in is left open and roster_version is bumped when
+-- anything changed, so every process's roster reloads
+-- p_found is 0 (and nothing is written) when the member is not active in the clubhouse
+CREATE PROCEDURE record_checkin(IN p_clubhouse_id INT, IN p_member_id INT, IN p_time DATETIME, IN p_open_since DATETIME,
+                                OUT p_found INT, OUT p_checked_in INT, OUT p_changed INT)
+BEGIN
+  DECLARE was_in INT DEFAULT 0;
+  DECLARE open_checkins INT DEFAULT 0;
+  DECLARE same_second INT DEFAULT 0;
+  SET p_changed = 0;
+  SELECT COUNT(*), COALESCE(MAX(is_checked_in), 0) INTO p_found, was_in FROM members
+    WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id AND active = 1
+    FOR UPDATE;
+  IF p_found > 0 THEN
+    SELECT COUNT(*) INTO open_checkins FROM checkins
+      WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+      AND checkout_datetime IS NULL AND checkin_datetime >= p_open_since;
+    IF open_checkins = 0 THEN
+      SELECT COUNT(*) INTO same_second FROM checkins
+        WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id AND checkin_datetime = p_time;
+      IF same_second = 0 THEN
+        INSERT INTO checkins (member_id, checkin_datetime, clubhouse_id)
+          VALUES (p_member_id, p_time, p_clubhouse_id);
+        INSERT INTO checkin_rollups (clubhouse_id, bucket, checkins, stay_seconds)
+          VALUES (p_clubhouse_id, TIMESTAMP(DATE(p_time), MAKETIME(HOUR(p_time), 0, 0)), 1, 0)
+          ON DUPLICATE KEY UPDATE checkins = checkins + 1;
+        SET p_changed = 1;
+      ELSE
+        UPDATE checkins SET checkout_datetime = NULL
+          WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+          AND checkin_datetime = p_time AND checkout_datetime = p_time;
+        SET p_changed = ROW_COUNT() > 0;
+      END IF;
+    END IF;
+    SET p_checked_in = open_checkins > 0 OR p_changed;
+    UPDATE members SET is_checked_in = p_checked_in
+      WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id;
+    IF p_changed OR was_in <> p_checked_in THEN
+      UPDATE clubhouses SET roster_version = roster_version + 1 WHERE clubhouse_id = p_clubhouse_id;
+    END IF;
+  END IF;
+END //
+
+CREATE PROCEDURE record_checkout(IN p_clubhouse_id INT, IN p_member_id INT, IN p_time DATETIME, IN p_open_since DATETIME,
+                                 OUT p_found INT, OUT p_checked_in INT, OUT p_changed INT)
+BEGIN
+  DECLARE was_in INT DEFAULT 0;
+  DECLARE still_open INT DEFAULT 0;
+  SET p_changed = 0;
+  SELECT COUNT(*), COALESCE(MAX(is_checked_in), 0) INTO p_found, was_in FROM members
+    WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id AND active = 1
+    FOR UPDATE;
+  IF p_found > 0 THEN
+    INSERT INTO checkin_rollups (clubhouse_id, bucket, checkins, stay_seconds)
+      SELECT * FROM (
+        SELECT clubhouse_id, TIMESTAMP(DATE(checkin_datetime), MAKETIME(HOUR(checkin_datetime), 0, 0)) AS bucket,
+          0 AS checkins, SUM(TIMESTAMPDIFF(SECOND, checkin_datetime, p_time)) AS stay_seconds
+        FROM checkins
+        WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+        AND checkout_datetime IS NULL AND checkin_datetime >= p_open_since AND checkin_datetime <= p_time
+        GROUP BY clubhouse_id, bucket) AS closing
+      ON DUPLICATE KEY UPDATE stay_seconds = checkin_rollups.stay_seconds + closing.stay_seconds;
+    UPDATE checkins SET checkout_datetime = p_time
+      WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+      AND checkout_datetime IS NULL AND checkin_datetime >= p_open_since AND checkin_datetime <= p_time;
+    SET p_changed = ROW_COUNT() > 0;
+    SELECT COUNT(*) INTO still_open FROM checkins
+      WHERE clubhouse_id = p_clubhouse_id AND member_id = p_member_id
+      AND checkout_datetime IS NULL AND checkin_datetime >= p_open_since;
+    SET p_checked_in = still_open > 0;
+    UPDATE members SET is_checked_in = p_checked_in
+      WHERE member_id = p_member_id AND clubhouse_id = p_clubhouse_id;
+    IF p_changed OR was_in <> p_checked_in THEN
+      UPDATE clubhouses SET roster_version = roster_version + 1 WHERE clubhouse_id = p_clubhouse_id;
+    END IF;
+  END IF;
+END //
+
+-- check a member in or out: one CALL, one transaction (see set_member_checkin in application/db.py)
+-- returns one row (checked_in, changed), or no row if the member is not active in the clubhouse
+CREATE PROCEDURE checkin_member(IN p_clubhouse_id INT, IN p_member_id INT, IN p_time DATETIME, IN p_open_since DATETIME)
+BEGIN
+  DECLARE found INT DEFAULT 0;
+  DECLARE checked_in INT DEFAULT 0;
+  DECLARE changed INT DEFAULT 0;
+  DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+  START TRANSACTION;
+  CALL record_checkin(p_clubhouse_id, p_member_id, p_time, p_open_since, found, checked_in, changed);
+  COMMIT;
+  IF found > 0 THEN
+    SELECT checked_in, changed;
+  END IF;
+END //
+
+CREATE PROCEDURE checkout_member(IN p_clubhouse_id INT, IN p_member_id INT, IN p_time DATETIME, IN p_open_since DATETIME)
+BEGIN
+  DECLARE found INT DEFAULT 0;
+  DECLARE checked_in INT DEFAULT 0;
+  DECLARE changed INT DEFAULT 0;
+  DECLARE EXIT HANDLER FOR SQLEXCEPTION BEGIN ROLLBACK; RESIGNAL; END;
+  START TRANSACTION;
+  CALL record_checkout(p_clubhouse_id, p_member_id, p_time, p_open_since, found, checked_in, changed);
+  COMMIT;
+  IF found > 0 THEN
+    SELECT checked_in, changed;
+  END IF;
+END //
+
+DELIMITER ;
@@ -0,0 +1,77 @@
+# shared test helpers
+# modules that import the application package need the full requirements (flask, pymysql, ...) and are
+# skipped without them; standalone modules such as pool.py are loaded straight from their file
+
+import importlib.util
+import os
+import sys
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# import application/<name>.py on its own, without running application/__init__.py
+def load_module(name):
+    spec = importlib.util.spec_from_file_location('standalone_' + name, os.path.join(ROOT, 'application', name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# stands in for a pymysql connection on a request: records every statement and answers reads with
+# answer(query, args), a list of rows (nothing by default)
+class FakeConnection:
+    def __init__(self, answer=None):
+        self.answer = answer or (lambda query, args: [])
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self, *args):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+class FakeCursor:
+    lastrowid = 1
+    rowcount = 1
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.conn.statements.append(" ".join(query.split()))
+        self.rows = list(self.conn.answer(query, args))
+
+    def executemany(self, query, args):
+        self.conn.statements.append(" ".join(query.split()))
+        self.rows = []
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def nextset(self):
+        return None
+
+    def close(self):
+        pass
+
+# an app context in which db.get_conn() hands out conn (needs the full requirements)
+@contextmanager
+def database(conn):
+    from flask import g
+    from application import application
+    from application.pool import PooledConnection
+    with application.app_context():
+        g.db_conn = PooledConnection(conn)
+        try:
+            yield conn
+        finally:
+            del g.db_conn
@@ -0,0 +1,67 @@
+# flask check-indexes must EXPLAIN every statement of a helper, not just the ones before the first
+# result it unpacks; a fake connection answers EXPLAIN with a canned plan and reads with one row of zeros
+
+import re
+from datetime import datetime
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('pymysql')
+
+from application import application, db
+from application.cli import ExplainConnection, explain_helper, full_scans
+from application.pool import PooledConnection
+
+class FakeCursor:
+    def __init__(self, scans):
+        self.scans = scans # tables the fake optimizer reads in full
+        self.rows = []
+
+    def execute(self, query, args=None):
+        if query.startswith('EXPLAIN '):
+            table = re.search(r'\bFROM\s+(\w+)', query).group(1)
+            self.rows = [{'table': table, 'type': 'ALL' if table in self.scans else 'range',
+                          'key': None if table in self.scans else 'idx', 'partitions': None}]
+        else:
+            self.rows = [(0, 0)]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self, scans=()):
+        self.scans = scans
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self.scans)
+
+def explain(helper, args, scans=()):
+    explainer = ExplainConnection(FakeConnection(scans))
+    with application.app_context():
+        from flask import g
+        g.db_conn = PooledConnection(explainer)
+        try:
+            return explain_helper(explainer, helper, args)
+        finally:
+            del g.db_conn
+
+def test_every_statement_of_a_helper_is_explained():
+    plans, error = explain(db.get_rollup_totals, (datetime(2026, 1, 1), 1))
+    assert error is None
+    assert [plan[0]['table'] for query, plan in plans] == ['checkin_rollups', 'checkins']
+
+def test_a_helper_that_stops_early_is_reported():
+    def helper():
+        cursor = db.get_conn().cursor()
+        cursor.execute("SELECT member_id FROM members WHERE member_id = %s", (1,))
+        raise ValueError("unexpected row")
+    plans, error = explain(helper, ())
+    assert len(plans) == 1
+    assert isinstance(error, ValueError)
+
+def test_full_scans_are_found_per_statement():
+    plans, error = explain(db.get_rollup_totals, (datetime(2026, 1, 1),), scans=('checkins',))
+    assert [full_scans(plan) for query, plan in plans] == [[], [('checkins', 'ALL')]]
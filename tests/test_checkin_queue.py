@@ -0,0 +1,57 @@
+# a queued batch goes through the same record_checkin/record_checkout steps as a direct check-in, in order
+# and in one transaction, so it is checked against what MySQL has stored and can be applied twice
+
+import os
+import re
+from datetime import datetime, timedelta
+import pytest
+
+pytest.importorskip('flask')
+
+from conftest import ROOT, FakeConnection, database
+from application import db
+
+def test_batch_is_one_transaction_of_procedure_steps():
+    now = datetime(2026, 10, 18, 9, 0, 0)
+    events = [(7, 2, True, now), (7, 2, False, now), (7, 2, True, now), (8, 3, False, now + timedelta(seconds=1))]
+    with database(FakeConnection()) as conn:
+        db.apply_checkin_events(events)
+    assert [statement.split('(')[0] for statement in conn.statements] == \
+        ['CALL record_checkin', 'CALL record_checkout', 'CALL record_checkin', 'CALL record_checkout']
+    assert conn.commits == 1
+
+# the procedures as created by a file, by name
+def procedures(path):
+    with open(os.path.join(ROOT, path)) as sql:
+        return dict(re.findall(r"CREATE PROCEDURE (\w+)(.*?END //)", sql.read(), re.S))
+
+def test_migration_matches_the_schema():
+    assert procedures('migrations/007_checkin_steps.sql') == procedures('.schema.sql')
+
+# taps are queued without asking the roster whether they change anything: on the database backend the
+# roster doesn't have the queued events yet, so a check-out right after a queued check-in looked like a
+# repeat and was dropped
+def test_checkout_after_a_queued_checkin_is_queued(tmp_path, monkeypatch):
+    from application import roster
+    from application.checkinqueue import CheckinQueue
+    def answer(query, args):
+        if 'SELECT roster_version, members_version' in query:
+            return [(1, 1)]
+        if 'SELECT c.roster_version, m.member_id' in query:
+            return [(1, None)]
+        if 'SELECT member_id, first_name, last_name, is_checked_in' in query:
+            return [(2, "Bo", "Brown", False)]
+        return []
+    monkeypatch.setattr(roster, 'backend', roster.DatabaseRosterBackend())
+    monkeypatch.setattr(roster, 'rosters', {})
+    monkeypatch.setattr(CheckinQueue, 'start', lambda queue: None) # nothing is flushed to MySQL here
+    queue = CheckinQueue(str(tmp_path / 'checkins.sqlite'))
+    monkeypatch.setattr(db, 'get_checkin_queue', lambda: queue)
+    taps = [(True, (True, True)), (True, (True, False)), (False, (False, True)), (False, (False, False))]
+    for checked_in, state in taps:
+        with database(FakeConnection(answer)) as conn: # a new request for every tap
+            assert db.set_member_checkin(2, 7, checked_in) == state
+        assert not any('checkins' in statement for statement in conn.statements)
+    assert [event[3] for event in queue.peek(10)] == [True, False]
+    with database(FakeConnection(answer)):
+        assert db.set_member_checkin(9, 7, True) is None # not a member
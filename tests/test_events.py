@@ -0,0 +1,26 @@
+# without redis, an events service learns about check-ins made by the web workers from roster_version and
+# tells its kiosks to reload their lists
+
+import pytest
+
+pytest.importorskip('flask')
+
+from application import db, events
+
+class Stop(Exception):
+    pass
+
+def test_moved_version_resets_the_clubhouse_streams(monkeypatch):
+    versions = iter([(1, 1), (1, 1), (2, 1)])
+    monkeypatch.setattr(db, 'get_roster_versions', lambda club_id: next(versions))
+    polls = iter(range(3))
+    def sleep(seconds):
+        if next(polls, None) is None:
+            raise Stop()
+    monkeypatch.setattr(events.time, 'sleep', sleep)
+    broker = events.Broker()
+    deltas = broker.subscribe(7) # no poll yet, so no watcher thread: watch() runs below instead
+    broker.poll = 2
+    with pytest.raises(Stop):
+        broker.watch()
+    assert deltas.get_nowait()['reset'] and deltas.empty()
@@ -0,0 +1,25 @@
+# member files are read from upload streams that are not io.IOBase objects (SpooledTemporaryFile before
+# Python 3.11 has no readable()), so the CSV reader may only rely on read()
+
+import pytest
+
+pytest.importorskip('flask')
+
+from application.importer import read_csv, validate_row
+
+class Upload:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+CSV = '\ufeffFirst Name,Last Name,City,Join Date\r\nZoë,Ølsen,"Saint\r\nPaul",2026-10-01\r\nBo,Brown,,\r\n'.encode('utf-8')
+
+def test_csv_is_read_from_a_plain_stream():
+    rows = list(read_csv(Upload(CSV)))
+    assert rows[0] == {'first_name': "Zoë", 'last_name': "Ølsen", 'city': "Saint\r\nPaul", 'join_date': '2026-10-01'}
+    assert validate_row(rows[1])[:3] == ("Bo", "Brown", None)
@@ -0,0 +1,55 @@
+# adding or editing a member or clubhouse writes every field in one whitelisted statement, instead of a
+# placeholder row followed by one UPDATE per form field
+
+import pytest
+
+pytest.importorskip('flask')
+
+from conftest import FakeConnection, database
+from application import db, roster
+from application.roster import LocalRosterBackend
+
+MEMBER = {'first_name': "Ada", 'last_name': "Adams", 'city': "Boston", 'member_email': "ada@example.org",
+          'join_date': '2026-10-01', 'csrf_token': 'x', 'submit': 'Save', 'first_name = 1; --': 'x'}
+CLUBHOUSE = {'username': 'club', 'password': 'secret', 'full_name': "Seventh Clubhouse", 'short_name': "",
+             'time_zone': 'America/New_York', 'image': None, 'display_by_last': 0, 'csrf_token': 'x'}
+
+@pytest.fixture(autouse=True)
+def local_roster(monkeypatch):
+    monkeypatch.setattr(roster, 'backend', LocalRosterBackend())
+    monkeypatch.setattr(roster, 'rosters', {})
+
+def writes(table, statements):
+    return [statement for statement in statements if table in statement and not statement.startswith('UPDATE clubhouses SET roster_version')]
+
+def test_add_member_is_one_insert():
+    with database(FakeConnection()) as conn:
+        db.add_member(7, MEMBER)
+    assert len(conn.statements) == 2 and conn.commits == 1 # the member and the roster version bump
+    insert, = writes('members', conn.statements)
+    assert insert.startswith("INSERT INTO members (clubhouse_id, first_name, last_name, city, member_email, join_date)")
+    assert 'csrf_token' not in insert and '--' not in insert
+
+def test_edit_member_is_one_update():
+    with database(FakeConnection()) as conn:
+        db.edit_member(7, 3, MEMBER)
+    assert len(conn.statements) == 2 and conn.commits == 1
+    update, = writes('members', conn.statements)
+    assert update.startswith("UPDATE members SET first_name = %s, last_name = %s, city = %s, member_email = %s, join_date = %s WHERE")
+
+def test_edit_member_without_fields_writes_nothing(monkeypatch):
+    dropped = []
+    monkeypatch.setattr(db, 'invalidate_club_plots', dropped.append)
+    monkeypatch.setattr(db, 'invalidate_roster', dropped.append)
+    with database(FakeConnection()) as conn:
+        db.edit_member(7, 3, {'csrf_token': 'x'})
+    assert conn.statements == [] and conn.commits == 0
+    assert dropped == [] # every worker's caches are kept
+
+def test_add_clubhouse_is_one_insert_per_table():
+    with database(FakeConnection()) as conn:
+        db.add_clubhouse(CLUBHOUSE)
+    assert len(conn.statements) == 2 and conn.commits == 1 # the clubhouse and its login
+    clubhouse, login = conn.statements
+    assert clubhouse.startswith("INSERT INTO clubhouses (short_name, full_name, time_zone, image, display_by_last)")
+    assert login.startswith("INSERT INTO logins") and 'secret' not in login
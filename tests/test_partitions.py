@@ -0,0 +1,42 @@
+# flask partition-checkins creates its copy from the checkins statement in .schema.sql, so the two can't
+# drift apart
+
+import re
+import pytest
+
+pytest.importorskip('flask')
+
+from conftest import FakeConnection, database
+from application import db
+
+def test_copy_has_the_schema_keys_and_the_new_months():
+    definitions = ["PARTITION p202610 VALUES LESS THAN ('2026-11-01')", "PARTITION p202611 VALUES LESS THAN ('2026-12-01')"]
+    with database(FakeConnection()) as conn:
+        db.start_checkins_copy('checkins_partitioned', definitions)
+    create, = [statement for statement in conn.statements if statement.startswith('CREATE TABLE')]
+    with open(db.SCHEMA_PATH) as schema:
+        keys = re.findall(r"INDEX (idx_checkins_\w+)", schema.read())
+    assert create.startswith("CREATE TABLE checkins_partitioned (")
+    assert keys and all("INDEX %s " % key in create for key in keys)
+    assert create.endswith("PARTITION p202610 VALUES LESS THAN ('2026-11-01'), PARTITION p202611 VALUES LESS THAN ('2026-12-01'), "
+                           "PARTITION pfuture VALUES LESS THAN (MAXVALUE) )")
+
+# the copy only skips rows the triggers already wrote, and refuses to start over check-ins the unique key
+# would reject, so no history is dropped on the way
+def test_duplicates_stop_the_migration_before_copying():
+    from application import partitions
+    def answer(query, args):
+        if 'HAVING COUNT(*) > 1' in query:
+            return [(7, 2, '2026-10-01 09:00:00', 2)]
+        return []
+    with database(FakeConnection(answer)) as conn:
+        with pytest.raises(ValueError, match="member 2"):
+            partitions.migrate()
+    assert not any(statement.startswith(('CREATE', 'INSERT')) for statement in conn.statements)
+
+def test_copy_skips_only_rows_already_copied():
+    with database(FakeConnection()) as conn:
+        db.copy_checkins('checkins_partitioned', 0, 100)
+    insert, = conn.statements
+    assert insert.startswith('INSERT INTO checkins_partitioned') and 'IGNORE' not in insert
+    assert 'NOT EXISTS (SELECT 1 FROM checkins_partitioned AS copied WHERE copied.checkin_id = checkins.checkin_id)' in insert
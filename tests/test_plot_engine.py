@@ -0,0 +1,15 @@
+# the bucketing engine must give the views the old per-row loops gave, on the same raw check-ins
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+pytest.importorskip('flask')
+
+from application import benchmark
+
+def test_engine_matches_loops():
+    rows, now = benchmark.engine_rows(5000, seed=3)
+    expected = benchmark.loop_views(rows, now)
+    views = benchmark.engine_views(*benchmark.engine_columns(rows, now), now)
+    for name in expected:
+        assert numpy.allclose(numpy.array(views[name], dtype=float), numpy.array(expected[name], dtype=float)), name
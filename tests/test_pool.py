@@ -0,0 +1,63 @@
+import threading
+import time
+from conftest import load_module
+
+pool_module = load_module('pool')
+
+class FakeConnection:
+    def __init__(self, ping_seconds=0):
+        self.ping_seconds = ping_seconds
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        time.sleep(self.ping_seconds)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def test_reuses_idle_connections():
+    pool = pool_module.ConnectionPool(FakeConnection, size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert pool.stats()['creations'] == 1
+
+def test_times_out_when_exhausted():
+    pool = pool_module.ConnectionPool(FakeConnection, size=1, timeout=0.05)
+    pool.acquire()
+    try:
+        pool.acquire()
+    except pool_module.PoolTimeout:
+        pass
+    else:
+        raise AssertionError("expected PoolTimeout")
+    assert pool.stats()['timeouts'] == 1
+
+def test_slow_ping_does_not_block_other_checkouts():
+    connections = [FakeConnection(ping_seconds=0.5), FakeConnection()]
+    pool = pool_module.ConnectionPool(lambda: connections.pop(0), size=2, ping_after=0)
+    slow = pool.acquire()
+    pool.release(slow) # idle, pinged on its next checkout
+    pinging = threading.Thread(target=pool.acquire)
+    pinging.start()
+    time.sleep(0.05) # the other thread is now pinging the slow connection
+    started = time.monotonic()
+    other = pool.acquire() # opens the second connection
+    assert time.monotonic() - started < 0.25
+    assert other.raw is not slow.raw
+    pinging.join()
+
+def test_failed_ping_discards_and_reconnects():
+    class DeadConnection(FakeConnection):
+        def ping(self, reconnect=False):
+            raise OSError("gone")
+    connections = [DeadConnection(), FakeConnection()]
+    pool = pool_module.ConnectionPool(lambda: connections.pop(0), size=1, ping_after=0)
+    dead = pool.acquire()
+    pool.release(dead)
+    fresh = pool.acquire()
+    assert dead.raw.closed and fresh is not dead
+    assert pool.stats()['failed_pings'] == 1 and pool.stats()['open'] == 1
@@ -0,0 +1,33 @@
+# the no-JavaScript fallback renders every dashboard format with matplotlib and mpld3 (render_plot), which
+# breaks when matplotlib drops an API the plots use (Axes.plot_date in 3.9+)
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('matplotlib')
+pytest.importorskip('mpld3')
+
+from conftest import FakeConnection, database
+from application import plot
+
+def answer(query, args):
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    if 'FROM members' in query:
+        return [(date(2026, 1, 5), 3), (date(2026, 3, 1), 2)]
+    if 'HOUR(bucket)' in query:
+        return [(9, Decimal(4)), (15, Decimal(2))]
+    if 'WEEKDAY(bucket)' in query:
+        return [(0, Decimal(3)), (4, Decimal(1))]
+    if 'SUM(checkins)' in query and 'GROUP BY' in query: # per hour or per day
+        return [(now - timedelta(hours=2), Decimal(5)), (now - timedelta(days=2), Decimal(1))]
+    if 'FROM checkin_rollups' in query:
+        return [(Decimal(12), Decimal(7200))]
+    return [(Decimal(0),)]
+
+@pytest.mark.parametrize('time_range, data_format', [('1', '0'), ('30', '0'), ('30', '1'), ('30', '2'), ('30', '3'), ('30', '4')])
+def test_every_format_renders(time_range, data_format):
+    with database(FakeConnection(answer)):
+        html = plot.render_plot(time_range, data_format, 7)
+    assert html and ('mpld3' in html or 'Average' in html)
@@ -0,0 +1,45 @@
+# MySQL returns SUM() as DECIMAL; the stats views divide the totals by plain numbers, which fails on a
+# Decimal unless the helpers convert them
+
+from datetime import datetime
+from decimal import Decimal
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('numpy')
+
+from conftest import FakeConnection, database
+from application import db, plot
+
+# rollups: 12 check-ins and 7200 s stayed; open stays: 1800 s; raw checkins: 3 check-ins, 4.5 h
+def answer(query, args):
+    if 'FROM checkin_rollups' in query:
+        return [(Decimal(12), Decimal(7200))]
+    if 'checkout_datetime IS NULL' in query:
+        return [(Decimal(1800),)]
+    return [(3, Decimal('4.5000'))]
+
+def test_rollup_totals_are_plain_numbers():
+    with database(FakeConnection(answer)):
+        totals = db.get_rollup_totals(datetime(2026, 1, 1), 1)
+    assert totals == (12, 2.5)
+    assert type(totals[0]) is int and type(totals[1]) is float
+
+def test_checkin_totals_are_plain_numbers():
+    with database(FakeConnection(answer)):
+        totals = db.get_checkin_totals(datetime(2026, 1, 1), 1, 5)
+    assert totals == (3, 4.5)
+    assert type(totals[0]) is int and type(totals[1]) is float
+
+@pytest.mark.parametrize('club_id', [None, 1])
+def test_stats_views(club_id):
+    with database(FakeConnection(answer)):
+        stats = plot.build_series('30', '3', club_id)
+        text = plot.avg_stats('30', club_id)
+    assert stats['values'] == [0.4, 0.21]
+    assert '0.21' in text
+
+def test_member_stats_view():
+    with database(FakeConnection(answer)):
+        stats = plot.build_series('30', '3', 1, 5)
+    assert stats['values'] == [0.1, 1.5]
@@ -0,0 +1,132 @@
+# rosters without redis follow the version counters on the clubhouse row, so a change committed by another
+# process (another worker, the clock process, a CLI command) shows up on the next request
+
+import pytest
+
+pytest.importorskip('flask')
+
+from conftest import FakeConnection, database
+from application import application, roster
+from application.roster import DatabaseRosterBackend, Roster
+
+ROWS = [(1, "Ada", "Adams", False), (2, "Bo", "Brown", True), (3, "Cy", "Chen", False)]
+
+class Clubhouse:
+    def __init__(self):
+        self.roster_version = 1
+        self.members_version = 1
+        self.checked_in = {2}
+
+    def answer(self, query, args):
+        if 'SELECT roster_version, members_version' in query:
+            return [(self.roster_version, self.members_version)]
+        if 'SELECT c.roster_version, m.member_id' in query:
+            return [(self.roster_version, member_id) for member_id in sorted(self.checked_in)] or [(self.roster_version, None)]
+        return []
+
+@pytest.fixture
+def clubhouse(monkeypatch):
+    monkeypatch.setattr(roster, 'backend', DatabaseRosterBackend())
+    monkeypatch.setattr(roster, 'rosters', {})
+    return Clubhouse()
+
+def lists(clubhouse):
+    with database(FakeConnection(clubhouse.answer)) as conn:
+        members = roster.get_roster(7, lambda club_id: ROWS)
+        result = members.lists()
+        assert members.is_checked_in(2) == ('2' in result[0])
+    return result, conn.statements
+
+def test_change_from_another_process_is_seen(clubhouse):
+    assert lists(clubhouse)[0] == (['2'], ['1', '3'])
+    clubhouse.checked_in = {1, 2} # committed elsewhere, with its version bump
+    clubhouse.roster_version += 1
+    assert lists(clubhouse)[0] == (['1', '2'], ['3'])
+
+def test_unchanged_roster_costs_one_read(clubhouse):
+    lists(clubhouse)
+    result, statements = lists(clubhouse)
+    assert result == (['2'], ['1', '3'])
+    assert len(statements) == 1
+
+def test_write_in_this_request_is_read_back(clubhouse):
+    with database(FakeConnection(clubhouse.answer)):
+        members = roster.get_roster(7, lambda club_id: ROWS)
+        assert members.lists() == (['2'], ['1', '3'])
+        clubhouse.checked_in = set()
+        clubhouse.roster_version += 1
+        roster.roster_mark(7, 2, False)
+        assert members.lists() == ([], ['1', '2', '3'])
+
+def test_unknown_member_is_not_displayed():
+    members = Roster(7, ROWS, 1)
+    assert members.display(['3', '4']) == [('3', "Cy Chen")]
+
+def test_member_added_since_the_roster_was_built_is_looked_up(clubhouse, monkeypatch):
+    from application.forms import CheckinManager
+    def answer(query, args):
+        if 'SELECT first_name, last_name' in query:
+            return [("Di", "Diaz")]
+        return clubhouse.answer(query, args)
+    monkeypatch.setitem(application.config, 'WTF_CSRF_ENABLED', False)
+    with application.test_request_context(), database(FakeConnection(answer)):
+        roster.rosters[7] = Roster(7, ROWS, 1)
+        manager = CheckinManager(7, True)
+        assert manager.get_member_display(4) == ('4', "Diaz, Di")
+
+def test_set_is_only_fetched_after_a_change(monkeypatch):
+    from application.benchmark import CountingBackend
+    counting = CountingBackend(roster.LocalRosterBackend())
+    monkeypatch.setattr(roster, 'backend', counting)
+    monkeypatch.setattr(roster, 'rosters', {})
+    members = roster.get_roster(7, lambda club_id: ROWS)
+    assert members.lists() == (['2'], ['1', '3'])
+    assert members.is_checked_in(2) and members.is_checked_out(3)
+    assert counting.calls['state'] == 1
+    roster.roster_mark(7, 3, True) # applied in place, the version moves by one
+    assert members.lists(1) == (['2'], ['1'])
+    assert members.is_checked_in(3)
+    assert counting.calls['state'] == 1
+
+def test_ranked_set_keeps_one_of_each():
+    ranks = roster.RankedSet([3, 1])
+    ranks.add(2)
+    ranks.add(2)
+    ranks.discard(5)
+    assert list(ranks) == [1, 2, 3]
+
+# writes made outside the web workers (clock process, import-members, seed) bump the version too (queued
+# check-ins through the procedures, see test_checkin_queue.py), otherwise the workers' rosters would never notice them
+def test_background_writes_bump_the_version(clubhouse):
+    from datetime import datetime
+    from application import db
+    def answer(query, args):
+        if 'SELECT member_id FROM checkins' in query:
+            return [(2,)]
+        return []
+    now = datetime(2026, 10, 18, 9, 0)
+    writes = [lambda: db.auto_checkout_clubhouse(7, now),
+              lambda: db.add_members_bulk(7, [("Di", "Diaz") + (None,) * (len(db.MEMBER_COLUMNS) - 2)])]
+    for write in writes:
+        with database(FakeConnection(answer)) as conn:
+            write()
+        bumps = [statement for statement in conn.statements if statement.startswith('UPDATE clubhouses SET roster_version')]
+        assert len(bumps) == 1 and conn.commits == 1
+
+# the check-in lists, the search results and static/checkin.js agree on one order, whichever name order is
+# displayed: the roster sorts like the search index (not MySQL's collation) and hands out the sort strings
+def test_options_carry_the_search_order(monkeypatch):
+    from application.forms import CheckinForm
+    from application.search import MemberIndex
+    rows = [(5, "eve", "adams", False), (1, "Zed", "Adams", False), (3, "Al", "Brown", False)]
+    members = Roster(7, rows, 1)
+    assert members.order == ['5', '1', '3'] # case doesn't matter
+    index = MemberIndex([row[:3] for row in rows], 1)
+    assert [index.sort_string(mem_id) for mem_id in members.order] == members.sort_strings
+    assert index.sort_string('3', "own") > index.sort_string('1', "ada") # a match inside the name sorts after
+    monkeypatch.setitem(application.config, 'WTF_CSRF_ENABLED', False)
+    with application.test_request_context():
+        form = CheckinForm()
+        form.check_in_id.choices = members.choices(members.order, display_last=False)
+        html = form.check_in_id()
+    assert html.index('data-sort="0\nadams\neve\n5"') < html.index('data-sort="0\nadams\nzed\n1"')
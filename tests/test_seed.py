@@ -0,0 +1,22 @@
+# seeded check-ins must fit the unique key on (clubhouse, member, check-in time), otherwise flask seed and
+# the benchmarks built on it stop at the first repeated visit
+
+import random
+from datetime import date, datetime
+import pytest
+
+pytest.importorskip('flask')
+
+from application.seed import HOUR_WEIGHTS, checkin_rows
+
+def test_member_checkins_never_share_a_start():
+    rng = random.Random(1)
+    now = datetime(2026, 10, 18, 12, 0)
+    hours = [hour for hour, weight in HOUR_WEIGHTS]
+    hour_weights = []
+    for hour, weight in HOUR_WEIGHTS:
+        hour_weights.append(weight + (hour_weights[-1] if hour_weights else 0))
+    starts = [(member_id, checkin) for member_id in range(2000) # 2k members over 5 years
+              for member_id, checkin, checkout in checkin_rows(rng, member_id, date(2021, 10, 18), now, hours, hour_weights)]
+    assert len(starts) > 100000
+    assert len(set(starts)) == len(starts)
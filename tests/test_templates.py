@@ -0,0 +1,12 @@
+# every template must compile: Jinja rejects a block defined twice in one file, which only shows up when
+# that page is requested
+
+import pytest
+
+pytest.importorskip('flask')
+
+from application import application
+
+@pytest.mark.parametrize('name', [name for name in application.jinja_env.list_templates() if name.endswith('.html')])
+def test_template_compiles(name):
+    application.jinja_env.get_template(name)
@@ -0,0 +1,51 @@
+# cached users must follow invalidations made by any worker, and never answer with an old password hash
+
+import pytest
+
+pytest.importorskip('flask')
+
+from werkzeug.security import generate_password_hash
+from conftest import FakeConnection, database
+from application import cache
+from application.models import load_user
+
+class Logins:
+    def __init__(self):
+        self.hash = generate_password_hash('old')
+
+    def answer(self, query, args):
+        if 'FROM logins' in query:
+            return [(5, 'coord', self.hash, 7, 0, 1, "Seventh Clubhouse")]
+        return []
+
+@pytest.fixture
+def logins(monkeypatch):
+    monkeypatch.setattr(cache, 'shared_versions', cache.LocalVersions())
+    cache.user_cache.clear()
+    return Logins()
+
+def load(logins):
+    with database(FakeConnection(logins.answer)) as conn:
+        user = load_user('5')
+    return user, len(conn.statements)
+
+def test_cached_user_saves_the_login_query(logins):
+    assert load(logins)[1] == 1
+    user, queries = load(logins)
+    assert queries == 0 and user.club_id == 7
+
+def test_invalidation_by_another_worker_is_seen(logins):
+    load(logins)
+    cache.shared_versions.incr(cache.USERS_VERSION) # e.g. delete_clubhouse in another worker
+    assert load(logins)[1] == 1
+
+def test_password_is_checked_against_the_current_hash(logins):
+    user = load(logins)[0]
+    logins.hash = generate_password_hash('new') # changed by another worker
+    with database(FakeConnection(logins.answer)):
+        assert user.check_password('new') and not user.check_password('old')
+
+def test_users_are_not_cached_without_a_shared_version(logins, monkeypatch):
+    monkeypatch.setattr(cache, 'shared_versions', None)
+    load(logins)
+    assert load(logins)[1] == 1